@@ -36,6 +36,8 @@ from nova.api.openstack import faults
 
 LOG = logging.getLogger('nova.api.openstack')
 FLAGS = flags.FLAGS
+flags.DEFINE_integer('auth_token_ttl', 2 * 24 * 60 * 60,
+                     'Seconds an openstack api auth token stays valid')
 
 
 class AuthMiddleware(wsgi.Middleware):
@@ -49,6 +51,7 @@ class AuthMiddleware(wsgi.Middleware):
         super(AuthMiddleware, self).__init__(application)
 
     @webob.dec.wsgify(RequestClass=wsgi.Request)
+    @wsgi.timed('auth')
     def __call__(self, req):
         if not self.has_authentication(req):
             return self.authenticate(req)
@@ -67,13 +70,15 @@ class AuthMiddleware(wsgi.Middleware):
         else:
             return faults.Fault(webob.exc.HTTPUnauthorized())
 
-        if not self.auth.is_admin(user) and \
-           not self.auth.is_project_member(user, account):
+        is_admin = self.auth.is_admin(user)
+        if not is_admin and not self.auth.is_project_member(user, account):
             msg = _("%(user)s must be an admin or a member of %(account)s")
             LOG.warn(msg % locals())
             return faults.Fault(webob.exc.HTTPUnauthorized())
 
-        req.environ['nova.context'] = context.RequestContext(user, account)
+        request_id = req.environ.get('nova.request_id')
+        req.environ['nova.context'] = context.RequestContext(
+                user, account, request_id=request_id, is_admin=is_admin)
         return self.application
 
     def has_authentication(self, req):
@@ -121,8 +126,7 @@ class AuthMiddleware(wsgi.Middleware):
         If the token is not found, returns None
         Otherwise returns dict(id=(the authorized user's id))
 
-        This method will also remove the token if the timestamp is older than
-        2 days ago.
+        This method will also remove the token if it has expired.
         """
         ctxt = context.get_admin_context()
         try:
@@ -130,8 +134,7 @@ class AuthMiddleware(wsgi.Middleware):
         except exception.NotFound:
             return None
         if token:
-            delta = datetime.datetime.now() - token.created_at
-            if delta.days >= 2:
+            if not token.expires_at or token.expires_at <= utils.utcnow():
                 self.db.auth_token_destroy(ctxt, token.token_hash)
             else:
                 return self.auth.get_user(token.user_id)
@@ -162,6 +165,8 @@ class AuthMiddleware(wsgi.Middleware):
             token_dict['server_management_url'] = os_url
             token_dict['storage_url'] = ''
             token_dict['user_id'] = user.id
+            token_dict['expires_at'] = utils.utcnow() + \
+                    datetime.timedelta(seconds=FLAGS.auth_token_ttl)
             token = self.db.auth_token_create(ctxt, token_dict)
             return token, user
         elif user and user.name != username:
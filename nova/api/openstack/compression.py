@@ -0,0 +1,119 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Middleware compressing large OpenStack API responses with gzip or deflate.
+"""
+
+import itertools
+import zlib
+
+import webob.dec
+
+from nova import wsgi
+
+
+# zlib window bits selecting the gzip and zlib ("deflate") formats
+_WBITS = {'gzip': 16 + zlib.MAX_WBITS,
+          'deflate': zlib.MAX_WBITS}
+
+_COMPRESSIBLE_TYPES = ('application/json', 'application/xml', 'text/')
+
+
+class CompressionMiddleware(wsgi.Middleware):
+    """Compresses responses of at least min_size bytes.
+
+    min_size and the zlib compression level can be set in the filter's
+    section of api-paste.ini.  Clients choose gzip or deflate through
+    Accept-Encoding.  The body is compressed as it is sent, so a response
+    streamed from app_iter is never held in memory whole.  Only its first
+    min_size bytes are buffered, when its length is not known up front.
+
+    """
+
+    def __init__(self, application, min_size=1024, level=6):
+        super(CompressionMiddleware, self).__init__(application)
+        self.min_size = int(min_size)
+        self.level = int(level)
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, req):
+        response = req.get_response(self.application)
+        encoding = self._get_encoding(req, response)
+        if encoding is not None:
+            self._compress(response, encoding)
+        return response
+
+    def _get_encoding(self, req, response):
+        """Return the encoding to compress response with, if any."""
+        if 'Accept-Encoding' not in req.headers or req.method == 'HEAD':
+            return None
+        if response.status_int in (204, 304) or response.content_encoding:
+            return None
+        content_type = response.content_type or ''
+        if not content_type.startswith(_COMPRESSIBLE_TYPES):
+            return None
+        length = response.content_length
+        if length is not None and length < self.min_size:
+            return None
+        return req.accept_encoding.best_match(['gzip', 'deflate'])
+
+    def _compress(self, response, encoding):
+        """Replace the body of response by its compressed stream."""
+        app_iter = response.app_iter
+        head = []
+        size = 0
+        chunks = iter(app_iter)
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= self.min_size:
+                break
+        else:
+            # The whole body fit below the threshold, send it as it is
+            _close(app_iter)
+            response.body = ''.join(head)
+            return
+
+        response.app_iter = self._compress_iter(app_iter, head, chunks,
+                                                encoding)
+        response.content_length = None
+        response.content_encoding = encoding
+        vary = response.headers.get('Vary')
+        if vary:
+            response.headers['Vary'] = vary + ', Accept-Encoding'
+        else:
+            response.headers['Vary'] = 'Accept-Encoding'
+
+    def _compress_iter(self, app_iter, head, chunks, encoding):
+        """Yield the compressed head and remaining chunks of a body."""
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                      _WBITS[encoding])
+        try:
+            for chunk in itertools.chain(head, chunks):
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            yield compressor.flush()
+        finally:
+            _close(app_iter)
+
+
+def _close(app_iter):
+    """Close app_iter as the WSGI spec asks, if it can be closed."""
+    if hasattr(app_iter, 'close'):
+        app_iter.close()
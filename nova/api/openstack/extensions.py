@@ -279,8 +279,7 @@ class ExtensionMiddleware(wsgi.Middleware):
             controller = resp_controllers[response_ext.key]
             controller.add_handler(response_ext.handler)
 
-        self._router = routes.middleware.RoutesMiddleware(self._dispatch,
-                                                          mapper)
+        self._router = wsgi.RouteDispatcher(self._dispatch, mapper)
 
         super(ExtensionMiddleware, self).__init__(application)
 
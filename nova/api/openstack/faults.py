@@ -58,7 +58,8 @@ class Fault(webob.exc.HTTPException):
         # 'code' is an attribute on the fault tag itself
         metadata = {'application/xml': {'attributes': {fault_name: 'code'}}}
         default_xmlns = common.XML_NS_V10
-        serializer = wsgi.Serializer(metadata, default_xmlns)
+        serializer = wsgi.get_serializer((Fault, fault_name), metadata,
+                                         default_xmlns)
         content_type = req.best_match_content_type()
         self.wrapped_exc.body = serializer.serialize(fault_data, content_type)
         self.wrapped_exc.content_type = content_type
@@ -97,7 +98,8 @@ class OverLimitFault(webob.exc.HTTPException):
         Return the wrapped exception with a serialized body conforming to our
         error format.
         """
-        serializer = wsgi.Serializer(self._serialization_metadata)
+        serializer = wsgi.get_serializer(OverLimitFault,
+                                         self._serialization_metadata)
         content_type = request.best_match_content_type()
         content = serializer.serialize(self.content, content_type)
         self.wrapped_exc.body = content
@@ -19,6 +19,7 @@ import webob
 
 from nova import db
 from nova import exception
+from nova import wsgi
 from nova.api.openstack import common
 from nova.api.openstack import views
 
@@ -35,11 +36,13 @@ class Controller(common.OpenstackController):
         }
     }
 
+    @wsgi.conditional
     def index(self, req):
         """Return all flavors in brief."""
         items = self._get_flavors(req, is_detail=False)
         return dict(flavors=items)
 
+    @wsgi.conditional
     def detail(self, req):
         """Return all flavors in detail."""
         items = self._get_flavors(req, is_detail=True)
@@ -54,6 +57,7 @@ class Controller(common.OpenstackController):
                  for flavor in flavors.values()]
         return items
 
+    @wsgi.conditional
     def show(self, req, id):
         """Return data about the given flavor id."""
         try:
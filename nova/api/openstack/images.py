@@ -20,6 +20,7 @@ from nova import exception
 from nova import flags
 from nova import log
 from nova import utils
+from nova import wsgi
 from nova.api.openstack import common
 from nova.api.openstack import faults
 from nova.api.openstack.views import images as images_view
@@ -75,6 +76,7 @@ class Controller(common.OpenstackController):
         builder = self.get_builder(req).build
         return dict(images=[builder(image, detail=True) for image in images])
 
+    @wsgi.conditional
     def show(self, req, id):
         """Return detailed information about a specific image.
 
@@ -95,6 +97,8 @@ class Controller(common.OpenstackController):
             explanation = _("Image '%d' not found.") % (image_id)
             raise faults.Fault(webob.exc.HTTPNotFound(explanation=explanation))
 
+        req.environ['nova.last_modified'] = (image.get('updated_at') or
+                                             image.get('created_at'))
         return dict(image=self.get_builder(req).build(image, detail=True))
 
     def delete(self, req, id):
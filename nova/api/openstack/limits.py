@@ -60,6 +60,7 @@ class LimitsController(common.OpenstackController):
         },
     }
 
+    @wsgi.conditional
     def index(self, req):
         """
         Return all global and rate limit information.
@@ -213,6 +214,7 @@ class RateLimitingMiddleware(wsgi.Middleware):
         self._limiter = Limiter(limits or DEFAULT_LIMITS)
 
     @wsgify(RequestClass=wsgi.Request)
+    @wsgi.timed('ratelimit')
     def __call__(self, req):
         """
         Represents a single call through this middleware. We should record the
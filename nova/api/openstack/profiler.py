@@ -0,0 +1,172 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Middleware profiling single OpenStack API requests.
+"""
+
+import cProfile
+import os
+import random
+import time
+
+import webob.dec
+
+from nova import db
+from nova import flags
+from nova import log as logging
+from nova import rpc
+from nova import utils
+from nova import wsgi
+
+
+LOG = logging.getLogger('nova.api.openstack.profiler')
+FLAGS = flags.FLAGS
+flags.DEFINE_float('api_profile_sample_rate', 0.0,
+                   'Fraction of OpenStack API requests to profile')
+flags.DEFINE_string('api_profile_path', None,
+                    'Directory to write OpenStack API request profiles to, '
+                    'defaults to $state_path/profiles')
+
+
+class ProfilerMiddleware(wsgi.Middleware):
+    """Profiles requests and stores the profiles by request id.
+
+    A request is profiled when an admin sends it with an X-Profile header,
+    or at random for the fraction of requests set by
+    --api_profile_sample_rate.  Both can be used on a running server.
+
+    Each profile is written to --api_profile_path as <request id>.prof,
+    readable with pstats, next to <request id>.json which holds the wall
+    and cpu time of the request, up to its body being sent, and the db
+    statements and rpc messages it sent.  Statements are only counted with
+    --sql_query_stats.  Admin requests that asked for a profile get the
+    request id back in an X-Profile-Id header.
+
+    Has to sit after auth in the pipeline.  The profiler sees every green
+    thread that runs while it is on, so the profile of a request made
+    under load also holds calls of others, and its cpu time is that of the
+    whole process.  Its db and rpc counts are its own.
+
+    """
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, req):
+        context = req.environ.get('nova.context')
+        if context is None:
+            return req.get_response(self.application)
+
+        requested = 'X-Profile' in req.headers and context.is_admin
+        sample_rate = FLAGS.api_profile_sample_rate
+        if not requested and not (sample_rate and
+                                  random.random() < sample_rate):
+            return req.get_response(self.application)
+
+        response = self._profile(req, context)
+        if requested:
+            response.headers['X-Profile-Id'] = context.request_id
+        return response
+
+    def _profile(self, req, context):
+        """Run the request under the profiler, storing what was seen.
+
+        The body is profiled as it is sent, and the profile is stored once
+        it has been.
+
+        """
+        profiler = cProfile.Profile()
+        count_statements = FLAGS.sql_query_stats
+        if count_statements:
+            db.query_stats_begin(context)
+        rpc.stats_begin(context)
+        start = time.time()
+        cpu_start = _cpu_time()
+
+        def _finish(status):
+            """Stop counting, then store the profile and its summary."""
+            wall = time.time() - start
+            cpu = _cpu_time() - cpu_start
+            db_stats = count_statements and db.query_stats_end(context)
+            rpc_stats = rpc.stats_end(context)
+            summary = {'request_id': context.request_id,
+                       'method': req.method,
+                       'path': req.path_info,
+                       'status': status,
+                       'wall': wall,
+                       'cpu': cpu,
+                       'db': db_stats,
+                       'rpc': rpc_stats}
+            try:
+                self._save(profiler, summary)
+            except (IOError, OSError) as ex:
+                LOG.warn(_("Could not store profile of %(request_id)s: "
+                           "%(ex)s") % {'request_id': context.request_id,
+                                        'ex': ex})
+
+        try:
+            response = profiler.runcall(req.get_response, self.application)
+        except Exception:
+            if count_statements:
+                db.query_stats_end(context)
+            rpc.stats_end(context)
+            raise
+        status = response.status_int
+        response.app_iter = ProfiledBody(response.app_iter, profiler,
+                                         lambda: _finish(status))
+        return response
+
+    def _save(self, profiler, summary):
+        """Write the profile and its summary, named by request id."""
+        path = FLAGS.api_profile_path
+        if not path:
+            path = os.path.join(FLAGS.state_path, 'profiles')
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        basename = os.path.join(path, summary['request_id'])
+        profiler.dump_stats(basename + '.prof')
+        with open(basename + '.json', 'w') as summary_file:
+            summary_file.write(utils.dumps(summary))
+
+        statements = summary['db'] and summary['db']['count']
+        messages = summary['rpc'] and summary['rpc']['count']
+        LOG.info(_("Profiled %(method)s %(path)s [%(request_id)s] to "
+                   "%(basename)s.prof: %(wall).3fs wall, %(cpu).3fs cpu, "
+                   "%(statements)s statements, %(messages)s rpc messages")
+                 % dict(summary, basename=basename, statements=statements,
+                        messages=messages))
+
+
+class ProfiledBody(wsgi.FinishingBody):
+    """Response body profiling how each of its chunks is produced."""
+
+    def __init__(self, app_iter, profiler, finish):
+        super(ProfiledBody, self).__init__(app_iter, finish)
+        self.profiler = profiler
+
+    def _next_chunk(self, chunks):
+        self.profiler.enable()
+        try:
+            return chunks.next()
+        finally:
+            self.profiler.disable()
+
+
+def _cpu_time():
+    """Return the user and system cpu time used by the process."""
+    times = os.times()
+    return times[0] + times[1]
@@ -0,0 +1,63 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Middleware logging how many db statements each OpenStack API request ran.
+"""
+
+import webob.dec
+
+from nova import db
+from nova import flags
+from nova import log as logging
+from nova import wsgi
+
+
+LOG = logging.getLogger('nova.api.openstack.query_log')
+FLAGS = flags.FLAGS
+
+
+class QueryLogMiddleware(wsgi.Middleware):
+    """Logs a summary of the db statements run for each request.
+
+    Needs --sql_query_stats and has to sit after auth in the pipeline, since
+    statements are matched to the request by the request id of its context.
+
+    """
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, req):
+        context = req.environ.get('nova.context')
+        if not FLAGS.sql_query_stats or context is None:
+            return req.get_response(self.application)
+
+        db.query_stats_begin(context)
+        try:
+            return req.get_response(self.application)
+        finally:
+            stats = db.query_stats_end(context)
+            if stats:
+                functions = ', '.join(['%s=%d' % item for item in
+                                       sorted(stats['functions'].items())])
+                LOG.info(_("%(method)s %(path)s [%(request_id)s]: %(count)d "
+                           "statements in %(time).3fs (%(functions)s)")
+                         % {'method': req.method,
+                            'path': req.path_info,
+                            'request_id': context.request_id,
+                            'count': stats['count'],
+                            'time': stats['time'],
+                            'functions': functions})
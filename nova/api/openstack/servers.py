@@ -17,7 +17,6 @@ import base64
 import traceback
 
 from webob import exc
-from xml.dom import minidom
 
 from nova import compute
 from nova import exception
@@ -25,6 +24,7 @@ from nova import flags
 from nova import log as logging
 from nova import quota
 from nova import utils
+from nova import wsgi
 from nova.api.openstack import common
 from nova.api.openstack import faults
 import nova.api.openstack.views.addresses
@@ -84,9 +84,10 @@ class Controller(common.OpenstackController):
         limited_list = self._limit_items(instance_list, req)
         builder = self._get_view_builder(req)
         servers = [builder.build(inst, is_detail)['server']
-                for inst in limited_list]
+                   for inst in limited_list]
         return dict(servers=servers)
 
+    @wsgi.conditional
     @scheduler_api.redirect_handler
     def show(self, req, id):
         """ Returns server details by server id """
@@ -187,7 +188,10 @@ class Controller(common.OpenstackController):
         """
         if request.content_type == "application/xml":
             deserializer = ServerCreateRequestXMLDeserializer()
-            return deserializer.deserialize(request.body)
+            try:
+                return deserializer.deserialize(request.body)
+            except exception.MalformedRequestBody as ex:
+                raise exc.HTTPBadRequest(explanation=str(ex))
         else:
             return self._deserialize(request.body, request.get_content_type())
 
@@ -735,16 +739,18 @@ class ServerCreateRequestXMLDeserializer(object):
 
     def deserialize(self, string):
         """Deserialize an xml-formatted server create request"""
-        dom = minidom.parseString(string)
-        server = self._extract_server(dom)
+        server_node = wsgi.parse_xml(string)
+        if server_node.name != 'server':
+            reason = _("expected a server element")
+            raise exception.MalformedRequestBody(reason=reason)
+        server = self._extract_server(server_node)
         return {'server': server}
 
-    def _extract_server(self, node):
+    def _extract_server(self, server_node):
         """Marshal the server attribute of a parsed request"""
         server = {}
-        server_node = self._find_first_child_named(node, 'server')
         for attr in ["name", "imageId", "flavorId"]:
-            server[attr] = server_node.getAttribute(attr)
+            server[attr] = server_node.attributes.get(attr, "")
         metadata = self._extract_metadata(server_node)
         if metadata is not None:
             server["metadata"] = metadata
@@ -760,7 +766,7 @@ class ServerCreateRequestXMLDeserializer(object):
             return None
         metadata = {}
         for meta_node in self._find_children_named(metadata_node, "meta"):
-            key = meta_node.getAttribute("key")
+            key = meta_node.attributes.get("key", "")
             metadata[key] = self._extract_text(meta_node)
         return metadata
 
@@ -773,29 +779,29 @@ class ServerCreateRequestXMLDeserializer(object):
         personality = []
         for file_node in self._find_children_named(personality_node, "file"):
             item = {}
-            if file_node.hasAttribute("path"):
-                item["path"] = file_node.getAttribute("path")
+            if "path" in file_node.attributes:
+                item["path"] = file_node.attributes["path"]
             item["contents"] = self._extract_text(file_node)
             personality.append(item)
         return personality
 
     def _find_first_child_named(self, parent, name):
         """Search a nodes children for the first child with a given name"""
-        for node in parent.childNodes:
-            if node.nodeName == name:
+        for node in parent.children:
+            if not isinstance(node, basestring) and node.name == name:
                 return node
         return None
 
     def _find_children_named(self, parent, name):
         """Return all of a nodes children who have the given name"""
-        for node in parent.childNodes:
-            if node.nodeName == name:
+        for node in parent.children:
+            if not isinstance(node, basestring) and node.name == name:
                 yield node
 
     def _extract_text(self, node):
         """Get the text field contained by the given node"""
-        if len(node.childNodes) == 1:
-            child = node.childNodes[0]
-            if child.nodeType == child.TEXT_NODE:
-                return child.nodeValue
+        if len(node.children) == 1:
+            child = node.children[0]
+            if isinstance(child, basestring):
+                return child
         return ""
@@ -0,0 +1,145 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Middleware breaking down the latency of each OpenStack API request.
+"""
+
+import time
+
+import webob.dec
+import webob.exc
+
+from nova import context
+from nova import db
+from nova import flags
+from nova import log as logging
+from nova import rpc
+from nova import wsgi
+
+
+LOG = logging.getLogger('nova.api.openstack.timing')
+FLAGS = flags.FLAGS
+
+# Phases timed through wsgi.add_timing, in the order they are reported
+PHASES = ('auth', 'ratelimit', 'routing', 'controller', 'serialization')
+
+
+class TimingMiddleware(wsgi.Middleware):
+    """Logs one access line per request with the time spent in each phase.
+
+    The phases are auth, rate limiting, routing, the controller action and
+    serialization, followed by the db statements (with --sql_query_stats)
+    and rpc messages of the request.  Serialization includes producing the
+    body as it is sent, and with it any items a controller builds lazily.
+    db and rpc time overlap the phases they happen in.  The line is logged
+    once the body has been sent, or dropped unsent.
+
+    Admins sending an X-Timing header get the same breakdown back in an
+    X-Timing response header.  Their body is read before the response is
+    returned, so its serialization can be reported.
+
+    Has to sit before auth in the pipeline.  It picks the request id, which
+    auth then gives the request's context.
+
+    """
+
+    @webob.dec.wsgify(RequestClass=wsgi.Request)
+    def __call__(self, req):
+        start = time.time()
+        request_id = context.generate_request_id()
+        req.environ['nova.request_id'] = request_id
+        req.environ['nova.timings'] = {}
+        # stands for the request in db and rpc stats until auth makes its
+        # context, with the same request id
+        stats_key = _StatsKey(request_id)
+        count_statements = FLAGS.sql_query_stats
+        if count_statements:
+            db.query_stats_begin(stats_key)
+        rpc.stats_begin(stats_key)
+
+        def _finish(status):
+            """Stop counting, then log the access line and return it."""
+            db_stats = count_statements and db.query_stats_end(stats_key)
+            rpc_stats = rpc.stats_end(stats_key)
+            timing = self._format(time.time() - start,
+                                  req.environ['nova.timings'], db_stats,
+                                  rpc_stats)
+            LOG.info(_("%(method)s %(path)s %(status)d [%(request_id)s] "
+                       "%(timing)s")
+                     % {'method': req.method,
+                        'path': req.path_info,
+                        'status': status,
+                        'request_id': request_id,
+                        'timing': timing})
+            return timing
+
+        try:
+            response = req.get_response(self.application)
+        except Exception:
+            _finish(webob.exc.HTTPInternalServerError.code)
+            raise
+
+        status = response.status_int
+        user_context = req.environ.get('nova.context')
+        if ('X-Timing' in req.headers and user_context is not None and
+            user_context.is_admin):
+            timings = []
+            body = TimedBody(response.app_iter, req.environ,
+                             lambda: timings.append(_finish(status)))
+            response.body = ''.join(body)
+            body.close()
+            response.headers['X-Timing'] = timings[0]
+        else:
+            response.app_iter = TimedBody(response.app_iter, req.environ,
+                                          lambda: _finish(status))
+        return response
+
+    def _format(self, total, timings, db_stats, rpc_stats):
+        """Return the breakdown of a request as name=value pairs."""
+        parts = ['total=%.4f' % total]
+        for phase in PHASES:
+            parts.append('%s=%.4f' % (phase, timings.get(phase, 0.0)))
+        if db_stats:
+            parts.append('db=%.4f db_statements=%d' % (db_stats['time'],
+                                                       db_stats['count']))
+        if rpc_stats:
+            parts.append('rpc=%.4f rpc_messages=%d' % (rpc_stats['time'],
+                                                       rpc_stats['count']))
+        return ' '.join(parts)
+
+
+class TimedBody(wsgi.FinishingBody):
+    """Response body that times producing each chunk as serialization."""
+
+    def __init__(self, app_iter, environ, finish):
+        super(TimedBody, self).__init__(app_iter, finish)
+        self.environ = environ
+
+    def _next_chunk(self, chunks):
+        start = time.time()
+        try:
+            return chunks.next()
+        finally:
+            wsgi.add_timing(self.environ, 'serialization', start)
+
+
+class _StatsKey(object):
+    """Request id the db and rpc stats of a request are kept by."""
+
+    def __init__(self, request_id):
+        self.request_id = request_id
@@ -51,7 +51,8 @@ class Versions(wsgi.Application):
         }
 
         content_type = req.best_match_content_type()
-        body = wsgi.Serializer(metadata).serialize(response, content_type)
+        serializer = wsgi.get_serializer(Versions, metadata)
+        body = serializer.serialize(response, content_type)
 
         response = webob.Response()
         response.content_type = content_type
@@ -112,11 +112,11 @@ class ViewBuilderV10(ViewBuilder):
     """Model an Openstack API V1.0 server response."""
 
     def _build_image(self, response, inst):
-        if 'image_id' in dict(inst):
+        if 'image_id' in inst:
             response['imageId'] = inst['image_id']
 
     def _build_flavor(self, response, inst):
-        if 'instance_type' in dict(inst):
+        if 'instance_type' in inst:
             response['flavorId'] = inst['instance_type']['flavorid']
 
 
@@ -130,12 +130,12 @@ class ViewBuilderV11(ViewBuilder):
         self.base_url = base_url
 
     def _build_image(self, response, inst):
-        if "image_id" in dict(inst):
+        if "image_id" in inst:
             image_id = inst.get("image_id")
             response["imageRef"] = self.image_builder.generate_href(image_id)
 
     def _build_flavor(self, response, inst):
-        if "instance_type" in dict(inst):
+        if "instance_type" in inst:
             flavor_id = inst["instance_type"]['flavorid']
             flavor_ref = self.flavor_builder.generate_href(flavor_id)
             response["flavorRef"] = flavor_ref
@@ -25,6 +25,12 @@ from nova import exception
 from nova import utils
 
 
+def generate_request_id():
+    """Return a random id for a new request."""
+    chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890-'
+    return ''.join([random.choice(chars) for x in xrange(20)])
+
+
 class RequestContext(object):
     """Security context and request information.
 
@@ -33,9 +39,10 @@ class RequestContext(object):
     """
 
     def __init__(self, tenant, user, groups=None, remote_address=None,
-                 timestamp=None, request_id=None):
+                 timestamp=None, request_id=None, is_admin=False):
         self.user = user
         self.tenant = tenant
+        self.is_admin = is_admin
         self.groups = groups and groups or []
         self.remote_address = remote_address
         if not timestamp:
@@ -44,8 +51,7 @@ class RequestContext(object):
             timestamp = utils.parse_isotime(timestamp)
         self.timestamp = timestamp
         if not request_id:
-            chars = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890-'
-            request_id = ''.join([random.choice(chars) for x in xrange(20)])
+            request_id = generate_request_id()
         self.request_id = request_id
 
     def to_dict(self):
@@ -54,7 +60,8 @@ class RequestContext(object):
                 'groups': self.groups,
                 'remote_address': self.remote_address,
                 'timestamp': utils.isotime(self.timestamp),
-                'request_id': self.request_id}
+                'request_id': self.request_id,
+                'is_admin': self.is_admin}
 
     @classmethod
     def from_dict(cls, values):
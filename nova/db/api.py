@@ -31,6 +31,12 @@ The underlying driver is loaded as a :class:`LazyPluggable`.
 :enable_new_services:  when adding a new service to the database, is it in the
                        pool of available hardware (Default: True)
 
+:sql_query_stats:  count statements and their time per db api function and
+                   per request (Default: False)
+
+:sql_slow_query_threshold:  log statements slower than this many seconds
+                            along with their parameters (Default: 0, off)
+
 """
 
 from nova import exception
@@ -47,6 +53,26 @@ flags.DEFINE_string('instance_name_template', 'instance-%08x',
                     'Template string to be used to generate instance names')
 flags.DEFINE_string('volume_name_template', 'volume-%08x',
                     'Template string to be used to generate instance names')
+flags.DEFINE_integer('db_bulk_chunk_size', 1000,
+                     'Number of rows sent per statement by bulk db calls')
+flags.DEFINE_integer('db_allocation_window', 16,
+                     'Number of free rows considered per allocation attempt')
+flags.DEFINE_integer('db_allocation_attempts', 8,
+                     'Attempts to claim a free row before giving up')
+flags.DEFINE_integer('db_update_attempts', 5,
+                     'Attempts at a versioned update before giving up, see '
+                     'update_with_retry')
+flags.DEFINE_integer('reservation_expire', 86400,
+                     'Seconds until unused quota reservations can be '
+                     'expired')
+flags.DEFINE_integer('instance_type_cache_ttl', 300,
+                     'Seconds to cache instance types for, 0 disables')
+flags.DEFINE_boolean('sql_query_stats', False,
+                     'Count statements and time per db api function and '
+                     'per request')
+flags.DEFINE_float('sql_slow_query_threshold', 0.0,
+                   'Log statements slower than this many seconds with their '
+                   'parameters, 0 disables')
 
 
 IMPL = utils.LazyPluggable(FLAGS['db_backend'],
@@ -73,6 +99,24 @@ class NoMoreTargets(exception.Error):
     pass
 
 
+def update_with_retry(get, update, attempts=None):
+    """Retry a versioned update until it applies to a fresh read.
+
+    get() reads the current row and update(row) applies the change with
+    expected_version=row['version'], recomputing values from row as it
+    needs to.  The pair is retried on UpdateConflict, up to attempts or
+    FLAGS.db_update_attempts times.  Returns what update returned.
+
+    """
+    attempts = attempts or FLAGS.db_update_attempts
+    for attempt in xrange(attempts):
+        try:
+            return update(get())
+        except exception.UpdateConflict:
+            if attempt == attempts - 1:
+                raise
+
+
 ###################
 
 
@@ -148,13 +192,16 @@ def service_create(context, values):
     return IMPL.service_create(context, values)
 
 
-def service_update(context, service_id, values):
+def service_update(context, service_id, values, expected_version=None):
     """Set the given properties on an service and update it.
 
-    Raises NotFound if service does not exist.
+    Raises NotFound if service does not exist.  If expected_version is given
+    the update is only applied if the row is still at that version, else
+    UpdateConflict is raised, and the new version is returned.
 
     """
-    return IMPL.service_update(context, service_id, values)
+    return IMPL.service_update(context, service_id, values,
+                               expected_version)
 
 
 ###################
@@ -170,14 +217,16 @@ def compute_node_create(context, values):
     return IMPL.compute_node_create(context, values)
 
 
-def compute_node_update(context, compute_id, values):
+def compute_node_update(context, compute_id, values, expected_version=None):
     """Set the given properties on an computeNode and update it.
 
-    Raises NotFound if computeNode does not exist.
+    Raises NotFound if computeNode does not exist.  If expected_version is
+    given the update is only applied if the row is still at that version,
+    else UpdateConflict is raised, and the new version is returned.
 
     """
-
-    return IMPL.compute_node_update(context, compute_id, values)
+    return IMPL.compute_node_update(context, compute_id, values,
+                                    expected_version)
 
 
 ###################
@@ -236,6 +285,20 @@ def floating_ip_create(context, values):
     return IMPL.floating_ip_create(context, values)
 
 
+def floating_ip_bulk_create(context, ips):
+    """Create floating ips from a list of values dictionaries.
+
+    All rows are inserted in a single transaction.
+
+    """
+    return IMPL.floating_ip_bulk_create(context, ips)
+
+
+def floating_ip_bulk_destroy(context, addresses):
+    """Destroy the floating ips with the given addresses."""
+    return IMPL.floating_ip_bulk_destroy(context, addresses)
+
+
 def floating_ip_count_by_project(context, project_id):
     """Count floating ips used by project."""
     return IMPL.floating_ip_count_by_project(context, project_id)
@@ -345,6 +408,15 @@ def fixed_ip_create(context, values):
     return IMPL.fixed_ip_create(context, values)
 
 
+def fixed_ip_bulk_create(context, ips):
+    """Create fixed ips from a list of values dictionaries.
+
+    All rows are inserted in a single transaction.
+
+    """
+    return IMPL.fixed_ip_bulk_create(context, ips)
+
+
 def fixed_ip_disassociate(context, address):
     """Disassociate a fixed ip from an instance by address."""
     return IMPL.fixed_ip_disassociate(context, address)
@@ -360,6 +432,16 @@ def fixed_ip_get_all(context):
     return IMPL.fixed_ip_get_all(context)
 
 
+def fixed_ip_get_all_iter(context, host=None):
+    """Iterate over all defined fixed ips, optionally only on host.
+
+    Rows are fetched in chunks as the iterator is consumed instead of
+    being loaded all at once.
+
+    """
+    return IMPL.fixed_ip_get_all_iter(context, host)
+
+
 def fixed_ip_get_all_by_host(context, host):
     """Get all defined fixed ips used by a host."""
     return IMPL.fixed_ip_get_all_by_host(context, host)
@@ -422,6 +504,16 @@ def instance_get_all(context):
     return IMPL.instance_get_all(context)
 
 
+def instance_get_all_iter(context, host=None):
+    """Iterate over all instances, optionally only on host.
+
+    Instances are fetched in chunks as the iterator is consumed instead
+    of being loaded all at once.
+
+    """
+    return IMPL.instance_get_all_iter(context, host)
+
+
 def instance_get_all_by_user(context, user_id):
     """Get all instances."""
     return IMPL.instance_get_all_by_user(context, user_id)
@@ -466,13 +558,16 @@ def instance_set_state(context, instance_id, state, description=None):
     return IMPL.instance_set_state(context, instance_id, state, description)
 
 
-def instance_update(context, instance_id, values):
+def instance_update(context, instance_id, values, expected_version=None):
     """Set the given properties on an instance and update it.
 
-    Raises NotFound if instance does not exist.
+    Raises NotFound if instance does not exist.  If expected_version is given
+    the update is only applied if the row is still at that version, else
+    UpdateConflict is raised, and the new version is returned.
 
     """
-    return IMPL.instance_update(context, instance_id, values)
+    return IMPL.instance_update(context, instance_id, values,
+                                expected_version)
 
 
 def instance_add_security_group(context, instance_id, security_group_id):
@@ -502,6 +597,17 @@ def instance_get_disk_sum_by_host_and_project(context, hostname, proj_id):
                                                           proj_id)
 
 
+def instance_get_usage_by_host(context, project_id=None, by_project=False):
+    """Get instance count, vcpus, memory_mb and local_gb totals per host.
+
+    Totals are computed in a single query.  The result is keyed by host, or
+    by (host, project_id) if by_project is set; project_id restricts the
+    totals to one project.
+
+    """
+    return IMPL.instance_get_usage_by_host(context, project_id, by_project)
+
+
 def instance_action_create(context, values):
     """Create an instance action from the values dictionary."""
     return IMPL.instance_action_create(context, values)
@@ -612,6 +718,11 @@ def network_get_all(context):
     return IMPL.network_get_all(context)
 
 
+def network_get_all_iter(context):
+    """Iterate over all defined networks, fetching them in chunks."""
+    return IMPL.network_get_all_iter(context)
+
+
 # pylint: disable=C0103
 def network_get_associated_fixed_ips(context, network_id):
     """Get all network's ips that have been associated."""
@@ -753,6 +864,11 @@ def auth_token_create(context, token):
     return IMPL.auth_token_create(context, token)
 
 
+def auth_token_destroy_expired(context):
+    """Removes all expired tokens and returns how many were removed."""
+    return IMPL.auth_token_destroy_expired(context)
+
+
 ###################
 
 
@@ -776,6 +892,51 @@ def quota_destroy(context, project_id):
     return IMPL.quota_destroy(context, project_id)
 
 
+def quota_usage_get_all_by_project(context, project_id):
+    """Get what a project uses and has reserved of each resource.
+
+    Returns {resource: {'in_use': n, 'reserved': n}} for instances, cores,
+    volumes, gigabytes and floating_ips.  in_use is kept up to date by the
+    calls creating and destroying those, so this is a single indexed read
+    once a project's usage has been counted the first time.
+
+    """
+    return IMPL.quota_usage_get_all_by_project(context, project_id)
+
+
+def quota_usage_refresh(context, project_id):
+    """Recount what a project uses from the live tables."""
+    return IMPL.quota_usage_refresh(context, project_id)
+
+
+def quota_reserve(context, project_id, deltas, limits, expire=None):
+    """Reserve quota for resources about to be created.
+
+    deltas and limits are keyed by resource, a limit of None or below 0 is
+    unlimited.  Either every positive delta fits in its limit next to what
+    is in use and already reserved and is reserved, or OverQuota is raised
+    and nothing is.  Returns reservation ids to pass to reservation_commit
+    once the resources exist, or to reservation_rollback.
+
+    """
+    return IMPL.quota_reserve(context, project_id, deltas, limits, expire)
+
+
+def reservation_commit(context, reservation_ids):
+    """Release reservations whose resources have been created."""
+    return IMPL.reservation_commit(context, reservation_ids)
+
+
+def reservation_rollback(context, reservation_ids):
+    """Release reservations whose resources will not be created."""
+    return IMPL.reservation_rollback(context, reservation_ids)
+
+
+def reservation_expire(context):
+    """Release reservations past their expire time, return how many."""
+    return IMPL.reservation_expire(context)
+
+
 ###################
 
 
@@ -930,6 +1091,20 @@ def security_group_rule_get_by_security_group(context, security_group_id):
                                                           security_group_id)
 
 
+def security_group_rule_get_by_instances(context, instance_ids=None,
+                                         host=None):
+    """Get the rules of the security groups of many instances at once.
+
+    Takes a list of instance ids, or a host to use all of its instances.
+    Returns {instance_id: [rule]} built from one query for group membership
+    and one for rules, with each rule a read-only record shared by every
+    instance in its group.  Instances in no group are left out.
+
+    """
+    return IMPL.security_group_rule_get_by_instances(context, instance_ids,
+                                                     host)
+
+
 def security_group_rule_get_by_security_group_grantee(context,
                                                       security_group_id):
     """Get all rules that grant access to the given security group."""
@@ -975,6 +1150,11 @@ def user_get_all(context):
     return IMPL.user_get_all(context)
 
 
+def user_get_all_iter(context):
+    """Iterate over all users, fetching them in chunks."""
+    return IMPL.user_get_all_iter(context)
+
+
 def user_add_role(context, user_id, role):
     """Add another global role for user."""
     return IMPL.user_add_role(context, user_id, role)
@@ -1154,6 +1334,16 @@ def instance_type_purge(context, name):
     return IMPL.instance_type_purge(context, name)
 
 
+def instance_type_cache_stats(context):
+    """Get hit and miss counters of the instance type cache."""
+    return IMPL.instance_type_cache_stats(context)
+
+
+def instance_type_cache_clear(context):
+    """Drop every cached instance type, so the next reads go to the db."""
+    return IMPL.instance_type_cache_clear(context)
+
+
 ####################
 
 
@@ -1190,11 +1380,52 @@ def instance_metadata_get(context, instance_id):
     return IMPL.instance_metadata_get(context, instance_id)
 
 
+def instance_metadata_get_all_by_instances(context, instance_ids):
+    """Get metadata for many instances as a dict keyed by instance id."""
+    return IMPL.instance_metadata_get_all_by_instances(context, instance_ids)
+
+
 def instance_metadata_delete(context, instance_id, key):
     """Delete the given metadata item."""
     IMPL.instance_metadata_delete(context, instance_id, key)
 
 
 def instance_metadata_update_or_create(context, instance_id, metadata):
-    """Create or update instance metadata."""
+    """Create or update instance metadata in a single transaction."""
     IMPL.instance_metadata_update_or_create(context, instance_id, metadata)
+
+
+####################
+
+
+def archive_deleted_rows(context, days, max_rows=None):
+    """Move rows soft deleted more than days ago into the shadow tables.
+
+    Stops after max_rows rows if given.  Returns a dict of the number of
+    rows moved keyed by table name.
+
+    """
+    return IMPL.archive_deleted_rows(context, days, max_rows)
+
+
+####################
+
+
+def query_stats_begin(context):
+    """Start counting the statements run for the request of context."""
+    return IMPL.query_stats_begin(context)
+
+
+def query_stats_get(context):
+    """Get statement count and time collected for the request so far."""
+    return IMPL.query_stats_get(context)
+
+
+def query_stats_end(context):
+    """Stop counting for the request and return what was collected."""
+    return IMPL.query_stats_end(context)
+
+
+def query_stats_get_by_function(context):
+    """Get statement count and time keyed by db api function."""
+    return IMPL.query_stats_get_by_function(context)
@@ -38,3 +38,8 @@ def db_sync(version=None):
 def db_version():
     """Display the current database version."""
     return IMPL.db_version()
+
+
+def db_check():
+    """List differences between the migrated and the model schema."""
+    return IMPL.db_check()
@@ -20,23 +20,33 @@ Implementation of SQLAlchemy backend.
 """
 
 import datetime
+import random
+import uuid
 import warnings
 
 from nova import db
 from nova import exception
 from nova import flags
+from nova import log as logging
 from nova import utils
 from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import query_stats
+from nova.db.sqlalchemy import records
 from nova.db.sqlalchemy.session import get_session
+from sqlalchemy import and_
 from sqlalchemy import or_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import joinedload
 from sqlalchemy.orm import joinedload_all
+from sqlalchemy.sql import bindparam
 from sqlalchemy.sql import exists
 from sqlalchemy.sql import func
+from sqlalchemy.sql import select
 from sqlalchemy.sql.expression import literal_column
 
 FLAGS = flags.FLAGS
+LOG = logging.getLogger('nova.db.sqlalchemy.api')
 
 
 def is_admin_context(context):
@@ -110,6 +120,157 @@ def require_context(f):
     return wrapper
 
 
+def _bulk_insert(session, model, rows):
+    """Insert rows into the table of model using executemany.
+
+    Rows are sent in chunks of FLAGS.db_bulk_chunk_size so a large range
+    does not build one enormous statement.  Rows sharing the same keys are
+    sent together; column defaults are applied by the table as usual.
+
+    """
+    table = model.__table__
+    chunk_size = max(FLAGS.db_bulk_chunk_size, 1)
+    for start in xrange(0, len(rows), chunk_size):
+        by_keys = {}
+        for row in rows[start:start + chunk_size]:
+            by_keys.setdefault(tuple(sorted(row.keys())), []).append(row)
+        for same_keys in by_keys.itervalues():
+            session.execute(table.insert(), same_keys)
+
+
+def _stream(query):
+    """Yield the rows of query as they are fetched.
+
+    Rows are built FLAGS.db_bulk_chunk_size at a time from a server side
+    cursor where the driver has one, so memory stays bounded however many
+    rows match.  Only use this for queries whose eager loads are many to
+    one; a joined collection could be split between two chunks.
+
+    """
+    return iter(query.yield_per(max(FLAGS.db_bulk_chunk_size, 1)))
+
+
+def _stream_by_id(query, model):
+    """Yield the rows of query in pages of FLAGS.db_bulk_chunk_size.
+
+    Each page is a separate query for the rows with an id above the last
+    one seen, so joined collections stay whole and every page is released
+    before the next one is loaded.
+
+    """
+    chunk_size = max(FLAGS.db_bulk_chunk_size, 1)
+    last_id = None
+    while True:
+        page = query
+        if last_id is not None:
+            page = page.filter(model.id > last_id)
+        rows = page.order_by(model.id).limit(chunk_size).all()
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1].id
+        del rows
+
+
+def _versioned_update(session, model, row_id, values, version, not_found,
+                      *criteria):
+    """Apply values to a row only if it is still at the given version.
+
+    Runs a single UPDATE ... WHERE id = ? AND version = ? that also bumps
+    the version, so there is one round trip and no row lock.  Only if no
+    row matched does a second query tell a missing row, for which
+    not_found is raised, from a conflicting update.  Returns the new
+    version.
+
+    """
+    table = model.__table__
+    where = and_(table.c.id == row_id, *criteria)
+    values = dict(values)
+    values['version'] = version + 1
+    result = session.execute(table.update().\
+                                   where(and_(where,
+                                              table.c.version == version)).\
+                                   values(**values))
+    if not result.rowcount:
+        if session.execute(select([table.c.id], where)).first() is None:
+            raise not_found
+        raise exception.UpdateConflict(table=table.name, id=row_id,
+                                       version=version)
+    return version + 1
+
+
+def _bump_version(model_ref):
+    """Bump the version of a row updated through the ORM."""
+    model_ref.version = (model_ref.version or 0) + 1
+
+
+def _allocate_free_row(session, model, free, values, claimed=None):
+    """Claim a free row of model by setting values on it.
+
+    free is a clause matching unallocated rows.  Candidates are read
+    without locks starting at a random id, so concurrent allocators
+    spread over the free rows instead of queueing on the first one, and
+    each candidate is claimed with an UPDATE that only matches while the
+    row is still free.  A row taken by somebody else in between is
+    skipped, which keeps this correct on backends without SELECT ... FOR
+    UPDATE such as sqlite.
+
+    Every claim commits on its own, so session must not be inside a
+    transaction: losers would otherwise hold their locks while retrying.
+    claimed, if given, is called with session and the row in the claim's
+    transaction, so what it writes commits or rolls back with the claim.
+
+    Returns the claimed row or None if no free row could be claimed.
+
+    """
+    table = model.__table__
+    free = and_(table.c.deleted == False, free)
+    window = max(FLAGS.db_allocation_window, 1)
+    free_rows = select([table]).order_by(table.c.id)
+    for _attempt in xrange(max(FLAGS.db_allocation_attempts, 1)):
+        low, high = session.execute(select([func.min(table.c.id),
+                                            func.max(table.c.id)])).first()
+        if low is None:
+            return None
+        pivot = random.randint(low, high)
+        above = free_rows.where(and_(free, table.c.id >= pivot)).limit(window)
+        candidates = session.execute(above).fetchall()
+        if len(candidates) < window:
+            below = free_rows.where(and_(free, table.c.id < pivot)).\
+                             limit(window - len(candidates))
+            candidates += session.execute(below).fetchall()
+        if not candidates:
+            return None
+        random.shuffle(candidates)
+        for candidate in candidates:
+            claim = table.update().\
+                          where(and_(free, table.c.id == candidate['id'])).\
+                          values(**values)
+            try:
+                with session.begin():
+                    if session.execute(claim).rowcount != 1:
+                        continue
+                    if claimed is not None:
+                        claimed(session, candidate)
+                return candidate
+            except OperationalError as ex:
+                # sqlite gives up on a busy database after its timeout,
+                # which is just another lost race for this candidate
+                if not _is_db_locked(ex):
+                    raise
+                LOG.debug(_('Database locked claiming %(table)s %(id)s')
+                          % {'table': table.name, 'id': candidate['id']})
+    return None
+
+
+def _is_db_locked(error):
+    """Whether an OperationalError is sqlite's busy database timeout."""
+    message = str(error.orig)
+    return ('database is locked' in message or
+            'database table is locked' in message)
+
+
 ###################
 
 @require_admin_context
@@ -215,27 +376,23 @@ def _service_get_all_topic_subquery(context, session, topic, subq, label):
 
 @require_admin_context
 def service_get_all_compute_sorted(context):
+    """Return (service, instance cores) pairs sorted by cores.
+
+    The cores come from instance_get_usage_by_host, the same per host
+    totals the other capacity checks read.
+
+    """
     session = get_session()
-    with session.begin():
-        # NOTE(vish): The intended query is below
-        #             SELECT services.*, COALESCE(inst_cores.instance_cores,
-        #                                         0)
-        #             FROM services LEFT OUTER JOIN
-        #             (SELECT host, SUM(instances.vcpus) AS instance_cores
-        #              FROM instances GROUP BY host) AS inst_cores
-        #             ON services.host = inst_cores.host
-        topic = 'compute'
-        label = 'instance_cores'
-        subq = session.query(models.Instance.host,
-                             func.sum(models.Instance.vcpus).label(label)).\
+    services = session.query(models.Service).\
+                       filter_by(topic='compute').\
                        filter_by(deleted=False).\
-                       group_by(models.Instance.host).\
-                       subquery()
-        return _service_get_all_topic_subquery(context,
-                                               session,
-                                               topic,
-                                               subq,
-                                               label)
+                       filter_by(disabled=False).\
+                       all()
+    usage = instance_get_usage_by_host(context)
+    result = [(service, usage.get(service.host, {}).get('vcpus', 0))
+              for service in services]
+    result.sort(key=lambda pair: pair[1])
+    return result
 
 
 @require_admin_context
@@ -299,11 +456,17 @@ def service_create(context, values):
 
 
 @require_admin_context
-def service_update(context, service_id, values):
+def service_update(context, service_id, values, expected_version=None):
     session = get_session()
+    if expected_version is not None:
+        return _versioned_update(session, models.Service, service_id,
+                    values, expected_version,
+                    exception.ServiceNotFound(service_id=service_id),
+                    models.Service.deleted == can_read_deleted(context))
     with session.begin():
         service_ref = service_get(context, service_id, session=session)
         service_ref.update(values)
+        _bump_version(service_ref)
         service_ref.save(session=session)
 
 
@@ -335,11 +498,17 @@ def compute_node_create(context, values):
 
 
 @require_admin_context
-def compute_node_update(context, compute_id, values):
+def compute_node_update(context, compute_id, values, expected_version=None):
     session = get_session()
+    if expected_version is not None:
+        return _versioned_update(session, models.ComputeNode, compute_id,
+                    values, expected_version,
+                    exception.ComputeHostNotFound(host=compute_id),
+                    models.ComputeNode.deleted == can_read_deleted(context))
     with session.begin():
         compute_ref = compute_node_get(context, compute_id, session=session)
         compute_ref.update(values)
+        _bump_version(compute_ref)
         compute_ref.save(session=session)
 
 
@@ -427,22 +596,21 @@ def certificate_update(context, certificate_id, values):
 @require_context
 def floating_ip_allocate_address(context, host, project_id):
     authorize_project_context(context, project_id)
+    table = models.FloatingIp.__table__
+
+    def _count_usage(session, floating_ip):
+        _quota_usage_adjust(session, project_id, {'floating_ips': 1})
+
     session = get_session()
-    with session.begin():
-        floating_ip_ref = session.query(models.FloatingIp).\
-                                  filter_by(host=host).\
-                                  filter_by(fixed_ip_id=None).\
-                                  filter_by(project_id=None).\
-                                  filter_by(deleted=False).\
-                                  with_lockmode('update').\
-                                  first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not floating_ip_ref:
-            raise db.NoMoreAddresses()
-        floating_ip_ref['project_id'] = project_id
-        session.add(floating_ip_ref)
-    return floating_ip_ref['address']
+    floating_ip = _allocate_free_row(session, models.FloatingIp,
+                                     and_(table.c.host == host,
+                                          table.c.fixed_ip_id == None,
+                                          table.c.project_id == None),
+                                     {'project_id': project_id},
+                                     _count_usage)
+    if not floating_ip:
+        raise db.NoMoreAddresses()
+    return floating_ip['address']
 
 
 @require_context
@@ -453,6 +621,40 @@ def floating_ip_create(context, values):
     return floating_ip_ref['address']
 
 
+@require_admin_context
+def floating_ip_bulk_create(context, ips):
+    session = get_session()
+    with session.begin():
+        _bulk_insert(session, models.FloatingIp, [dict(ip) for ip in ips])
+
+
+@require_admin_context
+def floating_ip_bulk_destroy(context, addresses):
+    addresses = list(addresses)
+    chunk_size = max(FLAGS.db_bulk_chunk_size, 1)
+    session = get_session()
+    with session.begin():
+        for start in xrange(0, len(addresses), chunk_size):
+            chunk = addresses[start:start + chunk_size]
+            for project_id, count in session.query(
+                        models.FloatingIp.project_id,
+                        func.count(models.FloatingIp.id)).\
+                    filter(models.FloatingIp.address.in_(chunk)).\
+                    filter(models.FloatingIp.project_id != None).\
+                    filter_by(auto_assigned=False).\
+                    filter_by(deleted=False).\
+                    group_by(models.FloatingIp.project_id):
+                _quota_usage_adjust(session, project_id,
+                                    {'floating_ips': -count})
+            session.query(models.FloatingIp).\
+                    filter(models.FloatingIp.address.in_(chunk)).\
+                    filter_by(deleted=False).\
+                    update({'deleted': True,
+                            'deleted_at': datetime.datetime.utcnow(),
+                            'updated_at': literal_column('updated_at')},
+                           synchronize_session=False)
+
+
 @require_context
 def floating_ip_count_by_project(context, project_id):
     authorize_project_context(context, project_id)
@@ -487,6 +689,9 @@ def floating_ip_deallocate(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        if not floating_ip_ref['auto_assigned']:
+            _quota_usage_adjust(session, floating_ip_ref['project_id'],
+                                {'floating_ips': -1})
         floating_ip_ref['project_id'] = None
         floating_ip_ref['auto_assigned'] = False
         floating_ip_ref.save(session=session)
@@ -500,6 +705,9 @@ def floating_ip_destroy(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        if not floating_ip_ref.auto_assigned:
+            _quota_usage_adjust(session, floating_ip_ref.project_id,
+                                {'floating_ips': -1})
         floating_ip_ref.delete(session=session)
 
 
@@ -529,6 +737,9 @@ def floating_ip_set_auto_assigned(context, address):
         floating_ip_ref = floating_ip_get_by_address(context,
                                                      address,
                                                      session=session)
+        if not floating_ip_ref.auto_assigned:
+            _quota_usage_adjust(session, floating_ip_ref.project_id,
+                                {'floating_ips': -1})
         floating_ip_ref.auto_assigned = True
         floating_ip_ref.save(session=session)
 
@@ -615,30 +826,20 @@ def fixed_ip_associate(context, address, instance_id):
 
 @require_admin_context
 def fixed_ip_associate_pool(context, network_id, instance_id):
+    table = models.FixedIp.__table__
     session = get_session()
-    with session.begin():
-        network_or_none = or_(models.FixedIp.network_id == network_id,
-                              models.FixedIp.network_id == None)
-        fixed_ip_ref = session.query(models.FixedIp).\
-                               filter(network_or_none).\
-                               filter_by(reserved=False).\
-                               filter_by(deleted=False).\
-                               filter_by(instance=None).\
-                               with_lockmode('update').\
-                               first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not fixed_ip_ref:
-            raise db.NoMoreAddresses()
-        if not fixed_ip_ref.network:
-            fixed_ip_ref.network = network_get(context,
-                                           network_id,
-                                           session=session)
-        fixed_ip_ref.instance = instance_get(context,
-                                             instance_id,
-                                             session=session)
-        session.add(fixed_ip_ref)
-    return fixed_ip_ref['address']
+    instance = instance_get(context, instance_id, session=session)
+    network_or_none = or_(table.c.network_id == network_id,
+                          table.c.network_id == None)
+    fixed_ip = _allocate_free_row(session, models.FixedIp,
+                                  and_(network_or_none,
+                                       table.c.reserved == False,
+                                       table.c.instance_id == None),
+                                  {'network_id': network_id,
+                                   'instance_id': instance['id']})
+    if not fixed_ip:
+        raise db.NoMoreAddresses()
+    return fixed_ip['address']
 
 
 @require_context
@@ -649,6 +850,13 @@ def fixed_ip_create(_context, values):
     return fixed_ip_ref['address']
 
 
+@require_admin_context
+def fixed_ip_bulk_create(context, ips):
+    session = get_session()
+    with session.begin():
+        _bulk_insert(session, models.FixedIp, [dict(ip) for ip in ips])
+
+
 @require_context
 def fixed_ip_disassociate(context, address):
     session = get_session()
@@ -689,6 +897,19 @@ def fixed_ip_get_all(context, session=None):
     return result
 
 
+@require_admin_context
+def fixed_ip_get_all_iter(context, host=None):
+    session = get_session()
+    query = session.query(models.FixedIp).\
+                    options(joinedload('instance')).\
+                    options(joinedload('network'))
+    if host is not None:
+        query = query.join(models.FixedIp.instance).\
+                      filter_by(state=1).\
+                      filter_by(host=host)
+    return _stream(query)
+
+
 @require_admin_context
 def fixed_ip_get_all_by_host(context, host=None):
     session = get_session()
@@ -795,6 +1016,9 @@ def instance_create(context, values):
     session = get_session()
     with session.begin():
         instance_ref.save(session=session)
+        _quota_usage_adjust(session, instance_ref.project_id,
+                            {'instances': 1,
+                             'cores': instance_ref.vcpus or 0})
     return instance_ref
 
 
@@ -814,11 +1038,20 @@ def instance_data_get_for_project(context, project_id):
 def instance_destroy(context, instance_id):
     session = get_session()
     with session.begin():
+        usage = session.query(models.Instance.project_id,
+                              models.Instance.vcpus).\
+                        filter_by(id=instance_id).\
+                        filter_by(deleted=False).\
+                        first()
         session.query(models.Instance).\
                 filter_by(id=instance_id).\
                 update({'deleted': True,
                         'deleted_at': datetime.datetime.utcnow(),
                         'updated_at': literal_column('updated_at')})
+        if usage:
+            _quota_usage_adjust(session, usage.project_id,
+                                {'instances': -1,
+                                 'cores': -(usage.vcpus or 0)})
         session.query(models.SecurityGroupInstanceAssociation).\
                 filter_by(instance_id=instance_id).\
                 update({'deleted': True,
@@ -903,6 +1136,20 @@ def instance_get_all_by_host(context, host):
                    all()
 
 
+@require_admin_context
+def instance_get_all_iter(context, host=None):
+    session = get_session()
+    query = session.query(models.Instance).\
+                    options(joinedload_all('fixed_ip.floating_ips')).\
+                    options(joinedload('security_groups')).\
+                    options(joinedload_all('fixed_ip.network')).\
+                    options(joinedload('instance_type')).\
+                    filter_by(deleted=can_read_deleted(context))
+    if host is not None:
+        query = query.filter_by(host=host)
+    return _stream_by_id(query, models.Instance)
+
+
 @require_context
 def instance_get_all_by_project(context, project_id):
     authorize_project_context(context, project_id)
@@ -918,6 +1165,12 @@ def instance_get_all_by_project(context, project_id):
                    all()
 
 
+def _select_records(session, name, table, whereclause=None):
+    """Select all columns of table as records of the given class name."""
+    result = session.execute(select([table], whereclause))
+    return records.make_records(name, result.keys(), result.fetchall())
+
+
 @require_context
 def instance_get_all_by_reservation(context, reservation_id):
     session = get_session()
@@ -1003,15 +1256,47 @@ def instance_set_state(context, instance_id, state, description=None):
 
 
 @require_context
-def instance_update(context, instance_id, values):
-    session = get_session()
+def instance_update(context, instance_id, values, expected_version=None):
+    session = get_session()
+    if expected_version is not None:
+        criteria = [models.Instance.deleted == can_read_deleted(context)]
+        if not is_admin_context(context):
+            criteria = [models.Instance.deleted == False,
+                        models.Instance.project_id == context.project_id]
+        with session.begin():
+            instance = None
+            if 'vcpus' in values:
+                # what the update replaces, the version makes sure of that
+                instance = session.query(models.Instance.project_id,
+                                         models.Instance.vcpus,
+                                         models.Instance.deleted).\
+                                   filter_by(id=instance_id).\
+                                   filter_by(version=expected_version).\
+                                   first()
+            version = _versioned_update(session, models.Instance,
+                        instance_id, values, expected_version,
+                        exception.InstanceNotFound(instance_id=instance_id),
+                        *criteria)
+            if instance is not None:
+                _instance_cores_adjust(session, instance, values['vcpus'])
+            return version
     with session.begin():
         instance_ref = instance_get(context, instance_id, session=session)
+        if 'vcpus' in values:
+            _instance_cores_adjust(session, instance_ref, values['vcpus'])
         instance_ref.update(values)
+        _bump_version(instance_ref)
         instance_ref.save(session=session)
         return instance_ref
 
 
+def _instance_cores_adjust(session, instance, vcpus):
+    """Account an instance changing to vcpus in its project's cores."""
+    if not instance.deleted:
+        _quota_usage_adjust(session, instance.project_id,
+                            {'cores': (vcpus or 0) - (instance.vcpus or 0)})
+
+
 def instance_add_security_group(context, instance_id, security_group_id):
     """Associate the given security group with the given instance"""
     session = get_session()
@@ -1063,6 +1348,34 @@ def instance_get_disk_sum_by_host_and_project(context, hostname, proj_id):
     return result
 
 
+@require_admin_context
+def instance_get_usage_by_host(context, project_id=None, by_project=False):
+    session = get_session()
+    group_by = [models.Instance.host]
+    if by_project:
+        group_by.append(models.Instance.project_id)
+    query = session.query(*(group_by +
+                            [func.count(models.Instance.id),
+                             func.sum(models.Instance.vcpus),
+                             func.sum(models.Instance.memory_mb),
+                             func.sum(models.Instance.local_gb)])).\
+                    filter(models.Instance.host != None).\
+                    filter_by(deleted=False)
+    if project_id is not None:
+        query = query.filter_by(project_id=project_id)
+
+    usage = {}
+    for row in query.group_by(*group_by).all():
+        key = by_project and tuple(row[:2]) or row[0]
+        count, vcpus, memory_mb, local_gb = row[len(group_by):]
+        # convert None sums to 0
+        usage[key] = {'instances': count,
+                      'vcpus': vcpus or 0,
+                      'memory_mb': memory_mb or 0,
+                      'local_gb': local_gb or 0}
+    return usage
+
+
 @require_context
 def instance_action_create(context, values):
     """Create an instance action from the values dictionary."""
@@ -1148,20 +1461,14 @@ def key_pair_get_all_by_user(context, user_id):
 
 @require_admin_context
 def network_associate(context, project_id):
+    table = models.Network.__table__
     session = get_session()
-    with session.begin():
-        network_ref = session.query(models.Network).\
-                               filter_by(deleted=False).\
-                               filter_by(project_id=None).\
-                               with_lockmode('update').\
-                               first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not network_ref:
-            raise db.NoMoreNetworks()
-        network_ref['project_id'] = project_id
-        session.add(network_ref)
-    return network_ref
+    network = _allocate_free_row(session, models.Network,
+                                 table.c.project_id == None,
+                                 {'project_id': project_id})
+    if not network:
+        raise db.NoMoreNetworks()
+    return network_get(context, network['id'], session=session)
 
 
 @require_admin_context
@@ -1269,6 +1576,12 @@ def network_get_all(context):
     return result
 
 
+@require_admin_context
+def network_get_all_iter(context):
+    session = get_session()
+    return _stream(session.query(models.Network))
+
+
 # NOTE(vish): pylint complains because of the long method name, but
 #             it fits with the names of the rest of the methods
 # pylint: disable=C0103
@@ -1492,6 +1805,15 @@ def auth_token_create(_context, token):
     return tk
 
 
+@require_admin_context
+def auth_token_destroy_expired(context):
+    session = get_session()
+    with session.begin():
+        return session.query(models.AuthToken).\
+                       filter(models.AuthToken.expires_at < utils.utcnow()).\
+                       delete(synchronize_session=False)
+
+
 ###################
 
 
@@ -1538,22 +1860,228 @@ def quota_destroy(context, project_id):
 ###################
 
 
+# Resources tracked in quota_usages
+QUOTA_RESOURCES = ('instances', 'cores', 'volumes', 'gigabytes',
+                   'floating_ips')
+
+
+def _quota_usage_count(session, project_id):
+    """Count what a project uses of each resource from the live tables."""
+    instances, cores = session.query(func.count(models.Instance.id),
+                                     func.sum(models.Instance.vcpus)).\
+                               filter_by(project_id=project_id).\
+                               filter_by(deleted=False).\
+                               first()
+    volumes, gigabytes = session.query(func.count(models.Volume.id),
+                                       func.sum(models.Volume.size)).\
+                                 filter_by(project_id=project_id).\
+                                 filter_by(deleted=False).\
+                                 first()
+    floating_ips = session.query(models.FloatingIp).\
+                           filter_by(project_id=project_id).\
+                           filter_by(auto_assigned=False).\
+                           filter_by(deleted=False).\
+                           count()
+    return {'instances': instances or 0,
+            'cores': cores or 0,
+            'volumes': volumes or 0,
+            'gigabytes': gigabytes or 0,
+            'floating_ips': floating_ips}
+
+
+def _quota_usages_create(project_id):
+    """Create the usage rows a project does not have yet.
+
+    They are counted from the live tables once per project, in their own
+    transaction ahead of the caller's.  Concurrent first requests for a
+    project race to insert the same rows, the losers hit the unique
+    constraint and use the rows the winner made.
+
+    """
+    session = get_session()
+    existing = session.query(models.QuotaUsage.resource).\
+                       filter_by(project_id=project_id).\
+                       filter_by(deleted=False).\
+                       all()
+    existing = set([resource for resource, in existing])
+    missing = [resource for resource in QUOTA_RESOURCES
+               if resource not in existing]
+    if not missing:
+        return
+    try:
+        with session.begin():
+            counts = _quota_usage_count(session, project_id)
+            now = utils.utcnow()
+            _bulk_insert(session, models.QuotaUsage,
+                         [{'project_id': project_id,
+                           'resource': resource,
+                           'in_use': counts[resource],
+                           'reserved': 0,
+                           'created_at': now,
+                           'deleted': False}
+                          for resource in missing])
+    except IntegrityError:
+        pass
+
+
+def _quota_usages_get(session, project_id):
+    """Return the usage rows of a project keyed by resource.
+
+    _quota_usages_create has to have been called for the project first,
+    outside of session's transaction.
+
+    """
+    usages = {}
+    for usage in session.query(models.QuotaUsage).\
+                         filter_by(project_id=project_id).\
+                         filter_by(deleted=False).\
+                         all():
+        usages[usage.resource] = usage
+    return usages
+
+
+def _quota_usage_adjust(session, project_id, deltas):
+    """Add deltas to what a project uses, as part of session's transaction.
+
+    Projects without usage rows are left alone, their rows are counted
+    from the live tables when first needed.
+
+    """
+    if project_id is None:
+        return
+    table = models.QuotaUsage.__table__
+    for resource, delta in deltas.iteritems():
+        if delta:
+            session.execute(table.update().\
+                                  where(and_(table.c.project_id == project_id,
+                                             table.c.resource == resource)).\
+                                  values(in_use=table.c.in_use + delta))
+
+
+@require_context
+def quota_usage_get_all_by_project(context, project_id):
+    authorize_project_context(context, project_id)
+    _quota_usages_create(project_id)
+    session = get_session()
+    with session.begin():
+        usages = _quota_usages_get(session, project_id)
+    return dict([(resource, {'in_use': usage.in_use,
+                             'reserved': usage.reserved})
+                 for resource, usage in usages.iteritems()])
+
+
 @require_admin_context
-def volume_allocate_shelf_and_blade(context, volume_id):
+def quota_usage_refresh(context, project_id):
+    _quota_usages_create(project_id)
     session = get_session()
     with session.begin():
-        export_device = session.query(models.ExportDevice).\
-                                filter_by(volume=None).\
-                                filter_by(deleted=False).\
-                                with_lockmode('update').\
-                                first()
-        # NOTE(vish): if with_lockmode isn't supported, as in sqlite,
-        #             then this has concurrency issues
-        if not export_device:
-            raise db.NoMoreBlades()
-        export_device.volume_id = volume_id
-        session.add(export_device)
-    return (export_device.shelf_id, export_device.blade_id)
+        usages = _quota_usages_get(session, project_id)
+        counts = _quota_usage_count(session, project_id)
+        for resource, usage in usages.iteritems():
+            usage.in_use = counts.get(resource, usage.in_use)
+            usage.save(session=session)
+
+
+@require_context
+def quota_reserve(context, project_id, deltas, limits, expire=None):
+    authorize_project_context(context, project_id)
+    if expire is None:
+        expire = utils.utcnow() + datetime.timedelta(
+                                        seconds=FLAGS.reservation_expire)
+    table = models.QuotaUsage.__table__
+    _quota_usages_create(project_id)
+    session = get_session()
+    with session.begin():
+        usages = _quota_usages_get(session, project_id)
+        overs = []
+        reservation_uuids = []
+        for resource, delta in sorted(deltas.iteritems()):
+            if resource not in usages:
+                raise exception.InvalidInput(
+                        reason=_('Unknown quota resource %s') % resource)
+            if delta <= 0:
+                continue
+            where = [table.c.id == usages[resource].id]
+            limit = limits.get(resource)
+            if limit is not None and limit >= 0:
+                where.append(table.c.in_use + table.c.reserved + delta <=
+                             limit)
+            result = session.execute(table.update().\
+                                           where(and_(*where)).\
+                                           values(reserved=table.c.reserved +
+                                                           delta))
+            if not result.rowcount:
+                overs.append(resource)
+                continue
+            reservation = models.Reservation()
+            reservation.update({'uuid': str(uuid.uuid4()),
+                                'project_id': project_id,
+                                'resource': resource,
+                                'delta': delta,
+                                'expire': expire})
+            reservation.save(session=session)
+            reservation_uuids.append(reservation.uuid)
+        if overs:
+            # raising here rolls back the reservations made so far
+            raise exception.OverQuota(overs=', '.join(overs))
+    return reservation_uuids
+
+
+def _reservations_release(session, reservations):
+    """Give back what reservations hold and forget them."""
+    table = models.QuotaUsage.__table__
+    for reservation in reservations:
+        session.execute(table.update().\
+                    where(and_(table.c.project_id == reservation.project_id,
+                               table.c.resource == reservation.resource)).\
+                    values(reserved=table.c.reserved - reservation.delta))
+        session.delete(reservation)
+
+
+@require_context
+def reservation_commit(context, reservation_uuids):
+    # in_use was already counted by the call that created the resources
+    reservation_rollback(context, reservation_uuids)
+
+
+@require_context
+def reservation_rollback(context, reservation_uuids):
+    if not reservation_uuids:
+        return
+    session = get_session()
+    with session.begin():
+        _reservations_release(session,
+                session.query(models.Reservation).\
+                        filter(models.Reservation.uuid.in_(
+                                    list(reservation_uuids))).\
+                        all())
+
+
+@require_admin_context
+def reservation_expire(context):
+    session = get_session()
+    with session.begin():
+        reservations = session.query(models.Reservation).\
+                               filter(models.Reservation.expire <
+                                      utils.utcnow()).\
+                               all()
+        _reservations_release(session, reservations)
+    return len(reservations)
+
+
+###################
+
+
+@require_admin_context
+def volume_allocate_shelf_and_blade(context, volume_id):
+    table = models.ExportDevice.__table__
+    session = get_session()
+    export_device = _allocate_free_row(session, models.ExportDevice,
+                                       table.c.volume_id == None,
+                                       {'volume_id': volume_id})
+    if not export_device:
+        raise db.NoMoreBlades()
+    return (export_device['shelf_id'], export_device['blade_id'])
 
 
 @require_admin_context
@@ -1596,6 +2124,9 @@ def volume_create(context, values):
     session = get_session()
     with session.begin():
         volume_ref.save(session=session)
+        _quota_usage_adjust(session, volume_ref.project_id,
+                            {'volumes': 1,
+                             'gigabytes': volume_ref.size or 0})
     return volume_ref
 
 
@@ -1615,11 +2146,20 @@ def volume_data_get_for_project(context, project_id):
 def volume_destroy(context, volume_id):
     session = get_session()
     with session.begin():
+        usage = session.query(models.Volume.project_id,
+                              models.Volume.size).\
+                        filter_by(id=volume_id).\
+                        filter_by(deleted=False).\
+                        first()
         session.query(models.Volume).\
                 filter_by(id=volume_id).\
                 update({'deleted': 1,
                         'deleted_at': datetime.datetime.utcnow(),
                         'updated_at': literal_column('updated_at')})
+        if usage:
+            _quota_usage_adjust(session, usage.project_id,
+                                {'volumes': -1,
+                                 'gigabytes': -(usage.size or 0)})
         session.query(models.ExportDevice).\
                 filter_by(volume_id=volume_id).\
                 update({'volume_id': None})
@@ -1946,6 +2486,56 @@ def security_group_rule_get_by_security_group_grantee(context,
     return result
 
 
+@require_admin_context
+def security_group_rule_get_by_instances(context, instance_ids=None,
+                                         host=None):
+    associations = models.SecurityGroupInstanceAssociation.__table__
+    instances = models.Instance.__table__
+    groups = models.SecurityGroup.__table__
+    rules = models.SecurityGroupIngressRule.__table__
+    chunk_size = max(FLAGS.db_bulk_chunk_size, 1)
+
+    membership = [associations.c.deleted == False,
+                  associations.c.instance_id == instances.c.id,
+                  instances.c.deleted == False,
+                  associations.c.security_group_id == groups.c.id,
+                  groups.c.deleted == False]
+    if host is not None:
+        selections = [instances.c.host == host]
+    else:
+        instance_ids = list(instance_ids or [])
+        selections = [associations.c.instance_id.in_(
+                                instance_ids[start:start + chunk_size])
+                      for start in xrange(0, len(instance_ids), chunk_size)]
+
+    session = get_session()
+    groups_by_instance = {}
+    for selection in selections:
+        for instance_id, group_id in session.execute(
+                select([associations.c.instance_id,
+                        associations.c.security_group_id],
+                       and_(selection, *membership))):
+            groups_by_instance.setdefault(instance_id, set()).add(group_id)
+
+    group_ids = set()
+    for instance_groups in groups_by_instance.itervalues():
+        group_ids.update(instance_groups)
+    group_ids = list(group_ids)
+    rules_by_group = dict([(group_id, []) for group_id in group_ids])
+    for start in xrange(0, len(group_ids), chunk_size):
+        for rule in _select_records(session, 'SecurityGroupRuleRecord', rules,
+                and_(rules.c.deleted == False,
+                     rules.c.parent_group_id.in_(
+                             group_ids[start:start + chunk_size]))):
+            rules_by_group[rule['parent_group_id']].append(rule)
+
+    return dict([(instance_id,
+                  [rule for group_id in sorted(instance_groups)
+                   for rule in rules_by_group[group_id]])
+                 for instance_id, instance_groups
+                 in groups_by_instance.iteritems()])
+
+
 @require_context
 def security_group_rule_create(context, values):
     security_group_rule_ref = models.SecurityGroupIngressRule()
@@ -2030,6 +2620,12 @@ def user_get_all(context):
                    all()
 
 
+def user_get_all_iter(context):
+    session = get_session()
+    return _stream(session.query(models.User).\
+                           filter_by(deleted=can_read_deleted(context)))
+
+
 def project_create(_context, values):
     project_ref = models.Project()
     project_ref.update(values)
@@ -2341,6 +2937,9 @@ def console_get(context, console_id, instance_id=None):
     ##################
 
 
+_INSTANCE_TYPE_CACHE = utils.GenerationCache()
+
+
 @require_admin_context
 def instance_type_create(_context, values):
     try:
@@ -2349,6 +2948,7 @@ def instance_type_create(_context, values):
         instance_type_ref.save()
     except Exception, e:
         raise exception.DBError(e)
+    _INSTANCE_TYPE_CACHE.invalidate()
     return instance_type_ref
 
 
@@ -2357,6 +2957,14 @@ def instance_type_get_all(context, inactive=False):
     """
     Returns a dict describing all instance_types with name as key.
     """
+    inst_dict = _INSTANCE_TYPE_CACHE.get(('all', bool(inactive)),
+                                         FLAGS.instance_type_cache_ttl,
+                                         _instance_type_get_all, inactive)
+    return dict([(name, dict(inst_type))
+                 for name, inst_type in inst_dict.iteritems()])
+
+
+def _instance_type_get_all(inactive):
     session = get_session()
     if inactive:
         inst_types = session.query(models.InstanceTypes).\
@@ -2405,6 +3013,13 @@ def instance_type_get_by_name(context, name):
 @require_context
 def instance_type_get_by_flavor_id(context, id):
     """Returns a dict describing specific flavor_id"""
+    inst_type = _INSTANCE_TYPE_CACHE.get(('flavor', int(id)),
+                                         FLAGS.instance_type_cache_ttl,
+                                         _instance_type_get_by_flavor_id, id)
+    return dict(inst_type)
+
+
+def _instance_type_get_by_flavor_id(id):
     session = get_session()
     inst_type = session.query(models.InstanceTypes).\
                                     filter_by(flavorid=int(id)).\
@@ -2422,6 +3037,7 @@ def instance_type_destroy(context, name):
     instance_type_ref = session.query(models.InstanceTypes).\
                                       filter_by(name=name)
     records = instance_type_ref.update(dict(deleted=True))
+    _INSTANCE_TYPE_CACHE.invalidate()
     if records == 0:
         raise exception.InstanceTypeNotFoundByName(instance_type_name=name)
     else:
@@ -2437,12 +3053,23 @@ def instance_type_purge(context, name):
     instance_type_ref = session.query(models.InstanceTypes).\
                                       filter_by(name=name)
     records = instance_type_ref.delete()
+    _INSTANCE_TYPE_CACHE.invalidate()
     if records == 0:
         raise exception.InstanceTypeNotFoundByName(instance_type_name=name)
     else:
         return instance_type_ref
 
 
+@require_admin_context
+def instance_type_cache_stats(context):
+    return _INSTANCE_TYPE_CACHE.stats()
+
+
+@require_admin_context
+def instance_type_cache_clear(context):
+    _INSTANCE_TYPE_CACHE.invalidate()
+
+
 ####################
 
 
@@ -2519,8 +3146,9 @@ def instance_metadata_delete(context, instance_id, key):
 
 
 @require_context
-def instance_metadata_get_item(context, instance_id, key):
-    session = get_session()
+def instance_metadata_get_item(context, instance_id, key, session=None):
+    if not session:
+        session = get_session()
 
     meta_result = session.query(models.InstanceMetadata).\
                     filter_by(instance_id=instance_id).\
@@ -2534,18 +3162,136 @@ def instance_metadata_get_item(context, instance_id, key):
     return meta_result
 
 
+@require_context
+def instance_metadata_get_all_by_instances(context, instance_ids):
+    instance_ids = list(instance_ids)
+    meta_dicts = dict([(instance_id, {}) for instance_id in instance_ids])
+    chunk_size = max(FLAGS.db_bulk_chunk_size, 1)
+    session = get_session()
+    for start in xrange(0, len(instance_ids), chunk_size):
+        chunk = instance_ids[start:start + chunk_size]
+        in_chunk = models.InstanceMetadata.instance_id.in_(chunk)
+        meta_results = session.query(models.InstanceMetadata.instance_id,
+                                     models.InstanceMetadata.key,
+                                     models.InstanceMetadata.value).\
+                        filter(in_chunk).\
+                        filter_by(deleted=False).\
+                        all()
+        for instance_id, key, value in meta_results:
+            meta_dicts[instance_id][key] = value
+    return meta_dicts
+
+
 @require_context
 def instance_metadata_update_or_create(context, instance_id, metadata):
+    if not metadata:
+        return metadata
+    table = models.InstanceMetadata.__table__
     session = get_session()
-    meta_ref = None
-    for key, value in metadata.iteritems():
-        try:
-            meta_ref = instance_metadata_get_item(context, instance_id, key,
-                                                        session)
-        except:
-            meta_ref = models.InstanceMetadata()
-        meta_ref.update({"key": key, "value": value,
-                            "instance_id": instance_id,
-                            "deleted": 0})
-        meta_ref.save(session=session)
+    with session.begin():
+        in_keys = models.InstanceMetadata.key.in_(metadata.keys())
+        existing = session.query(models.InstanceMetadata.key,
+                                 models.InstanceMetadata.id,
+                                 models.InstanceMetadata.value).\
+                        filter_by(instance_id=instance_id).\
+                        filter(in_keys).\
+                        filter_by(deleted=False).\
+                        all()
+        existing = dict([(key, (id, value)) for key, id, value in existing])
+
+        new_rows = []
+        changed_rows = []
+        for key, value in metadata.iteritems():
+            if key not in existing:
+                new_rows.append({'instance_id': instance_id,
+                                 'key': key,
+                                 'value': value})
+            elif existing[key][1] != value:
+                changed_rows.append({'meta_id': existing[key][0],
+                                     'meta_value': value})
+
+        _bulk_insert(session, models.InstanceMetadata, new_rows)
+        if changed_rows:
+            session.execute(table.update().\
+                                  where(table.c.id == bindparam('meta_id')).\
+                                  values(value=bindparam('meta_value')),
+                            changed_rows)
     return metadata
+
+
+####################
+
+
+def _archive_deleted_rows_for_table(table, before, max_rows):
+    """Move rows of table soft deleted before the given time to its shadow.
+
+    Rows still referenced by another table are left alone.  Each batch of
+    FLAGS.db_bulk_chunk_size rows is moved in its own transaction so locks
+    are only held briefly.  Returns the number of rows moved.
+
+    """
+    shadow = models.shadow_table(table)
+    key = list(table.primary_key.columns)[0]
+    archivable = [table.c.deleted == True, table.c.deleted_at < before]
+    for other in table.metadata.sorted_tables:
+        for foreign_key in other.foreign_keys:
+            if foreign_key.column.table is table:
+                archivable.append(~exists().where(
+                                        foreign_key.parent ==
+                                        foreign_key.column))
+    archivable = select([table], and_(*archivable)).order_by(key)
+
+    chunk_size = max(FLAGS.db_bulk_chunk_size, 1)
+    moved = 0
+    while max_rows is None or moved < max_rows:
+        limit = chunk_size
+        if max_rows is not None:
+            limit = min(limit, max_rows - moved)
+        session = get_session()
+        with session.begin():
+            rows = session.execute(archivable.limit(limit)).fetchall()
+            if rows:
+                session.execute(shadow.insert(), [dict(row) for row in rows])
+                keys = [row[key.name] for row in rows]
+                session.execute(table.delete().where(key.in_(keys)))
+        moved += len(rows)
+        if len(rows) < limit:
+            break
+    return moved
+
+
+@require_admin_context
+def archive_deleted_rows(context, days, max_rows=None):
+    before = utils.utcnow() - datetime.timedelta(days=days)
+    archived = {}
+    for model in models.ARCHIVED_MODELS:
+        table = model.__table__
+        remaining = None
+        if max_rows is not None:
+            remaining = max_rows - sum(archived.values())
+            if remaining <= 0:
+                break
+        archived[table.name] = _archive_deleted_rows_for_table(table,
+                                                               before,
+                                                               remaining)
+    return archived
+
+
+####################
+
+
+def query_stats_begin(context):
+    query_stats.begin_request(context.request_id)
+
+
+def query_stats_get(context):
+    return query_stats.get_request(context.request_id)
+
+
+def query_stats_end(context):
+    return query_stats.end_request(context.request_id)
+
+
+@require_admin_context
+def query_stats_get_by_function(context):
+    return query_stats.get_functions()
@@ -0,0 +1,45 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Rows every new database is seeded with.
+
+The migrations that introduced them and creating the schema straight from
+the models both seed through here, so both give the same data.
+"""
+
+# Here are the old static instance types
+DEFAULT_INSTANCE_TYPES = {
+    'm1.tiny': dict(memory_mb=512, vcpus=1, local_gb=0, flavorid=1),
+    'm1.small': dict(memory_mb=2048, vcpus=1, local_gb=20, flavorid=2),
+    'm1.medium': dict(memory_mb=4096, vcpus=2, local_gb=40, flavorid=3),
+    'm1.large': dict(memory_mb=8192, vcpus=4, local_gb=80, flavorid=4),
+    'm1.xlarge': dict(memory_mb=16384, vcpus=8, local_gb=160, flavorid=5)}
+
+
+def seed_instance_types(engine, instance_types):
+    """Insert the default instance types into the instance_types table."""
+    # FIXME(kpepple) should we be seeding created_at / updated_at ?
+    rows = [dict(values, name=name, deleted=False)
+            for name, values in DEFAULT_INSTANCE_TYPES.iteritems()]
+    rows.sort(key=lambda row: row['flavorid'])
+    engine.execute(instance_types.insert(), rows)
+
+
+def seed(engine, tables):
+    """Seed a db created from the models, tables being keyed by name."""
+    seed_instance_types(engine, tables['instance_types'])
@@ -19,6 +19,7 @@ from migrate import *
 from nova import api
 from nova import db
 from nova import log as logging
+from nova.db.sqlalchemy import defaults
 
 import datetime
 
@@ -59,22 +60,8 @@ def upgrade(migrate_engine):
         logging.exception('Exception while creating instance_types table')
         raise
 
-    # Here are the old static instance types
-    INSTANCE_TYPES = {
-    'm1.tiny': dict(memory_mb=512, vcpus=1, local_gb=0, flavorid=1),
-    'm1.small': dict(memory_mb=2048, vcpus=1, local_gb=20, flavorid=2),
-    'm1.medium': dict(memory_mb=4096, vcpus=2, local_gb=40, flavorid=3),
-    'm1.large': dict(memory_mb=8192, vcpus=4, local_gb=80, flavorid=4),
-    'm1.xlarge': dict(memory_mb=16384, vcpus=8, local_gb=160, flavorid=5)}
     try:
-        i = instance_types.insert()
-        for name, values in INSTANCE_TYPES.iteritems():
-            # FIXME(kpepple) should we be seeding created_at / updated_at ?
-            # now = datetime.datatime.utcnow()
-            i.execute({'name': name, 'memory_mb': values["memory_mb"],
-                        'vcpus': values["vcpus"], 'deleted': False,
-                        'local_gb': values["local_gb"],
-                        'flavorid': values["flavorid"]})
+        defaults.seed_instance_types(migrate_engine, instance_types)
     except Exception:
         logging.info(repr(instance_types))
         logging.exception('Exception while seeding instance_types table')
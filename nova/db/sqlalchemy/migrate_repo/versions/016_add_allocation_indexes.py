@@ -0,0 +1,68 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+
+meta = MetaData()
+
+#
+# Tables to alter
+#
+#
+
+fixed_ips = Table('fixed_ips', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('network_id', Integer()),
+        Column('instance_id', Integer()),
+        )
+
+floating_ips = Table('floating_ips', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('host', String(255)),
+        )
+
+export_devices = Table('export_devices', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('volume_id', Integer()),
+        )
+
+networks = Table('networks', meta,
+        Column('id', Integer(), primary_key=True, nullable=False),
+        Column('project_id', String(255)),
+        )
+
+# Names match the ones the models generate for index=True columns
+indexes = [Index('ix_fixed_ips_network_id', fixed_ips.c.network_id),
+           Index('ix_fixed_ips_instance_id', fixed_ips.c.instance_id),
+           Index('ix_floating_ips_host', floating_ips.c.host),
+           Index('ix_export_devices_volume_id', export_devices.c.volume_id),
+           Index('ix_networks_project_id', networks.c.project_id)]
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine;
+    # bind migrate_engine to your metadata
+    meta.bind = migrate_engine
+    for index in indexes:
+        index.create(migrate_engine)
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    for index in indexes:
+        index.drop(migrate_engine)
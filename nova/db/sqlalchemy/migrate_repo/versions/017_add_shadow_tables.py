@@ -0,0 +1,57 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+
+meta = MetaData()
+
+
+# Tables whose soft deleted rows can be archived, each gets a shadow_ copy
+# with the same columns but without keys and constraints.
+archived_tables = ['instance_metadata',
+                   'instance_actions',
+                   'security_group_instance_association',
+                   'migrations',
+                   'floating_ips',
+                   'fixed_ips',
+                   'volumes',
+                   'instances',
+                   'auth_tokens']
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine;
+    # bind migrate_engine to your metadata
+    meta.bind = migrate_engine
+    for table_name in archived_tables:
+        table = Table(table_name, meta, autoload=True,
+                      autoload_with=migrate_engine)
+        columns = [Column(column.name, column.type,
+                          primary_key=column.primary_key,
+                          autoincrement=False)
+                   for column in table.columns]
+        shadow = Table('shadow_' + table_name, meta, *columns)
+        shadow.create()
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    for table_name in archived_tables:
+        shadow = Table('shadow_' + table_name, meta, autoload=True,
+                       autoload_with=migrate_engine)
+        shadow.drop()
@@ -0,0 +1,64 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+
+meta = MetaData()
+
+
+# Tokens used to be honoured for two days after they were created
+legacy_token_lifetime_days = 2
+
+
+def _load_tables(migrate_engine):
+    return [Table(table_name, meta, autoload=True,
+                  autoload_with=migrate_engine)
+            for table_name in ('auth_tokens', 'shadow_auth_tokens')]
+
+
+def _add_days(migrate_engine, column, days):
+    """Return an expression of column plus days in the engine's dialect."""
+    if migrate_engine.name == 'sqlite':
+        return func.datetime(column, '+%d days' % days)
+    if migrate_engine.name == 'postgresql':
+        return column + literal_column("INTERVAL '%d days'" % days)
+    return func.date_add(column, literal_column('INTERVAL %d DAY' % days))
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine;
+    # bind migrate_engine to your metadata
+    meta.bind = migrate_engine
+    auth_tokens, shadow_auth_tokens = _load_tables(migrate_engine)
+    for table in (auth_tokens, shadow_auth_tokens):
+        table.create_column(Column('expires_at', DateTime(timezone=False)))
+    Index('ix_auth_tokens_expires_at', auth_tokens.c.expires_at).create()
+
+    expires_at = _add_days(migrate_engine, auth_tokens.c.created_at,
+                           legacy_token_lifetime_days)
+    migrate_engine.execute(auth_tokens.update().\
+                where(auth_tokens.c.created_at != None).\
+                values(expires_at=expires_at))
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    auth_tokens, shadow_auth_tokens = _load_tables(migrate_engine)
+    Index('ix_auth_tokens_expires_at', auth_tokens.c.expires_at).drop()
+    for table in (auth_tokens, shadow_auth_tokens):
+        table.drop_column('expires_at')
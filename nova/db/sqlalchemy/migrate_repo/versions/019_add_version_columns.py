@@ -0,0 +1,47 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from sqlalchemy import *
+from migrate import *
+
+
+meta = MetaData()
+
+
+# Tables whose updates can be made conditional on the row version
+versioned_tables = ['instances', 'shadow_instances', 'services',
+                    'compute_nodes']
+
+
+def _load_tables(migrate_engine):
+    return [Table(table_name, meta, autoload=True,
+                  autoload_with=migrate_engine)
+            for table_name in versioned_tables]
+
+
+def upgrade(migrate_engine):
+    # Upgrade operations go here. Don't create your own engine;
+    # bind migrate_engine to your metadata
+    meta.bind = migrate_engine
+    for table in _load_tables(migrate_engine):
+        table.create_column(Column('version', Integer()))
+        migrate_engine.execute(table.update().values(version=0))
+
+
+def downgrade(migrate_engine):
+    meta.bind = migrate_engine
+    for table in _load_tables(migrate_engine):
+        table.drop_column('version')
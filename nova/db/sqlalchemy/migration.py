@@ -17,11 +17,14 @@
 #    under the License.
 
 import os
+import shutil
 import sys
+import tempfile
 
 from nova import flags
 
 import sqlalchemy
+from sqlalchemy.engine import reflection
 from migrate.versioning import api as versioning_api
 
 try:
@@ -36,10 +39,20 @@ except ImportError:
 
 FLAGS = flags.FLAGS
 
+# Columns the migrations leave behind that no model maps any more, so a
+# schema created from the models doesn't have them
+_LEGACY_COLUMNS = {'instances': set(['internal_id', 'server_name']),
+                   'volumes': set(['ec2_id'])}
+
+# Columns whose values depend on when a row was written
+_TIMESTAMP_COLUMNS = set(['created_at', 'updated_at', 'deleted_at'])
+
 
 def db_sync(version=None):
-    db_version()
     repo_path = _find_migrate_repo()
+    if version is None and _is_empty(FLAGS.sql_connection):
+        return _create_from_models(FLAGS.sql_connection, repo_path)
+    db_version()
     return versioning_api.upgrade(FLAGS.sql_connection, repo_path, version)
 
 
@@ -77,6 +90,139 @@ def db_version_control(version=None):
     return version
 
 
+def db_check():
+    """Compare a schema created from the models with a migrated one.
+
+    Both are built in scratch sqlite dbs.  Returns a list of differences
+    in tables, columns, index names and the rows they are seeded with,
+    which is empty if they match.  Legacy columns nothing uses any more
+    and timestamps are not compared.
+
+    """
+    repo_path = _find_migrate_repo()
+    scratch = tempfile.mkdtemp()
+    try:
+        migrated = 'sqlite:///%s' % os.path.join(scratch, 'migrated.sqlite')
+        versioning_api.version_control(migrated, repo_path, 0)
+        versioning_api.upgrade(migrated, repo_path)
+        created = 'sqlite:///%s' % os.path.join(scratch, 'created.sqlite')
+        _create_from_models(created, repo_path)
+        return (_schema_differences(_describe_schema(migrated),
+                                    _describe_schema(created)) +
+                _row_differences(migrated, created))
+    finally:
+        shutil.rmtree(scratch)
+
+
+def _is_empty(sql_connection):
+    """Whether the db has no tables at all, not even migrate_version."""
+    engine = sqlalchemy.create_engine(sql_connection, echo=False)
+    return not engine.table_names()
+
+
+def _create_from_models(sql_connection, repo_path):
+    """Create the latest schema straight from the models.
+
+    Much faster than replaying every migration on an empty db.  The db is
+    then put under version control at the latest version, so later
+    migrations apply to it as usual.
+
+    """
+    from nova.db.sqlalchemy import defaults
+    from nova.db.sqlalchemy import models
+
+    engine = sqlalchemy.create_engine(sql_connection, echo=False)
+    models.BASE.metadata.create_all(engine)
+    for model in models.ARCHIVED_MODELS:
+        models.shadow_table(model.__table__).create(bind=engine)
+    defaults.seed(engine, models.BASE.metadata.tables)
+    version = versioning_api.version(repo_path)
+    versioning_api.version_control(sql_connection, repo_path, version)
+    return version
+
+
+def _describe_schema(sql_connection):
+    """Return {table: (column names, index names)} for a db."""
+    engine = sqlalchemy.create_engine(sql_connection, echo=False)
+    inspector = reflection.Inspector.from_engine(engine)
+    schema = {}
+    for table_name in inspector.get_table_names():
+        columns = set([column['name']
+                       for column in inspector.get_columns(table_name)])
+        indexes = set([index['name']
+                       for index in inspector.get_indexes(table_name)])
+        schema[table_name] = (columns, indexes)
+    return schema
+
+
+def _schema_differences(migrated, created):
+    differences = []
+    for table_name in sorted(set(migrated) | set(created)):
+        if table_name not in created:
+            differences.append(_('table %s only created by migrations')
+                               % table_name)
+        elif table_name not in migrated:
+            differences.append(_('table %s only created from models')
+                               % table_name)
+        else:
+            columns, indexes = migrated[table_name]
+            model_table_name = table_name
+            if model_table_name.startswith('shadow_'):
+                model_table_name = model_table_name[len('shadow_'):]
+            legacy = _LEGACY_COLUMNS.get(model_table_name, set())
+            for kind, in_migrated, in_created in zip(
+                    (_('column'), _('index')),
+                    (columns - legacy, indexes),
+                    created[table_name]):
+                for name in sorted(in_migrated - in_created):
+                    differences.append(
+                            _('%(kind)s %(table_name)s.%(name)s only '
+                              'created by migrations') % locals())
+                for name in sorted(in_created - in_migrated):
+                    differences.append(
+                            _('%(kind)s %(table_name)s.%(name)s only '
+                              'created from models') % locals())
+    return differences
+
+
+def _load_tables(sql_connection):
+    engine = sqlalchemy.create_engine(sql_connection, echo=False)
+    meta = sqlalchemy.MetaData()
+    meta.reflect(bind=engine)
+    return engine, meta.tables
+
+
+def _row_differences(migrated, created):
+    """Compare the rows both dbs hold in the tables they share."""
+    migrated_engine, migrated_tables = _load_tables(migrated)
+    created_engine, created_tables = _load_tables(created)
+    differences = []
+    for table_name in sorted(set(migrated_tables) & set(created_tables)):
+        if table_name == 'migrate_version':
+            continue
+        migrated_table = migrated_tables[table_name]
+        created_table = created_tables[table_name]
+        names = (set(migrated_table.columns.keys()) &
+                 set(created_table.columns.keys())) - _TIMESTAMP_COLUMNS
+        names = sorted(names)
+        migrated_rows = _select_rows(migrated_engine, migrated_table, names)
+        created_rows = _select_rows(created_engine, created_table, names)
+        for row in sorted(migrated_rows - created_rows):
+            row = dict(zip(names, row))
+            differences.append(_('row %(table_name)s %(row)r only created '
+                                 'by migrations') % locals())
+        for row in sorted(created_rows - migrated_rows):
+            row = dict(zip(names, row))
+            differences.append(_('row %(table_name)s %(row)r only created '
+                                 'from models') % locals())
+    return differences
+
+
+def _select_rows(engine, table, names):
+    query = sqlalchemy.select([table.columns[name] for name in names])
+    return set([tuple(row) for row in engine.execute(query)])
+
+
 def _find_migrate_repo():
     """Get the path for the migrate repository."""
     path = os.path.join(os.path.abspath(os.path.dirname(__file__)),
@@ -23,6 +23,7 @@ import datetime
 
 from sqlalchemy.orm import relationship, backref, object_mapper
 from sqlalchemy import Column, Integer, String, schema
+from sqlalchemy import MetaData, Table
 from sqlalchemy import ForeignKey, DateTime, Boolean, Text
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.declarative import declarative_base
@@ -76,6 +77,10 @@ class NovaBase(object):
     def get(self, key, default=None):
         return getattr(self, key, default)
 
+    def __contains__(self, key):
+        """Same keys as iteritems, without building a dict."""
+        return key in object_mapper(self).columns or key in self.__dict__
+
     def __iter__(self):
         self._i = iter(object_mapper(self).columns)
         return self
@@ -111,6 +116,7 @@ class Service(BASE, NovaBase):
     report_count = Column(Integer, nullable=False, default=0)
     disabled = Column(Boolean, default=False)
     availability_zone = Column(String(255), default='nova')
+    version = Column(Integer, default=0)
 
 
 class ComputeNode(BASE, NovaBase):
@@ -134,6 +140,7 @@ class ComputeNode(BASE, NovaBase):
     local_gb_used = Column(Integer, nullable=True)
     hypervisor_type = Column(Text, nullable=True)
     hypervisor_version = Column(Integer, nullable=True)
+    version = Column(Integer, default=0)
 
     # Note(masumotok): Expected Strings example:
     #
@@ -233,6 +240,9 @@ class Instance(BASE, NovaBase):
 
     os_type = Column(String(255))
 
+    # bumped on every update, see db.instance_update
+    version = Column(Integer, default=0)
+
     # TODO(vish): see Ewan's email about state improvements, probably
     #             should be in a driver base class or some such
     # vmstate_state = running, halted, suspended, paused
@@ -327,6 +337,38 @@ class Quota(BASE, NovaBase):
     metadata_items = Column(Integer)
 
 
+class QuotaUsage(BASE, NovaBase):
+    """Represents what a project uses of a resource.
+
+    in_use is kept up to date by the calls creating and destroying what
+    the resource counts, reserved is held by outstanding reservations.
+
+    """
+    __tablename__ = 'quota_usages'
+    __table_args__ = (schema.UniqueConstraint("project_id", "resource"),
+                      {'mysql_engine': 'InnoDB'})
+    id = Column(Integer, primary_key=True)
+
+    project_id = Column(String(255), index=True)
+    resource = Column(String(255))
+
+    in_use = Column(Integer, nullable=False)
+    reserved = Column(Integer, nullable=False)
+
+
+class Reservation(BASE, NovaBase):
+    """Represents quota held for a resource until it is created."""
+    __tablename__ = 'reservations'
+    id = Column(Integer, primary_key=True)
+    uuid = Column(String(36), nullable=False, index=True)
+
+    project_id = Column(String(255))
+    resource = Column(String(255))
+
+    delta = Column(Integer, nullable=False)
+    expire = Column(DateTime)
+
+
 class ExportDevice(BASE, NovaBase):
     """Represates a shelf and blade that a volume can be exported on."""
     __tablename__ = 'export_devices'
@@ -335,7 +377,8 @@ class ExportDevice(BASE, NovaBase):
     id = Column(Integer, primary_key=True)
     shelf_id = Column(Integer)
     blade_id = Column(Integer)
-    volume_id = Column(Integer, ForeignKey('volumes.id'), nullable=True)
+    volume_id = Column(Integer, ForeignKey('volumes.id'), nullable=True,
+                       index=True)
     volume = relationship(Volume,
                           backref=backref('export_device', uselist=False),
                           foreign_keys=volume_id,
@@ -479,7 +522,7 @@ class Network(BASE, NovaBase):
     # NOTE(vish): The unique constraint below helps avoid a race condition
     #             when associating a network, but it also means that we
     #             can't associate two networks with one project.
-    project_id = Column(String(255), unique=True)
+    project_id = Column(String(255), unique=True, index=True)
     host = Column(String(255))  # , ForeignKey('hosts.id'))
 
 
@@ -496,6 +539,7 @@ class AuthToken(BASE, NovaBase):
     server_manageent_url = Column(String(255))
     storage_url = Column(String(255))
     cdn_management_url = Column(String(255))
+    expires_at = Column(DateTime, index=True)
 
 
 # TODO(vish): can these both come from the same baseclass?
@@ -504,9 +548,11 @@ class FixedIp(BASE, NovaBase):
     __tablename__ = 'fixed_ips'
     id = Column(Integer, primary_key=True)
     address = Column(String(255))
-    network_id = Column(Integer, ForeignKey('networks.id'), nullable=True)
+    network_id = Column(Integer, ForeignKey('networks.id'), nullable=True,
+                        index=True)
     network = relationship(Network, backref=backref('fixed_ips'))
-    instance_id = Column(Integer, ForeignKey('instances.id'), nullable=True)
+    instance_id = Column(Integer, ForeignKey('instances.id'), nullable=True,
+                         index=True)
     instance = relationship(Instance,
                             backref=backref('fixed_ip', uselist=False),
                             foreign_keys=instance_id,
@@ -591,7 +637,7 @@ class FloatingIp(BASE, NovaBase):
                                 'FloatingIp.fixed_ip_id == FixedIp.id,'
                                 'FloatingIp.deleted == False)')
     project_id = Column(String(255))
-    host = Column(String(255))  # , ForeignKey('hosts.id'))
+    host = Column(String(255), index=True)  # , ForeignKey('hosts.id'))
     auto_assigned = Column(Boolean, default=False, nullable=False)
 
 
@@ -643,6 +689,34 @@ class Zone(BASE, NovaBase):
     password = Column(String(255))
 
 
+# Soft deleted rows of these are archived into shadow tables.  Children
+# come before the tables they reference, so a single run can archive an
+# instance after its metadata and actions.
+ARCHIVED_MODELS = (InstanceMetadata,
+                   InstanceActions,
+                   SecurityGroupInstanceAssociation,
+                   Migration,
+                   FloatingIp,
+                   FixedIp,
+                   Volume,
+                   Instance,
+                   AuthToken)
+
+_SHADOW_TABLES = {}
+
+
+def shadow_table(table):
+    """Return the shadow table that archived rows of table are moved to."""
+    if table.name not in _SHADOW_TABLES:
+        columns = [Column(column.name, column.type,
+                          primary_key=column.primary_key,
+                          autoincrement=False)
+                   for column in table.columns]
+        _SHADOW_TABLES[table.name] = Table('shadow_' + table.name,
+                                           MetaData(), *columns)
+    return _SHADOW_TABLES[table.name]
+
+
 def register_models():
     """Register Models and create metadata.
 
@@ -656,7 +730,7 @@ def register_models():
               Network, SecurityGroup, SecurityGroupIngressRule,
               SecurityGroupInstanceAssociation, AuthToken, User,
               Project, Certificate, ConsolePool, Console, Zone,
-              InstanceMetadata, Migration)
+              InstanceMetadata, Migration, QuotaUsage, Reservation)
     engine = create_engine(FLAGS.sql_connection, echo=False)
     for model in models:
         model.metadata.create_all(engine)
@@ -0,0 +1,158 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Statement counting and slow statement logging for the SQLAlchemy backend.
+
+:class:`QueryStatsProxy` is installed on the engine by get_session when
+--sql_query_stats or --sql_slow_query_threshold is set.  Every statement is
+attributed to the outermost nova.db.sqlalchemy.api function on the stack,
+and to the request whose context that function was called with if the
+request was registered with :func:`begin_request`.
+"""
+
+import sys
+import time
+
+from sqlalchemy.interfaces import ConnectionProxy
+
+from nova import flags
+from nova import log as logging
+
+
+FLAGS = flags.FLAGS
+LOG = logging.getLogger('nova.db.sqlalchemy.query_stats')
+
+_API_MODULE = 'nova.db.sqlalchemy.api'
+
+# statement count and time keyed by db api function name
+_FUNCTIONS = {}
+
+# statement count and time keyed by request id, see begin_request
+_REQUESTS = {}
+
+# how many times requests still collecting were begun, when more than once
+_NESTING = {}
+
+
+def _new_stats():
+    return {'count': 0, 'time': 0.0, 'functions': {}}
+
+
+def _caller():
+    """Find the db api function a statement is being run for.
+
+    Returns the name of the outermost api function on the stack and the
+    first argument it was called with, which is its context.
+
+    """
+    name = None
+    context = None
+    frame = sys._getframe(2)
+    while frame:
+        code = frame.f_code
+        if frame.f_globals.get('__name__') == _API_MODULE:
+            # skip the require_context style decorator wrappers
+            if code.co_name != 'wrapper':
+                name = code.co_name
+                if code.co_argcount:
+                    context = frame.f_locals.get(code.co_varnames[0])
+        elif name:
+            break
+        frame = frame.f_back
+    return name or 'unknown', context
+
+
+def _add(stats, function, elapsed):
+    stats['count'] += 1
+    stats['time'] += elapsed
+    functions = stats['functions']
+    functions[function] = functions.get(function, 0) + 1
+
+
+def record(statement, parameters, elapsed):
+    """Account a statement that took elapsed seconds."""
+    function, context = _caller()
+    if FLAGS.sql_query_stats:
+        stats = _FUNCTIONS.setdefault(function, {'count': 0, 'time': 0.0})
+        stats['count'] += 1
+        stats['time'] += elapsed
+        request_stats = _REQUESTS.get(getattr(context, 'request_id', None))
+        if request_stats is not None:
+            _add(request_stats, function, elapsed)
+    threshold = FLAGS.sql_slow_query_threshold
+    if threshold and elapsed >= threshold:
+        LOG.warn(_("Slow statement in %(function)s took %(elapsed).3fs: "
+                   "%(statement)s %(parameters)r") % locals())
+
+
+def begin_request(request_id):
+    """Start collecting statements run for request_id.
+
+    Several middlewares can begin the same request.  Collecting goes on
+    until end_request has been called as many times as begin_request.
+
+    """
+    if request_id in _REQUESTS:
+        _NESTING[request_id] = _NESTING.get(request_id, 1) + 1
+    else:
+        _REQUESTS[request_id] = _new_stats()
+
+
+def get_request(request_id):
+    """Return what has been collected for request_id so far, or None."""
+    return _REQUESTS.get(request_id)
+
+
+def end_request(request_id):
+    """Stop collecting for request_id and return what was collected.
+
+    Returns None if the request was never registered.  If it was begun
+    more than once, what was collected so far is returned and collecting
+    goes on for the outer callers.
+
+    """
+    nesting = _NESTING.pop(request_id, 1)
+    if nesting > 1:
+        _NESTING[request_id] = nesting - 1
+        stats = dict(_REQUESTS[request_id])
+        stats['functions'] = dict(stats['functions'])
+        return stats
+    return _REQUESTS.pop(request_id, None)
+
+
+def get_functions():
+    """Return statement count and time keyed by db api function name."""
+    return dict([(function, dict(stats))
+                 for function, stats in _FUNCTIONS.iteritems()])
+
+
+def reset():
+    """Forget everything that was collected."""
+    _FUNCTIONS.clear()
+    _REQUESTS.clear()
+    _NESTING.clear()
+
+
+class QueryStatsProxy(ConnectionProxy):
+    """Times every statement run on the engine and records it."""
+
+    def cursor_execute(self, execute, cursor, statement, parameters,
+                       context, executemany):
+        start = time.time()
+        try:
+            return execute(cursor, statement, parameters, context)
+        finally:
+            record(statement, parameters, time.time() - start)
@@ -0,0 +1,95 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+"""
+Read-only row records for the SQLAlchemy backend.
+
+Listing calls whose results only feed views can return records instead of
+model objects.  A record only holds the tuple of its values and reads them
+through a key map shared by every record of its class, so it takes little
+more memory than the row itself and needs no session, identity map or
+instrumentation.
+
+security_group_rule_get_by_instances returns them.  Instance listings still
+return models: the servers controller lists through the compute api, which
+hands its models on to other callers as well.
+"""
+
+
+# Record classes keyed by name and fields, see record_class
+_CLASSES = {}
+
+
+class Record(object):
+    """Read-only row with dict and attribute access by field name."""
+
+    __slots__ = ('_values',)
+    _fields = ()
+    _index = {}
+
+    def __init__(self, values):
+        self._values = tuple(values)
+
+    def __getitem__(self, key):
+        try:
+            return self._values[self._index[key]]
+        except KeyError:
+            raise KeyError(key)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._values[self._index[name]]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        if index is None:
+            return default
+        return self._values[index]
+
+    def keys(self):
+        return list(self._fields)
+
+    def iteritems(self):
+        return iter(zip(self._fields, self._values))
+
+    def __repr__(self):
+        return '%s(%s)' % (self.__class__.__name__,
+                           ', '.join(['%s=%r' % item
+                                      for item in self.iteritems()]))
+
+
+def record_class(name, fields):
+    """Return the Record subclass for rows with the given fields."""
+    fields = tuple(fields)
+    key = (name, fields)
+    if key not in _CLASSES:
+        index = dict([(field, i) for i, field in enumerate(fields)])
+        _CLASSES[key] = type(name, (Record,), {'__slots__': (),
+                                               '_fields': fields,
+                                               '_index': index})
+    return _CLASSES[key]
+
+
+def make_records(name, columns, rows):
+    """Turn result rows with the given column names into records."""
+    cls = record_class(name, columns)
+    return [cls(row) for row in rows]
@@ -25,8 +25,11 @@ from sqlalchemy.orm import sessionmaker
 
 from nova import exception
 from nova import flags
+from nova.db.sqlalchemy import query_stats
 
 FLAGS = flags.FLAGS
+flags.DECLARE('sql_query_stats', 'nova.db.api')
+flags.DECLARE('sql_slow_query_threshold', 'nova.db.api')
 
 _ENGINE = None
 _MAKER = None
@@ -44,6 +47,9 @@ def get_session(autocommit=True, expire_on_commit=False):
             if FLAGS.sql_connection.startswith('sqlite'):
                 kwargs['poolclass'] = pool.NullPool
 
+            if FLAGS.sql_query_stats or FLAGS.sql_slow_query_threshold:
+                kwargs['proxy'] = query_stats.QueryStatsProxy()
+
             _ENGINE = create_engine(FLAGS.sql_connection,
                                     **kwargs)
         _MAKER = (sessionmaker(bind=_ENGINE,
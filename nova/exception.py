@@ -157,6 +157,10 @@ class InvalidContentType(Invalid):
     message = _("Invalid content type %(content_type)s.")
 
 
+class MalformedRequestBody(Invalid):
+    message = _("Malformed message body: %(reason)s")
+
+
 class InstanceNotRunning(Invalid):
     message = _("Instance %(instance_id)s is not running.")
 
@@ -546,5 +550,14 @@ class InstanceExists(Duplicate):
     message = _("Instance %(name)s already exists.")
 
 
+class OverQuota(NovaException):
+    message = _("Quota exceeded for resources: %(overs)s")
+
+
+class UpdateConflict(NovaException):
+    message = _("%(table)s %(id)s was changed by someone else after "
+                "version %(version)s.")
+
+
 class MigrationError(NovaException):
     message = _("Migration error") + ": %(reason)s"
@@ -60,6 +60,13 @@ flags.DEFINE_integer('rabbit_max_retries', 12, 'rabbit connection attempts')
 flags.DEFINE_string('control_exchange', 'nova',
                     'the main exchange to connect to')
 
+# messages sent and time spent sending them keyed by request id, see
+# stats_begin
+_REQUEST_STATS = {}
+
+# how many times requests still counting were begun, when more than once
+_NESTING = {}
+
 
 class Connection(carrot_connection.BrokerConnection):
     """Connection instance object."""
@@ -378,8 +385,62 @@ def _pack_context(msg, context):
     msg.update(context)
 
 
+def stats_begin(context):
+    """Start counting the messages sent for the request of context.
+
+    Several middlewares can begin the same request.  Counting goes on
+    until stats_end has been called as many times as stats_begin.
+
+    """
+    request_id = context.request_id
+    if request_id in _REQUEST_STATS:
+        _NESTING[request_id] = _NESTING.get(request_id, 1) + 1
+    else:
+        _REQUEST_STATS[request_id] = {'count': 0, 'time': 0.0,
+                                      'methods': {}}
+
+
+def stats_get(context):
+    """Get message count and time collected for the request so far."""
+    return _REQUEST_STATS.get(context.request_id)
+
+
+def stats_end(context):
+    """Stop counting for the request and return what was collected.
+
+    Returns None if the request was never begun.
+
+    """
+    request_id = context.request_id
+    nesting = _NESTING.pop(request_id, 1)
+    if nesting > 1:
+        _NESTING[request_id] = nesting - 1
+        stats = dict(_REQUEST_STATS[request_id])
+        stats['methods'] = dict(stats['methods'])
+        return stats
+    return _REQUEST_STATS.pop(request_id, None)
+
+
+def _record(context, method, start):
+    """Account a message sent for context since start, if counted."""
+    stats = _REQUEST_STATS.get(getattr(context, 'request_id', None))
+    if stats is not None:
+        stats['count'] += 1
+        stats['time'] += time.time() - start
+        methods = stats['methods']
+        methods[method] = methods.get(method, 0) + 1
+
+
 def call(context, topic, msg):
     """Sends a message on a topic and wait for a response."""
+    start = time.time()
+    try:
+        return _call(context, topic, msg)
+    finally:
+        _record(context, 'call', start)
+
+
+def _call(context, topic, msg):
     LOG.debug(_('Making asynchronous call on %s ...'), topic)
     msg_id = uuid.uuid4().hex
     msg.update({'_msg_id': msg_id})
@@ -422,21 +483,25 @@ def call(context, topic, msg):
 def cast(context, topic, msg):
     """Sends a message on a topic without waiting for a response."""
     LOG.debug(_('Making asynchronous cast on %s...'), topic)
+    start = time.time()
     _pack_context(msg, context)
     conn = Connection.instance()
     publisher = TopicPublisher(connection=conn, topic=topic)
     publisher.send(msg)
     publisher.close()
+    _record(context, 'cast', start)
 
 
 def fanout_cast(context, topic, msg):
     """Sends a message on a fanout exchange without waiting for a response."""
     LOG.debug(_('Making asynchronous fanout cast...'))
+    start = time.time()
     _pack_context(msg, context)
     conn = Connection.instance()
     publisher = FanoutPublisher(topic, connection=conn)
     publisher.send(msg)
     publisher.close()
+    _record(context, 'fanout_cast', start)
 
 
 def generic_response(message_data, message):
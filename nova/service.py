@@ -54,6 +54,27 @@ flags.DEFINE_string('osapi_listen', "0.0.0.0",
 flags.DEFINE_integer('osapi_listen_port', 8774, 'port for os api to listen')
 flags.DEFINE_string('api_paste_config', "api-paste.ini",
                     'File name for the paste.deploy config for nova-api')
+flags.DEFINE_integer('auth_token_reap_interval', 60 * 60,
+                     'seconds between nova-api purging expired auth tokens, '
+                     '0 disables purging')
+
+
+def _stop_timers(timers):
+    """Stop the looping calls and consumers of a service."""
+    for x in timers:
+        try:
+            x.stop()
+        except Exception:
+            pass
+
+
+def _wait_timers(timers):
+    """Wait for the looping calls and consumers of a service to end."""
+    for x in timers:
+        try:
+            x.wait()
+        except Exception:
+            pass
 
 
 class Service(object):
@@ -149,19 +170,11 @@ class Service(object):
         self.stop()
 
     def stop(self):
-        for x in self.timers:
-            try:
-                x.stop()
-            except Exception:
-                pass
+        _stop_timers(self.timers)
         self.timers = []
 
     def wait(self):
-        for x in self.timers:
-            try:
-                x.wait()
-            except Exception:
-                pass
+        _wait_timers(self.timers)
 
     def periodic_tasks(self):
         """Tasks to be run at a periodic interval."""
@@ -196,6 +209,33 @@ class WsgiService(object):
 class ApiService(WsgiService):
     """Class for our nova-api service."""
 
+    def __init__(self, conf, apis):
+        super(ApiService, self).__init__(conf, apis)
+        self.timers = []
+
+    def start(self):
+        super(ApiService, self).start()
+        if FLAGS.auth_token_reap_interval:
+            reaper = utils.LoopingCall(self.destroy_expired_auth_tokens)
+            reaper.start(interval=FLAGS.auth_token_reap_interval, now=False)
+            self.timers.append(reaper)
+
+    def stop(self):
+        _stop_timers(self.timers)
+        self.timers = []
+
+    def wait(self):
+        super(ApiService, self).wait()
+        _wait_timers(self.timers)
+
+    def destroy_expired_auth_tokens(self):
+        """Remove tokens that expired without being presented again."""
+        try:
+            count = db.auth_token_destroy_expired(context.get_admin_context())
+            logging.debug(_("Removed %d expired auth tokens"), count)
+        except Exception:
+            logging.exception(_("Failed to remove expired auth tokens"))
+
     @classmethod
     def create(cls, conf=None):
         if not conf:
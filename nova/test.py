@@ -27,13 +27,17 @@ import datetime
 import functools
 import os
 import shutil
+import sqlite3
+import tempfile
 import uuid
 import unittest
 
 import mox
 import shutil
+import sqlalchemy
 import stubout
 from eventlet import greenthread
+from sqlalchemy import pool
 
 from nova import context
 from nova import db
@@ -42,6 +46,8 @@ from nova import flags
 from nova import rpc
 from nova import service
 from nova import wsgi
+from nova.db import migration
+from nova.db.sqlalchemy import session as db_session
 
 
 FLAGS = flags.FLAGS
@@ -51,6 +57,73 @@ flags.DEFINE_bool('fake_tests', True,
                   'should we use everything for testing')
 
 
+# pages and sql dump of the migrated clean db, built once per test run
+_DB_TEMPLATE = None
+
+
+def _build_db_template():
+    """Migrate a fresh clean db and return its pages and its sql dump.
+
+    The db is built in a temporary directory, removed once it is read.
+
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cleandb = os.path.join(tmpdir, FLAGS.sqlite_clean_db)
+        sql_connection = FLAGS.sql_connection
+        FLAGS.sql_connection = 'sqlite:///%s' % cleandb
+        try:
+            migration.db_sync()
+        finally:
+            FLAGS.sql_connection = sql_connection
+        clean_file = open(cleandb, 'rb')
+        try:
+            pages = clean_file.read()
+        finally:
+            clean_file.close()
+        conn = sqlite3.connect(cleandb)
+        try:
+            script = '\n'.join(conn.iterdump())
+        finally:
+            conn.close()
+    finally:
+        shutil.rmtree(tmpdir)
+    return pages, script
+
+
+def reset_db():
+    """Restore the sqlite test db to a freshly migrated schema.
+
+    Migrations only run the first time this is called.  After that a file
+    db gets the saved pages written back over it, and an in-memory db
+    (sql_connection of sqlite://) is swapped for a new connection loaded
+    from the saved dump.  Other databases are left alone.
+
+    """
+    global _DB_TEMPLATE
+    if not FLAGS.sql_connection.startswith('sqlite'):
+        return
+    if _DB_TEMPLATE is None:
+        _DB_TEMPLATE = _build_db_template()
+    pages, script = _DB_TEMPLATE
+
+    if FLAGS.sql_connection == 'sqlite://':
+        conn = sqlite3.connect(':memory:', check_same_thread=False)
+        conn.executescript(script)
+        # every session has to share the one connection or it would see
+        # an empty db of its own
+        db_session._ENGINE = sqlalchemy.create_engine(
+                'sqlite://', poolclass=pool.StaticPool, creator=lambda: conn)
+        db_session._MAKER = None
+        return
+
+    testdb = open(FLAGS.sql_connection[len('sqlite:///'):], 'wb')
+    try:
+        testdb.write(pages)
+    finally:
+        testdb.close()
+
+
 def skip_if_fake(func):
     """Decorator that skips a test if running in fake mode."""
     def _skipper(*args, **kw):
@@ -72,8 +145,9 @@ class TestCase(unittest.TestCase):
         #             now that we have some required db setup for the system
         #             to work properly.
         self.start = datetime.datetime.utcnow()
-        #shutil.copyfile(os.path.join(FLAGS.state_path, FLAGS.sqlite_clean_db),
-        #                os.path.join(FLAGS.state_path, FLAGS.sqlite_db))
+        reset_db()
+        # the restored db may not hold what the cache was filled from
+        db.instance_type_cache_clear(context.get_admin_context())
 
         # emulate some of the mox stuff, we can't use the metaclass
         # because it screws with our generators
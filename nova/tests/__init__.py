@@ -37,23 +37,6 @@ setattr(__builtin__, '_', lambda x: x)
 
 
 def setup():
+    # the clean db the tests start from is migrated on the first
+    # nova.test.TestCase.setUp, see nova.test.reset_db
     from nova.tests import fake_flags
-    return
-    import os
-    import shutil
-
-    from nova import context
-    from nova import flags
-    from nova.db import migration
-    from nova.network import manager as network_manager
-
-    FLAGS = flags.FLAGS
-
-    testdb = os.path.join(FLAGS.state_path, FLAGS.sqlite_db)
-    if os.path.exists(testdb):
-        os.unlink(testdb)
-    migration.db_sync()
-    ctxt = context.get_admin_context()
-
-    cleandb = os.path.join(FLAGS.state_path, FLAGS.sqlite_clean_db)
-    shutil.copyfile(testdb, cleandb)
@@ -120,6 +120,22 @@ def stub_out_auth(stubs):
         '__call__', fake_wsgi)
 
 
+def auth_token(app, name, admin=False):
+    """Add a user with a project of its own, return a token it got from app.
+
+    app has to authenticate through an AuthMiddleware set up with
+    fake_auth_init.
+
+    """
+    user = User(name, name, '%s_key' % name, None, admin)
+    FakeAuthManager().add_user(user)
+    FakeAuthManager().create_project('%s_project' % name, user)
+    request = webob.Request.blank('/')
+    request.headers['X-Auth-User'] = name
+    request.headers['X-Auth-Key'] = '%s_key' % name
+    return request.get_response(app).headers['X-Auth-Token']
+
+
 def stub_out_rate_limiting(stubs):
     def fake_rate_init(self, app):
         super(limits.RateLimitingMiddleware, self).__init__(app)
@@ -227,6 +243,7 @@ def stub_out_glance(stubs, initial_fixtures=None):
 class FakeToken(object):
     # FIXME(sirp): let's not use id here
     id = 0
+    expires_at = None
 
     def __init__(self, **kwargs):
         FakeToken.id += 1
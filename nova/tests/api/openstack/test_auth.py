@@ -27,6 +27,7 @@ import nova.auth.manager
 from nova import auth
 from nova import context
 from nova import db
+from nova import exception
 from nova import test
 from nova.tests.api.openstack import fakes
 
@@ -100,7 +101,8 @@ class Test(test.TestCase):
         def bad_token(meh, context, token_hash):
             return fakes.FakeToken(
                     token_hash=token_hash,
-                    created_at=datetime.datetime(1990, 1, 1))
+                    created_at=datetime.datetime(1990, 1, 1),
+                    expires_at=datetime.datetime(1990, 1, 3))
 
         self.stubs.Set(fakes.FakeAuthDatabase, 'auth_token_destroy',
             destroy_token_mock)
@@ -157,6 +159,7 @@ class TestFunctional(test.TestCase):
 
         db.auth_token_update(ctx, tok.token_hash, dict(
                 created_at=datetime.datetime(2000, 1, 1, 12, 0, 0),
+                expires_at=datetime.datetime(2000, 1, 3, 12, 0, 0),
                 ))
 
         req = webob.Request.blank('/v1.0/')
@@ -164,6 +167,26 @@ class TestFunctional(test.TestCase):
         result = req.get_response(fakes.wsgi_app())
         self.assertEqual(result.status, '401 Unauthorized')
 
+    def test_expired_tokens_are_purged(self):
+        ctx = context.get_admin_context()
+        tomorrow = datetime.datetime.utcnow() + datetime.timedelta(days=1)
+        for token_hash, expires_at in (('expired_token_hash',
+                                        datetime.datetime(2000, 1, 3)),
+                                       ('valid_token_hash', tomorrow)):
+            db.auth_token_create(ctx, dict(
+                    token_hash=token_hash,
+                    cdn_management_url='',
+                    server_management_url='',
+                    storage_url='',
+                    user_id='user1',
+                    expires_at=expires_at,
+                    ))
+
+        self.assertEqual(db.auth_token_destroy_expired(ctx), 1)
+        db.auth_token_get(ctx, 'valid_token_hash')
+        self.assertRaises(exception.NotFound, db.auth_token_get, ctx,
+                          'expired_token_hash')
+
     def test_token_doesnotexist(self):
         req = webob.Request.blank('/v1.0/')
         req.headers['X-Auth-Token'] = 'nonexistant_token_hash'
@@ -0,0 +1,92 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import gzip
+import StringIO
+import zlib
+
+import webob
+import webob.dec
+
+from nova import test
+from nova.api.openstack import compression
+
+
+BODY = ['{"servers": [', '{"id": 1, "name": "server-1"}, ' * 100, '{}]}']
+
+
+class ClosingIter(object):
+    """Body iterable that records whether it was closed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+class CompressionMiddlewareTest(test.TestCase):
+
+    def _get_response(self, encoding=None, chunks=BODY,
+                      content_type='application/json'):
+        self.body = ClosingIter(chunks)
+
+        @webob.dec.wsgify
+        def app(req):
+            response = webob.Response(content_type=content_type)
+            response.app_iter = self.body
+            return response
+
+        middleware = compression.CompressionMiddleware(app, min_size='100')
+        request = webob.Request.blank('/servers/detail')
+        if encoding is not None:
+            request.headers['Accept-Encoding'] = encoding
+        return request.get_response(middleware)
+
+    def test_gzip(self):
+        response = self._get_response('gzip, deflate')
+        self.assertEqual(response.content_encoding, 'gzip')
+        self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+        body = gzip.GzipFile(fileobj=StringIO.StringIO(response.body)).read()
+        self.assertEqual(body, ''.join(BODY))
+        self.assertTrue(self.body.closed)
+
+    def test_deflate(self):
+        response = self._get_response('gzip;q=0, deflate')
+        self.assertEqual(response.content_encoding, 'deflate')
+        self.assertEqual(zlib.decompress(response.body), ''.join(BODY))
+
+    def test_not_accepted(self):
+        for encoding in (None, 'identity'):
+            response = self._get_response(encoding)
+            self.assertEqual(response.content_encoding, None)
+            self.assertEqual(response.body, ''.join(BODY))
+
+    def test_below_min_size(self):
+        response = self._get_response('gzip', chunks=['{"servers": ', '[]}'])
+        self.assertEqual(response.content_encoding, None)
+        self.assertEqual(response.body, '{"servers": []}')
+        self.assertEqual(response.content_length, 15)
+        self.assertTrue(self.body.closed)
+
+    def test_uncompressible_type(self):
+        response = self._get_response('gzip', content_type='image/png')
+        self.assertEqual(response.content_encoding, None)
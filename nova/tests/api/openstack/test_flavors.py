@@ -158,6 +158,25 @@ class FlavorsTest(test.TestCase):
         }
         self.assertEqual(flavor, expected)
 
+    def test_get_flavor_not_modified_v1_1(self):
+        req = webob.Request.blank('/v1.1/flavors/12')
+        req.environ['api.version'] = '1.1'
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 200)
+        self.assertTrue(res.etag)
+
+        req = webob.Request.blank('/v1.1/flavors/12')
+        req.environ['api.version'] = '1.1'
+        req.headers['If-None-Match'] = '"%s"' % res.etag
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 304)
+        self.assertEqual(res.body, '')
+
+        self.stubs.Set(nova.db.api, "instance_type_get_by_flavor_id",
+                       lambda context, flavorid: stub_flavor(flavorid, "new"))
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 200)
+
     def test_get_flavor_list_v1_1(self):
         req = webob.Request.blank('/v1.1/flavors')
         req.environ['api.version'] = '1.1'
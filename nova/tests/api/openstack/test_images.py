@@ -39,6 +39,7 @@ from nova import test
 from nova import utils
 import nova.api.openstack
 from nova.api.openstack import images
+from nova.api.openstack.views import images as images_view
 from nova.tests.api.openstack import fakes
 
 
@@ -280,6 +281,16 @@ class ImageControllerWithGlanceServiceTest(test.TestCase):
 
         self.assertDictListMatch(response_list, expected)
 
+    def test_get_image_index_build_error_is_fault(self):
+        def _build(self, image_obj, detail=False):
+            raise exception.Error('view failed')
+
+        self.stubs.Set(images_view.ViewBuilder, 'build', _build)
+        request = webob.Request.blank('/v1.0/images/detail')
+        response = request.get_response(fakes.wsgi_app())
+        self.assertEqual(response.status_int, 500)
+        self.assertTrue('view failed' in response.body)
+
     def test_get_image(self):
         request = webob.Request.blank('/v1.0/images/123')
         response = request.get_response(fakes.wsgi_app())
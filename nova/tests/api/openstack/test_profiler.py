@@ -0,0 +1,107 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import json
+import os
+import pstats
+import shutil
+import tempfile
+
+import webob
+import webob.dec
+
+from nova import test
+from nova.api.openstack import auth
+from nova.api.openstack import profiler
+from nova.tests.api.openstack import fakes
+
+
+@webob.dec.wsgify
+def servers_app(req):
+    response = webob.Response(content_type='application/json')
+    response.app_iter = iter(['{"servers": ', '[]}'])
+    return response
+
+
+class ProfilerMiddlewareTest(test.TestCase):
+
+    def setUp(self):
+        super(ProfilerMiddlewareTest, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.flags(api_profile_path=self.path)
+        self.stubs.Set(auth.AuthMiddleware, '__init__', fakes.fake_auth_init)
+        fakes.FakeAuthManager.clear_fakes()
+        fakes.FakeAuthDatabase.data = {}
+        self.middleware = auth.AuthMiddleware(
+                profiler.ProfilerMiddleware(servers_app))
+        self.admin_token = fakes.auth_token(self.middleware, 'admin',
+                                            admin=True)
+        self.user_token = fakes.auth_token(self.middleware, 'user')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        super(ProfilerMiddlewareTest, self).tearDown()
+
+    def _get_response(self, token, request_id, headers=None):
+        request = webob.Request.blank('/v1.1/servers', headers=headers)
+        request.headers['X-Auth-Token'] = token
+        request.environ['nova.request_id'] = request_id
+        return request.get_response(self.middleware)
+
+    def test_admin_header(self):
+        response = self._get_response(self.admin_token, 'req-1',
+                                      {'X-Profile': '1'})
+        self.assertEqual(response.body, '{"servers": []}')
+        self.assertEqual(response.headers['X-Profile-Id'], 'req-1')
+
+        stats = pstats.Stats(os.path.join(self.path, 'req-1.prof'))
+        self.assertTrue(stats.total_calls > 0)
+        summary = json.load(open(os.path.join(self.path, 'req-1.json')))
+        self.assertEqual(summary['path'], '/v1.1/servers')
+        self.assertEqual(summary['status'], 200)
+        self.assertEqual(summary['rpc']['count'], 0)
+        self.assertTrue(summary['wall'] >= 0)
+
+    def test_stored_once_body_is_sent(self):
+        response = self._get_response(self.admin_token, 'req-4',
+                                      {'X-Profile': '1'})
+        self.assertEqual(os.listdir(self.path), [])
+        self.assertEqual(response.body, '{"servers": []}')
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['req-4.json', 'req-4.prof'])
+
+    def test_stored_when_body_is_dropped(self):
+        response = self._get_response(self.admin_token, 'req-5',
+                                      {'X-Profile': '1'})
+        del response
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['req-5.json', 'req-5.prof'])
+
+    def test_header_ignored_for_users(self):
+        response = self._get_response(self.user_token, 'req-2',
+                                      {'X-Profile': '1'})
+        self.assertEqual(response.body, '{"servers": []}')
+        self.assertFalse('X-Profile-Id' in response.headers)
+        self.assertEqual(os.listdir(self.path), [])
+
+    def test_sample_rate(self):
+        self.flags(api_profile_sample_rate=1.0)
+        response = self._get_response(self.user_token, 'req-3')
+        self.assertFalse('X-Profile-Id' in response.headers)
+        self.assertEqual(response.body, '{"servers": []}')
+        self.assertEqual(sorted(os.listdir(self.path)),
+                         ['req-3.json', 'req-3.prof'])
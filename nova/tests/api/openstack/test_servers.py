@@ -354,6 +354,18 @@ class ServersTest(test.TestCase):
             self.assertEqual(s.get('imageId', None), None)
             i += 1
 
+    def test_get_server_list_build_error_is_fault(self):
+        class FailingBuilder(object):
+            def build(self, inst, is_detail):
+                raise exception.Error('view failed')
+
+        self.stubs.Set(servers.ControllerV10, '_get_view_builder',
+                       lambda self, req: FailingBuilder())
+        req = webob.Request.blank('/v1.0/servers/detail')
+        res = req.get_response(fakes.wsgi_app())
+        self.assertEqual(res.status_int, 500)
+        self.assertTrue('view failed' in res.body)
+
     def test_get_server_list_v11(self):
         req = webob.Request.blank('/v1.1/servers')
         res = req.get_response(fakes.wsgi_app())
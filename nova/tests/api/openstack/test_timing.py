@@ -0,0 +1,103 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import webob
+import webob.dec
+
+from nova import rpc
+from nova import test
+from nova import wsgi
+from nova.api.openstack import auth
+from nova.api.openstack import timing
+from nova.tests.api.openstack import fakes
+
+
+@webob.dec.wsgify
+def servers_app(req):
+    start = time.time()
+    wsgi.add_timing(req.environ, 'controller', start)
+
+    def _body():
+        yield '{"servers": '
+        yield '[]}'
+
+    response = webob.Response(content_type='application/json')
+    response.app_iter = _body()
+    return response
+
+
+class TimingMiddlewareTest(test.TestCase):
+
+    def setUp(self):
+        super(TimingMiddlewareTest, self).setUp()
+        self.flags(sql_query_stats=False)
+        self.logged = []
+        self.stubs.Set(timing.LOG, 'info', self.logged.append)
+        self.stubs.Set(auth.AuthMiddleware, '__init__', fakes.fake_auth_init)
+        fakes.FakeAuthManager.clear_fakes()
+        fakes.FakeAuthDatabase.data = {}
+        self.middleware = timing.TimingMiddleware(
+                auth.AuthMiddleware(servers_app))
+        self.admin_token = fakes.auth_token(self.middleware, 'admin',
+                                            admin=True)
+        self.user_token = fakes.auth_token(self.middleware, 'user')
+        del self.logged[:]
+
+    def test_access_log(self):
+        request = webob.Request.blank('/v1.1/servers')
+        request.headers['X-Auth-Token'] = self.user_token
+        response = request.get_response(self.middleware)
+        self.assertFalse('X-Timing' in response.headers)
+        self.assertEqual(self.logged, [])
+
+        self.assertEqual(response.body, '{"servers": []}')
+        self.assertEqual(len(self.logged), 1)
+        line = self.logged[0]
+        self.assertTrue(line.startswith('GET /v1.1/servers 200 [%s] total='
+                                        % request.environ['nova.request_id']))
+        for phase in timing.PHASES:
+            self.assertTrue(' %s=' % phase in line)
+        self.assertTrue(' rpc_messages=0' in line)
+
+    def test_timing_header_for_admins(self):
+        request = webob.Request.blank('/v1.1/servers')
+        request.headers['X-Timing'] = '1'
+        request.headers['X-Auth-Token'] = self.admin_token
+        response = request.get_response(self.middleware)
+        self.assertEqual(len(self.logged), 1)
+        self.assertTrue(response.headers['X-Timing'].startswith('total='))
+        self.assertTrue(' serialization=' in response.headers['X-Timing'])
+        self.assertEqual(response.body, '{"servers": []}')
+
+        request = webob.Request.blank('/v1.1/servers')
+        request.headers['X-Timing'] = '1'
+        request.headers['X-Auth-Token'] = self.user_token
+        response = request.get_response(self.middleware)
+        self.assertFalse('X-Timing' in response.headers)
+
+    def test_access_log_when_body_is_dropped(self):
+        request = webob.Request.blank('/v1.1/servers')
+        request.headers['X-Auth-Token'] = self.user_token
+        response = request.get_response(self.middleware)
+        self.assertEqual(self.logged, [])
+        del response
+        self.assertEqual(len(self.logged), 1)
+        self.assertTrue(self.logged[0].startswith('GET /v1.1/servers 200'))
+        self.assertFalse(request.environ['nova.request_id'] in
+                         rpc._REQUEST_STATS)
@@ -21,6 +21,8 @@
 Test WSGI basics and provide some helper functions for other WSGI tests.
 """
 
+import datetime
+import hashlib
 import json
 from nova import test
 
@@ -28,6 +30,7 @@ import routes
 import webob
 
 from nova import exception
+from nova import utils
 from nova import wsgi
 
 
@@ -69,6 +72,124 @@ class Test(test.TestCase):
         self.assertNotEqual(result.body, "Router result")
 
 
+class FinishingBodyTest(test.TestCase):
+
+    def setUp(self):
+        super(FinishingBodyTest, self).setUp()
+        self.finished = 0
+        self.closed = 0
+
+    def _finish(self):
+        self.finished += 1
+
+    def _body(self):
+        test = self
+
+        class Body(object):
+            def __iter__(self):
+                return iter(['a', 'b'])
+
+            def close(self):
+                test.closed += 1
+
+        return wsgi.FinishingBody(Body(), self._finish)
+
+    def test_finished_on_close(self):
+        body = self._body()
+        self.assertEqual(iter(body).next(), 'a')
+        self.assertEqual(self.finished, 0)
+        body.close()
+        body.close()
+        self.assertEqual((self.finished, self.closed), (1, 1))
+
+    def test_finished_when_read(self):
+        body = self._body()
+        self.assertEqual(''.join(body), 'ab')
+        self.assertEqual((self.finished, self.closed), (1, 1))
+        body.close()
+        self.assertEqual(self.finished, 1)
+
+    def test_finished_when_dropped(self):
+        body = self._body()
+        iter(body).next()
+        del body
+        self.assertEqual(self.finished, 1)
+        self.assertEqual(wsgi._UNFINISHED_BODIES, {})
+
+
+class RouteTableTest(test.TestCase):
+
+    def setUp(self):
+        super(RouteTableTest, self).setUp()
+        self.mapper = routes.Mapper()
+        self.mapper.resource("server", "servers", controller="servers",
+                             collection={'detail': 'GET'},
+                             member={'action': 'POST'})
+        self.mapper.resource("ip", "ips", controller="ips",
+                             collection={'public': 'GET'},
+                             parent_resource=dict(member_name='server',
+                                                  collection_name='servers'))
+        self.mapper.connect("/v1.0/{path_info:.*}", controller="v10")
+        self.mapper.create_regs()
+        self.table = wsgi.RouteTable(self.mapper)
+
+    def test_matches_like_routes(self):
+        paths = ['/servers', '/servers.json', '/servers/detail',
+                 '/servers/detail.xml', '/servers/1', '/servers/1.2.json',
+                 '/servers/1/action', '/servers/1/ips/public',
+                 '/servers/1/ips/2.json', '/v1.0/servers/1', '/missing',
+                 '/servers/', '/']
+        for path in paths:
+            for method in ('GET', 'POST', 'PUT', 'DELETE'):
+                environ = {'REQUEST_METHOD': method, 'PATH_INFO': path}
+                expected = self.mapper.routematch(path, environ)
+                self.assertEqual(tuple(expected or (None, None)),
+                                 self.table.match(path, environ))
+
+    def test_dispatcher_sets_routing_args(self):
+        def application(environ, start_response):
+            start_response("200 OK", [])
+            match = environ['wsgiorg.routing_args'][1]
+            return ['%(controller)s %(action)s %(id)s' % match]
+
+        dispatcher = wsgi.RouteDispatcher(application, self.mapper)
+        result = webob.Request.blank('/servers/5').get_response(dispatcher)
+        self.assertEqual(result.body, 'servers show 5')
+        request = webob.Request.blank('/servers/5?_method=DELETE')
+        result = request.get_response(dispatcher)
+        self.assertEqual(result.body, 'servers delete 5')
+
+
+    def test_dispatcher_sets_request_config(self):
+        def application(environ, start_response):
+            start_response("200 OK", [])
+            config = routes.request_config()
+            return ['%s %s %s' % (config.host, config.mapper_dict['id'],
+                                  routes.url_for('server', id=7))]
+
+        dispatcher = wsgi.RouteDispatcher(application, self.mapper)
+        request = webob.Request.blank('/servers/5',
+                                      {'HTTP_HOST': 'nova.example'})
+        result = request.get_response(dispatcher)
+        self.assertEqual(result.body, 'nova.example 5 /servers/7')
+
+    def test_dispatcher_method_override_is_a_parameter(self):
+        def fallback(environ, start_response):
+            start_response("200 OK", [])
+            return ['fallback']
+
+        def application(environ, start_response):
+            start_response("200 OK", [])
+            return ['table']
+
+        dispatcher = wsgi.RouteDispatcher(application, self.mapper)
+        dispatcher._fallback = fallback
+        request = webob.Request.blank('/servers/5?name=_method')
+        self.assertEqual(request.get_response(dispatcher).body, 'table')
+        request = webob.Request.blank('/servers/5?_method=DELETE')
+        self.assertEqual(request.get_response(dispatcher).body, 'fallback')
+
+
 class ControllerTest(test.TestCase):
 
     class TestRouter(wsgi.Router):
@@ -83,6 +204,12 @@ class ControllerTest(test.TestCase):
             def show(self, req, id):  # pylint: disable=W0622,C0103
                 return {"test": {"id": id}}
 
+            @wsgi.conditional
+            def index(self, req):
+                req.environ['nova.last_modified'] = datetime.datetime(
+                        2011, 6, 1, 12, 0, 0, 500)
+                return {"tests": [{"id": "1"}]}
+
         def __init__(self):
             mapper = routes.Mapper()
             mapper.resource("test", "tests", controller=self.TestController())
@@ -93,6 +220,75 @@ class ControllerTest(test.TestCase):
         result = request.get_response(self.TestRouter())
         self.assertEqual(json.loads(result.body), {"test": {"id": "123"}})
 
+    def test_show_xml(self):
+        request = webob.Request.blank('/tests/123.xml')
+        result = request.get_response(self.TestRouter())
+        self.assertEqual(result.body.strip(), '<test id="123"/>')
+
+    def test_content_length(self):
+        for path in ('/tests/123', '/tests/123.xml', '/tests'):
+            result = wsgi.Request.blank(path).get_response(self.TestRouter())
+            self.assertEqual(result.content_length, len(result.body))
+
+    def test_serializer_reused(self):
+        controller = self.TestRouter.TestController()
+        serializer = controller._get_serializer()
+        self.assertTrue(serializer is controller._get_serializer())
+        self.assertTrue(serializer is
+                        self.TestRouter.TestController()._get_serializer())
+        self.assertFalse(serializer is controller._get_serializer('urn:x'))
+
+    def test_conditional_get(self):
+        result = wsgi.Request.blank('/tests').get_response(self.TestRouter())
+        self.assertEqual(result.status_int, 200)
+        self.assertTrue(result.etag)
+        self.assertEqual(result.headers['Last-Modified'],
+                         'Wed, 01 Jun 2011 12:00:00 GMT')
+        self.assertFalse('ETag' in wsgi.Request.blank('/tests/1').get_response(
+                self.TestRouter()).headers)
+
+        request = wsgi.Request.blank('/tests')
+        request.headers['If-None-Match'] = '"%s"' % result.etag
+        not_modified = request.get_response(self.TestRouter())
+        self.assertEqual(not_modified.status_int, 304)
+        self.assertEqual(not_modified.etag, result.etag)
+        self.assertEqual(not_modified.body, '')
+
+        request = wsgi.Request.blank('/tests.xml')
+        request.headers['If-None-Match'] = '"%s"' % result.etag
+        self.assertEqual(request.get_response(self.TestRouter()).status_int,
+                         200)
+
+    def test_conditional_get_sends_canonical_json(self):
+        result = wsgi.Request.blank('/tests').get_response(self.TestRouter())
+        self.assertEqual(result.body, '{"tests": [{"id": "1"}]}')
+        self.assertEqual(result.etag, wsgi.make_etag(
+                'application/json', None, result.body))
+
+    def test_make_etag_is_canonical(self):
+        etag = wsgi.make_etag({'b': 1, 'a': [{'d': 2, 'c': 3}]})
+        self.assertEqual(etag, hashlib.md5(
+                '[{"a": [{"c": 3, "d": 2}], "b": 1}]').hexdigest())
+        # set_json_backend replaces both, so have them restored
+        self.stubs.Set(utils, 'json', utils.json)
+        self.stubs.Set(utils, '_json_encoders', utils._json_encoders)
+        utils.set_json_backend(json)
+        self.assertEqual(etag,
+                         wsgi.make_etag({'a': [{'c': 3, 'd': 2}], 'b': 1}))
+
+    def test_conditional_get_modified_since(self):
+        request = wsgi.Request.blank('/tests')
+        request.headers['If-Modified-Since'] = 'Wed, 01 Jun 2011 12:00:00 GMT'
+        self.assertEqual(request.get_response(self.TestRouter()).status_int,
+                         304)
+        request.headers['If-Modified-Since'] = 'Wed, 01 Jun 2011 11:59:59 GMT'
+        self.assertEqual(request.get_response(self.TestRouter()).status_int,
+                         200)
+        request.headers['If-Modified-Since'] = 'Wed, 01 Jun 2011 12:00:00 GMT'
+        request.headers['If-None-Match'] = '"stale"'
+        self.assertEqual(request.get_response(self.TestRouter()).status_int,
+                         200)
+
     def test_response_content_type_from_accept_xml(self):
         request = webob.Request.blank('/tests/123')
         request.headers["Accept"] = "application/xml"
@@ -200,6 +396,85 @@ class SerializerTest(test.TestCase):
         result = result.replace('\n', '').replace(' ', '')
         self.assertEqual(result, expected_xml)
 
+    def test_xml_compact(self):
+        input_dict = dict(servers=[dict(id=1, name='a&b')])
+        metadata = {'application/xml': dict(attributes={'server': ['id']})}
+        serializer = wsgi.Serializer(metadata, 'urn:x', pretty=False)
+        result = serializer.serialize(input_dict, "application/xml")
+        self.assertEqual(result, '<servers xmlns="urn:x"><server id="1">'
+                                 '<name>a&amp;b</name></server></servers>')
+
+    def test_xml_single_attribute_name(self):
+        input_dict = dict(fault=dict(code=404, message='gone'))
+        metadata = {'application/xml': dict(attributes={'fault': 'code'})}
+        serializer = wsgi.Serializer(metadata, pretty=False)
+        result = serializer.serialize(input_dict, "application/xml")
+        self.assertEqual(result,
+                         '<fault code="404"><message>gone</message></fault>')
+
+    def test_xml_collections(self):
+        input_dict = dict(server=dict(public=['1.2.3.4'], metadata=dict(a=1),
+                                      empty=[]))
+        metadata = {'application/xml': dict(
+                list_collections={'public': dict(item_name='ip',
+                                                 item_key='addr')},
+                dict_collections={'metadata': dict(item_name='meta',
+                                                   item_key='key')})}
+        serializer = wsgi.Serializer(metadata, pretty=False)
+        result = serializer.serialize(input_dict, "application/xml")
+        self.assertTrue('<public><ip addr="1.2.3.4"/></public>' in result)
+        self.assertTrue('<metadata><meta key="a">1</meta></metadata>'
+                        in result)
+        self.assertTrue('<empty/>' in result)
+
+    def test_xml_iter_matches_serialize(self):
+        input_dict = dict(servers=[dict(id=i) for i in xrange(2000)])
+        serializer = wsgi.Serializer()
+        chunks = list(serializer.serialize_iter(input_dict,
+                                                "application/xml"))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(''.join(chunks),
+                         serializer.serialize(input_dict, "application/xml"))
+
+    def test_iter_lazy_lists(self):
+        serializer = wsgi.Serializer({'application/xml': {
+                'attributes': {'server': ['id']},
+                'list_collections': {'ips': {'item_name': 'ip',
+                                             'item_key': 'addr'}}}})
+
+        def _servers(count):
+            return dict(servers=[dict(id=i, ips=['10.0.0.%d' % i], tags=[])
+                                 for i in xrange(count)])
+
+        def _lazy_servers(count):
+            return dict(servers=(dict(id=i, ips=iter(['10.0.0.%d' % i]),
+                                      tags=iter([]))
+                                 for i in xrange(count)))
+
+        for content_type in ('application/json', 'application/xml'):
+            expected = serializer.serialize(_servers(2000), content_type)
+            chunks = list(serializer.serialize_iter(_lazy_servers(2000),
+                                                    content_type))
+            self.assertTrue(len(chunks) > 1)
+            self.assertEqual(''.join(chunks), expected)
+
+    def test_iter_reads_lazy_lists_late(self):
+        built = []
+
+        def _servers():
+            for i in xrange(3):
+                built.append(i)
+                yield dict(id=i)
+
+        serializer = wsgi.Serializer()
+        for content_type in ('application/json', 'application/xml'):
+            del built[:]
+            chunks = serializer.serialize_iter(dict(servers=_servers()),
+                                               content_type)
+            self.assertEqual(built, [])
+            self.assertTrue(''.join(chunks))
+            self.assertEqual(built, [0, 1, 2])
+
     def test_json(self):
         input_dict = dict(servers=dict(a=(2, 3)))
         expected_json = '{"servers":{"a":[2,3]}}'
@@ -256,3 +531,39 @@ class SerializerTest(test.TestCase):
         serializer = wsgi.Serializer()
         self.assertEqual(serializer.deserialize(xml, "application/xml"),
                          as_dict)
+
+    def test_deserialize_xml_list_with_whitespace(self):
+        xml = """
+            <a>
+              <bs>
+                <b>1</b>
+                <b>2</b>
+              </bs>
+            </a>
+            """.strip()
+        metadata = {'application/xml': dict(plurals={'bs': 'b'})}
+        serializer = wsgi.Serializer(metadata)
+        self.assertEqual(serializer.deserialize(xml, "application/xml"),
+                         {'a': {'bs': ['1', '2']}})
+
+    def test_deserialize_malformed_xml(self):
+        serializer = wsgi.Serializer()
+        self.assertRaises(exception.MalformedRequestBody,
+                          serializer.deserialize, '<a>', "application/xml")
+
+    def test_deserialize_xml_with_doctype(self):
+        xml = '<!DOCTYPE a [<!ENTITY b "bbbb">]><a>&b;</a>'
+        serializer = wsgi.Serializer()
+        self.assertRaises(exception.MalformedRequestBody,
+                          serializer.deserialize, xml, "application/xml")
+
+    def test_parse_xml_limits(self):
+        self.assertRaises(exception.MalformedRequestBody,
+                          wsgi.parse_xml, '<a>%s</a>' % ('x' * 100),
+                          max_size=64)
+        self.assertRaises(exception.MalformedRequestBody,
+                          wsgi.parse_xml, '<a><b><c/></b></a>', max_depth=2)
+        self.assertRaises(exception.MalformedRequestBody,
+                          wsgi.parse_xml, '<a><b/><b/></a>', max_elements=2)
+        root = wsgi.parse_xml('<a><b/><b/></a>', max_elements=3)
+        self.assertEqual(['b', 'b'], [b.name for b in root.children])
@@ -0,0 +1,673 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the helpers of the db api."""
+
+import datetime
+import warnings
+
+from sqlalchemy import exc
+from sqlalchemy import sql
+
+from nova import context
+from nova import db
+from nova import exception
+from nova import test
+from nova import utils
+from nova.db.sqlalchemy import api as sqlalchemy_api
+from nova.db.sqlalchemy import models
+from nova.db.sqlalchemy import session as sqlalchemy_session
+
+
+class UpdateWithRetryTestCase(test.TestCase):
+    """Test retrying versioned updates."""
+
+    def setUp(self):
+        super(UpdateWithRetryTestCase, self).setUp()
+        self.reads = 0
+
+    def _get(self):
+        self.reads += 1
+        return {'version': self.reads}
+
+    def test_retries_until_applied(self):
+        def update(row):
+            if row['version'] < 3:
+                raise exception.UpdateConflict(table='instances', id=1,
+                                               version=row['version'])
+            return row['version'] + 1
+
+        self.assertEqual(4, db.update_with_retry(self._get, update))
+        self.assertEqual(3, self.reads)
+
+    def test_gives_up_after_attempts(self):
+        def update(row):
+            raise exception.UpdateConflict(table='instances', id=1,
+                                           version=row['version'])
+
+        self.assertRaises(exception.UpdateConflict,
+                          db.update_with_retry, self._get, update, 2)
+        self.assertEqual(2, self.reads)
+
+
+class AllocateFreeRowTestCase(test.TestCase):
+    """Test claiming free rows when an UPDATE fails."""
+
+    def setUp(self):
+        super(AllocateFreeRowTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        for blade_id in (1, 2):
+            db.export_device_create_safe(self.context,
+                                         {'shelf_id': 0,
+                                          'blade_id': blade_id})
+        self.errors = []
+        get_session = sqlalchemy_api.get_session
+
+        def _get_session():
+            session = get_session()
+            execute = session.execute
+
+            def _execute(statement, *args, **kwargs):
+                if self.errors and isinstance(statement, sql.Update):
+                    raise exc.OperationalError(str(statement), {},
+                                               self.errors.pop())
+                return execute(statement, *args, **kwargs)
+
+            session.execute = _execute
+            return session
+
+        self.stubs.Set(sqlalchemy_api, 'get_session', _get_session)
+
+    def test_locked_candidate_is_skipped(self):
+        self.errors.append(Exception('database is locked'))
+        db.volume_allocate_shelf_and_blade(self.context, 1)
+        self.assertEqual(self.errors, [])
+        self.assertEqual(1, db.export_device_count(self.context) -
+                         self._free_count())
+
+    def test_other_errors_are_raised(self):
+        self.errors.append(Exception('no such column: volume_id'))
+        self.assertRaises(exc.OperationalError,
+                          db.volume_allocate_shelf_and_blade,
+                          self.context, 1)
+        self.assertEqual(0, db.export_device_count(self.context) -
+                         self._free_count())
+
+    def _free_count(self):
+        session = sqlalchemy_session.get_session()
+        return session.query(models.ExportDevice).\
+                       filter_by(volume_id=None).\
+                       count()
+
+
+class StreamTestCase(test.TestCase):
+    """Test iterating over admin wide listings in chunks."""
+
+    def setUp(self):
+        super(StreamTestCase, self).setUp()
+        self.flags(db_bulk_chunk_size=2)
+        self.context = context.get_admin_context()
+        network = db.network_create_safe(self.context,
+                                         {'cidr': '10.0.0.0/24'})
+        for i in xrange(5):
+            instance = db.instance_create(self.context,
+                                          {'host': 'host%d' % (i % 2),
+                                           'state': 1})
+            db.fixed_ip_create(self.context,
+                               {'address': '10.0.0.%d' % i,
+                                'network_id': network['id'],
+                                'instance_id': instance['id']})
+
+    def test_instances_match_listing(self):
+        expected = [i['id'] for i in db.instance_get_all(self.context)]
+        streamed = [i['id'] for i in db.instance_get_all_iter(self.context)]
+        self.assertEqual(expected, streamed)
+
+    def test_instances_by_host(self):
+        streamed = db.instance_get_all_iter(self.context, 'host1')
+        self.assertEqual(['host1', 'host1'], [i['host'] for i in streamed])
+
+    def test_fixed_ips(self):
+        streamed = list(db.fixed_ip_get_all_iter(self.context))
+        self.assertEqual(5, len(streamed))
+        self.assertEqual('10.0.0.0/24', streamed[0]['network']['cidr'])
+        by_host = db.fixed_ip_get_all_iter(self.context, 'host0')
+        self.assertEqual(3, len(list(by_host)))
+
+
+class InstanceTypeCacheTestCase(test.TestCase):
+    """Test the cached instance type lookups against the db."""
+
+    def setUp(self):
+        super(InstanceTypeCacheTestCase, self).setUp()
+        self.flags(instance_type_cache_ttl=300)
+        self.context = context.get_admin_context()
+        self._create('test.small', 901)
+        self._create('test.medium', 903)
+
+    def _create(self, name, flavorid):
+        return db.instance_type_create(self.context,
+                                       {'name': name,
+                                        'memory_mb': 512,
+                                        'vcpus': 1,
+                                        'local_gb': 10,
+                                        'flavorid': flavorid})
+
+    def _set_memory_behind_cache(self, name, memory_mb):
+        session = sqlalchemy_session.get_session()
+        session.query(models.InstanceTypes).\
+                filter_by(name=name).\
+                update({'memory_mb': memory_mb})
+
+    def test_reads_are_cached(self):
+        before = db.instance_type_cache_stats(self.context)
+        db.instance_type_get_all(self.context)
+        db.instance_type_get_all(self.context)
+        db.instance_type_get_by_flavor_id(self.context, 901)
+        db.instance_type_get_by_flavor_id(self.context, 901)
+        after = db.instance_type_cache_stats(self.context)
+        self.assertEqual(2, after['misses'] - before['misses'])
+        self.assertEqual(2, after['hits'] - before['hits'])
+
+    def test_cached_values_are_copies(self):
+        db.instance_type_get_all(self.context)['test.small']['vcpus'] = 8
+        db.instance_type_get_by_flavor_id(self.context, 901)['vcpus'] = 8
+        self.assertEqual(1, db.instance_type_get_all(
+                                self.context)['test.small']['vcpus'])
+        self.assertEqual(1, db.instance_type_get_by_flavor_id(
+                                self.context, 901)['vcpus'])
+
+    def test_clear_drops_cached_values(self):
+        db.instance_type_get_all(self.context)
+        db.instance_type_get_by_flavor_id(self.context, 901)
+        self._set_memory_behind_cache('test.small', 1024)
+        self.assertEqual(512, db.instance_type_get_all(
+                                self.context)['test.small']['memory_mb'])
+        self.assertEqual(512, db.instance_type_get_by_flavor_id(
+                                self.context, 901)['memory_mb'])
+
+        db.instance_type_cache_clear(self.context)
+        self.assertEqual(0, db.instance_type_cache_stats(self.context)['size'])
+        self.assertEqual(1024, db.instance_type_get_all(
+                                self.context)['test.small']['memory_mb'])
+        self.assertEqual(1024, db.instance_type_get_by_flavor_id(
+                                self.context, 901)['memory_mb'])
+
+    def test_create_invalidates(self):
+        self.assertFalse('test.large' in
+                         db.instance_type_get_all(self.context))
+        self.assertRaises(exception.FlavorNotFound,
+                          db.instance_type_get_by_flavor_id,
+                          self.context, 902)
+        self._create('test.large', 902)
+        self.assertTrue('test.large' in
+                        db.instance_type_get_all(self.context))
+        self.assertEqual('test.large', db.instance_type_get_by_flavor_id(
+                                           self.context, 902)['name'])
+
+    def test_destroy_invalidates(self):
+        self.assertFalse(db.instance_type_get_by_flavor_id(
+                             self.context, 901)['deleted'])
+        self.assertTrue('test.small' in
+                        db.instance_type_get_all(self.context))
+        db.instance_type_destroy(self.context, 'test.small')
+        self.assertFalse('test.small' in
+                         db.instance_type_get_all(self.context))
+        self.assertTrue('test.small' in
+                        db.instance_type_get_all(self.context, True))
+        self.assertTrue(db.instance_type_get_by_flavor_id(
+                            self.context, 901)['deleted'])
+
+    def test_purge_invalidates(self):
+        db.instance_type_get_by_flavor_id(self.context, 901)
+        db.instance_type_purge(self.context, 'test.small')
+        self.assertRaises(exception.FlavorNotFound,
+                          db.instance_type_get_by_flavor_id,
+                          self.context, 901)
+
+
+class InstanceMetadataTestCase(test.TestCase):
+    """Test the bulk instance metadata calls."""
+
+    def setUp(self):
+        super(InstanceMetadataTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.instance_ids = [db.instance_create(self.context, {})['id']
+                             for i in xrange(3)]
+
+    def test_update_or_create_inserts_and_updates(self):
+        instance_id = self.instance_ids[0]
+        db.instance_metadata_update_or_create(self.context, instance_id,
+                                              {'a': '1', 'b': '2'})
+        db.instance_metadata_update_or_create(self.context, instance_id,
+                                              {'b': '3', 'c': '4'})
+        self.assertEqual({'a': '1', 'b': '3', 'c': '4'},
+                         db.instance_metadata_get(self.context, instance_id))
+
+    def test_update_or_create_recreates_deleted_keys(self):
+        instance_id = self.instance_ids[0]
+        db.instance_metadata_update_or_create(self.context, instance_id,
+                                              {'a': '1'})
+        db.instance_metadata_delete(self.context, instance_id, 'a')
+        db.instance_metadata_update_or_create(self.context, instance_id,
+                                              {'a': '2'})
+        self.assertEqual({'a': '2'},
+                         db.instance_metadata_get(self.context, instance_id))
+
+    def test_update_or_create_empty_metadata(self):
+        instance_id = self.instance_ids[0]
+        db.instance_metadata_update_or_create(self.context, instance_id,
+                                              {'a': '1'})
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            db.instance_metadata_update_or_create(self.context,
+                                                  instance_id, {})
+        self.assertEqual({'a': '1'},
+                         db.instance_metadata_get(self.context, instance_id))
+
+    def test_get_all_by_instances(self):
+        self.flags(db_bulk_chunk_size=2)
+        first, second, third = self.instance_ids
+        db.instance_metadata_update_or_create(self.context, first,
+                                              {'a': '1', 'b': '2'})
+        db.instance_metadata_update_or_create(self.context, third,
+                                              {'a': '3', 'c': '4'})
+        db.instance_metadata_delete(self.context, third, 'c')
+        self.assertEqual({first: {'a': '1', 'b': '2'},
+                          second: {},
+                          third: {'a': '3'}},
+                         db.instance_metadata_get_all_by_instances(
+                                 self.context, iter(self.instance_ids)))
+
+    def test_get_all_by_no_instances(self):
+        self.assertEqual({}, db.instance_metadata_get_all_by_instances(
+                                 self.context, []))
+
+
+class InstanceUsageByHostTestCase(test.TestCase):
+    """Test the per host usage totals."""
+
+    def setUp(self):
+        super(InstanceUsageByHostTestCase, self).setUp()
+        self.context = context.get_admin_context()
+
+    def _create(self, host, project_id='p1', vcpus=1, memory_mb=512,
+                local_gb=10):
+        return db.instance_create(self.context, {'host': host,
+                                                 'project_id': project_id,
+                                                 'vcpus': vcpus,
+                                                 'memory_mb': memory_mb,
+                                                 'local_gb': local_gb})
+
+    def test_no_instances(self):
+        self.assertEqual({}, db.instance_get_usage_by_host(self.context))
+
+    def test_totals_per_host(self):
+        self._create('host1')
+        self._create('host1', vcpus=2, memory_mb=1024, local_gb=20)
+        self._create('host2', project_id='p2')
+        self.assertEqual({'host1': {'instances': 2, 'vcpus': 3,
+                                    'memory_mb': 1536, 'local_gb': 30},
+                          'host2': {'instances': 1, 'vcpus': 1,
+                                    'memory_mb': 512, 'local_gb': 10}},
+                         db.instance_get_usage_by_host(self.context))
+
+    def test_skips_unscheduled_and_deleted_instances(self):
+        self._create(None)
+        deleted = self._create('host1')
+        db.instance_destroy(self.context, deleted['id'])
+        self.assertEqual({}, db.instance_get_usage_by_host(self.context))
+
+    def test_missing_sizes_count_as_zero(self):
+        self._create('host1', vcpus=None, memory_mb=None, local_gb=None)
+        self.assertEqual({'host1': {'instances': 1, 'vcpus': 0,
+                                    'memory_mb': 0, 'local_gb': 0}},
+                         db.instance_get_usage_by_host(self.context))
+
+    def test_by_project(self):
+        self._create('host1')
+        self._create('host1', project_id='p2')
+        self._create('host2', project_id='p2')
+        usage = db.instance_get_usage_by_host(self.context, by_project=True)
+        self.assertEqual([('host1', 'p1'), ('host1', 'p2'), ('host2', 'p2')],
+                         sorted(usage.keys()))
+        usage = db.instance_get_usage_by_host(self.context, project_id='p2')
+        self.assertEqual({'host1': 1, 'host2': 1},
+                         dict([(host, totals['instances'])
+                               for host, totals in usage.iteritems()]))
+        self.assertEqual({}, db.instance_get_usage_by_host(self.context,
+                                                           project_id='p3'))
+
+
+    def test_compute_services_sorted_by_cores(self):
+        for host in ('host1', 'host2', 'host3'):
+            db.service_create(self.context, {'host': host,
+                                             'binary': 'nova-compute',
+                                             'topic': 'compute'})
+        db.service_create(self.context, {'host': 'host4',
+                                         'binary': 'nova-compute',
+                                         'topic': 'compute',
+                                         'disabled': True})
+        self._create('host1', vcpus=4)
+        self._create('host2', vcpus=1)
+        self._create('host2', vcpus=2)
+        self._create('host4', vcpus=1)
+        self.assertEqual([('host3', 0), ('host2', 3), ('host1', 4)],
+                         [(service['host'], cores) for service, cores in
+                          db.service_get_all_compute_sorted(self.context)])
+
+
+class ArchiveDeletedRowsTestCase(test.TestCase):
+    """Test moving soft deleted rows into the shadow tables."""
+
+    def setUp(self):
+        super(ArchiveDeletedRowsTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        utils.set_time_override(datetime.datetime.utcnow())
+
+    def tearDown(self):
+        utils.clear_time_override()
+        super(ArchiveDeletedRowsTestCase, self).tearDown()
+
+    def _ids(self, table_name):
+        session = sqlalchemy_session.get_session()
+        rows = session.execute('SELECT id FROM %s ORDER BY id' % table_name)
+        return [row[0] for row in rows]
+
+    def _archive(self, max_rows=None):
+        utils.advance_time_seconds(2 * 24 * 60 * 60)
+        return db.archive_deleted_rows(self.context, 1, max_rows)
+
+    def test_archives_old_deleted_rows(self):
+        kept = db.instance_create(self.context, {})
+        deleted = db.instance_create(self.context, {})
+        db.instance_metadata_update_or_create(self.context, deleted['id'],
+                                              {'a': '1'})
+        db.instance_destroy(self.context, deleted['id'])
+        archived = self._archive()
+        self.assertEqual(1, archived['instances'])
+        self.assertEqual(1, archived['instance_metadata'])
+        self.assertEqual([kept['id']], self._ids('instances'))
+        self.assertEqual([deleted['id']], self._ids('shadow_instances'))
+        self.assertEqual([], self._ids('instance_metadata'))
+
+    def test_keeps_recently_deleted_rows(self):
+        instance = db.instance_create(self.context, {})
+        db.instance_destroy(self.context, instance['id'])
+        archived = db.archive_deleted_rows(self.context, 1)
+        self.assertEqual(0, archived['instances'])
+        self.assertEqual([instance['id']], self._ids('instances'))
+        self.assertEqual([], self._ids('shadow_instances'))
+
+    def test_keeps_referenced_rows(self):
+        network = db.network_create_safe(self.context,
+                                         {'cidr': '10.0.0.0/24'})
+        instance = db.instance_create(self.context, {})
+        db.fixed_ip_create(self.context, {'address': '10.0.0.2',
+                                          'network_id': network['id'],
+                                          'instance_id': instance['id']})
+        db.instance_destroy(self.context, instance['id'])
+        archived = self._archive()
+        self.assertEqual(0, archived['instances'])
+        self.assertEqual([instance['id']], self._ids('instances'))
+        self.assertEqual([], self._ids('shadow_instances'))
+
+    def test_stops_after_max_rows(self):
+        self.flags(db_bulk_chunk_size=2)
+        for i in xrange(5):
+            instance = db.instance_create(self.context, {})
+            db.instance_destroy(self.context, instance['id'])
+        archived = self._archive(max_rows=3)
+        self.assertEqual(3, archived['instances'])
+        self.assertEqual(2, len(self._ids('instances')))
+        self.assertEqual(3, len(self._ids('shadow_instances')))
+
+
+class SecurityGroupRulesByInstancesTestCase(test.TestCase):
+    """Test fetching the security group rules of many instances."""
+
+    def setUp(self):
+        super(SecurityGroupRulesByInstancesTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.web = self._group('web', [80, 443])
+        self.ssh = self._group('ssh', [22])
+        self.both = self._instance('host1', self.web, self.ssh)
+        self.web_only = self._instance('host2', self.web)
+        self.none = self._instance('host1')
+
+    def _group(self, name, ports):
+        group = db.security_group_create(self.context,
+                                         {'name': name,
+                                          'project_id': 'fake',
+                                          'user_id': 'fake'})
+        for port in ports:
+            db.security_group_rule_create(self.context,
+                                          {'parent_group_id': group['id'],
+                                           'protocol': 'tcp',
+                                           'from_port': port,
+                                           'to_port': port,
+                                           'cidr': '0.0.0.0/0'})
+        return group
+
+    def _instance(self, host, *groups):
+        instance = db.instance_create(self.context, {'host': host})
+        for group in groups:
+            db.instance_add_security_group(self.context, instance['id'],
+                                           group['id'])
+        return instance
+
+    def _ports(self, rules_by_instance):
+        return dict([(instance_id, sorted([rule['from_port']
+                                           for rule in rules]))
+                     for instance_id, rules in rules_by_instance.iteritems()])
+
+    def test_by_instance_ids(self):
+        self.flags(db_bulk_chunk_size=1)
+        rules = db.security_group_rule_get_by_instances(
+                self.context,
+                [self.both['id'], self.web_only['id'], self.none['id']])
+        self.assertEqual({self.both['id']: [22, 80, 443],
+                          self.web_only['id']: [80, 443]},
+                         self._ports(rules))
+
+    def test_by_host(self):
+        rules = db.security_group_rule_get_by_instances(self.context,
+                                                        host='host1')
+        self.assertEqual({self.both['id']: [22, 80, 443]},
+                         self._ports(rules))
+        self.assertEqual({}, db.security_group_rule_get_by_instances(
+                                 self.context, host='host3'))
+
+    def test_instances_in_no_group(self):
+        self.assertEqual({}, db.security_group_rule_get_by_instances(
+                                 self.context, [self.none['id']]))
+        self.assertEqual({}, db.security_group_rule_get_by_instances(
+                                 self.context, []))
+
+    def test_skips_deleted_groups_and_instances(self):
+        db.security_group_destroy(self.context, self.ssh['id'])
+        db.instance_destroy(self.context, self.web_only['id'])
+        rules = db.security_group_rule_get_by_instances(
+                self.context, [self.both['id'], self.web_only['id']])
+        self.assertEqual({self.both['id']: [80, 443]}, self._ports(rules))
+
+
+class QuotaUsageTestCase(test.TestCase):
+    """Test the quota usage counters and reservations."""
+
+    def setUp(self):
+        super(QuotaUsageTestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.project_id = 'fake'
+        self.limits = {'instances': 10, 'cores': 8}
+
+    def _create_instance(self, vcpus):
+        return db.instance_create(self.context,
+                                  {'project_id': self.project_id,
+                                   'vcpus': vcpus})
+
+    def _usage(self, field='in_use'):
+        usages = db.quota_usage_get_all_by_project(self.context,
+                                                   self.project_id)
+        return dict([(resource, usage[field])
+                     for resource, usage in usages.iteritems()])
+
+    def _reserved(self):
+        return self._usage('reserved')
+
+    def test_first_read_counts_live_tables(self):
+        self._create_instance(2)
+        self._create_instance(1)
+        db.volume_create(self.context, {'project_id': self.project_id,
+                                        'size': 5})
+        self.assertEqual({'instances': 2, 'cores': 3, 'volumes': 1,
+                          'gigabytes': 5, 'floating_ips': 0},
+                         self._usage())
+
+    def test_concurrent_first_reads(self):
+        count = sqlalchemy_api._quota_usage_count
+        raced = []
+
+        def racing_count(session, project_id):
+            if not raced:
+                raced.append(project_id)
+                # a concurrent first request creates the rows meanwhile
+                db.quota_usage_get_all_by_project(self.context, project_id)
+            return count(session, project_id)
+
+        self._create_instance(2)
+        self.stubs.Set(sqlalchemy_api, '_quota_usage_count', racing_count)
+        self.assertEqual(1, self._usage()['instances'])
+        self.assertEqual([self.project_id], raced)
+
+    def test_instance_calls_keep_usage(self):
+        self._usage()
+        instance = self._create_instance(2)
+        self.assertEqual(1, self._usage()['instances'])
+        self.assertEqual(2, self._usage()['cores'])
+        db.instance_update(self.context, instance['id'], {'vcpus': 4})
+        self.assertEqual(4, self._usage()['cores'])
+        db.instance_destroy(self.context, instance['id'])
+        self.assertEqual(0, self._usage()['instances'])
+        self.assertEqual(0, self._usage()['cores'])
+
+    def test_versioned_update_keeps_cores(self):
+        self._usage()
+        instance = self._create_instance(2)
+        version = db.instance_update(self.context, instance['id'],
+                                     {'vcpus': 4}, instance['version'])
+        self.assertEqual(4, self._usage()['cores'])
+        self.assertRaises(exception.UpdateConflict, db.instance_update,
+                          self.context, instance['id'], {'vcpus': 8},
+                          instance['version'])
+        self.assertEqual(4, self._usage()['cores'])
+        db.instance_update(self.context, instance['id'], {'vcpus': 1},
+                           version)
+        self.assertEqual(1, self._usage()['cores'])
+        db.instance_destroy(self.context, instance['id'])
+        self.assertEqual(0, self._usage()['cores'])
+
+    def test_floating_ip_allocation_keeps_usage(self):
+        self._usage()
+        db.floating_ip_create(self.context, {'address': '10.0.0.1',
+                                             'host': 'host1'})
+        address = db.floating_ip_allocate_address(self.context, 'host1',
+                                                  self.project_id)
+        self.assertEqual(1, self._usage()['floating_ips'])
+        db.floating_ip_deallocate(self.context, address)
+        self.assertEqual(0, self._usage()['floating_ips'])
+
+    def test_floating_ip_claim_rolls_back_with_usage(self):
+        self._usage()
+        db.floating_ip_create(self.context, {'address': '10.0.0.1',
+                                             'host': 'host1'})
+
+        def failing_adjust(session, project_id, deltas):
+            raise exception.DBError(Exception('lost connection'))
+
+        self.stubs.Set(sqlalchemy_api, '_quota_usage_adjust', failing_adjust)
+        self.assertRaises(exception.DBError,
+                          db.floating_ip_allocate_address, self.context,
+                          'host1', self.project_id)
+        floating_ip = db.floating_ip_get_by_address(self.context, '10.0.0.1')
+        self.assertEqual(None, floating_ip['project_id'])
+
+    def test_refresh_recounts(self):
+        self._usage()
+        instance = self._create_instance(2)
+        usages = models.QuotaUsage.__table__
+        session = sqlalchemy_session.get_session()
+        session.execute(usages.update().values(in_use=7))
+        db.quota_usage_refresh(self.context, self.project_id)
+        self.assertEqual(1, self._usage()['instances'])
+        self.assertEqual(2, self._usage()['cores'])
+
+    def test_reserve_and_commit(self):
+        reservations = db.quota_reserve(self.context, self.project_id,
+                                        {'instances': 2, 'cores': 4},
+                                        self.limits)
+        self.assertEqual(2, len(reservations))
+        self.assertEqual(2, self._reserved()['instances'])
+        self.assertEqual(4, self._reserved()['cores'])
+        self._create_instance(2)
+        self._create_instance(2)
+        db.reservation_commit(self.context, reservations)
+        self.assertEqual(0, self._reserved()['instances'])
+        self.assertEqual(0, self._reserved()['cores'])
+        self.assertEqual(2, self._usage()['instances'])
+        self.assertEqual(4, self._usage()['cores'])
+
+    def test_reserve_and_rollback(self):
+        reservations = db.quota_reserve(self.context, self.project_id,
+                                        {'instances': 1, 'cores': 2},
+                                        self.limits)
+        db.reservation_rollback(self.context, reservations)
+        self.assertEqual(0, self._reserved()['instances'])
+        self.assertEqual(0, self._reserved()['cores'])
+        self.assertEqual(0, self._usage()['instances'])
+
+    def test_reserve_counts_usage_and_reservations(self):
+        self._create_instance(4)
+        db.quota_reserve(self.context, self.project_id, {'cores': 3},
+                         self.limits)
+        self.assertRaises(exception.OverQuota, db.quota_reserve,
+                          self.context, self.project_id,
+                          {'instances': 1, 'cores': 2}, self.limits)
+        self.assertEqual(0, self._reserved()['instances'])
+        self.assertEqual(3, self._reserved()['cores'])
+        db.quota_reserve(self.context, self.project_id, {'cores': 1},
+                         self.limits)
+        db.quota_reserve(self.context, self.project_id, {'cores': 100},
+                         {'cores': -1})
+
+    def test_reserve_unknown_resource(self):
+        self.assertRaises(exception.InvalidInput, db.quota_reserve,
+                          self.context, self.project_id, {'widgets': 1},
+                          self.limits)
+
+    def test_expire(self):
+        now = datetime.datetime.utcnow()
+        db.quota_reserve(self.context, self.project_id, {'instances': 1},
+                         self.limits, now - datetime.timedelta(seconds=1))
+        kept = db.quota_reserve(self.context, self.project_id,
+                                {'instances': 2}, self.limits,
+                                now + datetime.timedelta(hours=1))
+        self.assertEqual(1, db.reservation_expire(self.context))
+        self.assertEqual(2, self._reserved()['instances'])
+        db.reservation_rollback(self.context, kept)
+        self.assertEqual(0, db.reservation_expire(self.context))
+        self.assertEqual(0, self._reserved()['instances'])
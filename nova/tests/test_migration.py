@@ -0,0 +1,36 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for creating the schema from the models instead of migrating."""
+
+from nova import context
+from nova import db
+from nova import test
+from nova.db import migration
+from nova.db.sqlalchemy import defaults
+
+
+class MigrationTestCase(test.TestCase):
+    """Test the schema created from the models against the migrations."""
+
+    def test_models_match_migrations(self):
+        self.assertEqual([], migration.db_check())
+
+    def test_created_db_is_seeded(self):
+        instance_types = db.instance_type_get_all(context.get_admin_context())
+        self.assertEqual(sorted(defaults.DEFAULT_INSTANCE_TYPES),
+                         sorted(instance_types))
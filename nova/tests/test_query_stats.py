@@ -0,0 +1,97 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from nova import context
+from nova import db
+from nova import flags
+from nova import test
+from nova.db.sqlalchemy import query_stats
+from nova.db.sqlalchemy import session as db_session
+
+
+FLAGS = flags.FLAGS
+flags.DECLARE('sql_query_stats', 'nova.db.api')
+flags.DECLARE('sql_slow_query_threshold', 'nova.db.api')
+
+
+class FakeTime(object):
+    """Clock on which every statement takes a quarter of a second."""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        self.now += 0.25
+        return self.now
+
+
+class QueryStatsTestCase(test.TestCase):
+    def setUp(self):
+        super(QueryStatsTestCase, self).setUp()
+        self.flags(sql_query_stats=True)
+        self.context = context.get_admin_context()
+        self.instance_id = db.instance_create(self.context, {})['id']
+        # the engine only gets the proxy when it is created
+        self.stubs.Set(db_session, '_ENGINE', None)
+        self.stubs.Set(db_session, '_MAKER', None)
+        self.stubs.Set(query_stats, 'time', FakeTime())
+        query_stats.reset()
+
+    def tearDown(self):
+        query_stats.reset()
+        super(QueryStatsTestCase, self).tearDown()
+
+    def test_counts_per_function(self):
+        db.instance_get(self.context, self.instance_id)
+        db.instance_get(self.context, self.instance_id)
+        stats = query_stats.get_functions()['instance_get']
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['time'], 0.5)
+
+    def test_counts_per_registered_request(self):
+        query_stats.begin_request(self.context.request_id)
+        db.instance_get(self.context, self.instance_id)
+        stats = query_stats.end_request(self.context.request_id)
+        self.assertEqual(stats['count'], 1)
+        self.assertEqual(stats['functions'], {'instance_get': 1})
+        self.assertEqual(query_stats.end_request(self.context.request_id),
+                         None)
+
+    def test_nested_requests(self):
+        request_id = self.context.request_id
+        query_stats.begin_request(request_id)
+        query_stats.begin_request(request_id)
+        db.instance_get(self.context, self.instance_id)
+        self.assertEqual(query_stats.end_request(request_id)['count'], 1)
+        db.instance_get(self.context, self.instance_id)
+        self.assertEqual(query_stats.end_request(request_id)['count'], 2)
+        self.assertEqual(query_stats.end_request(request_id), None)
+
+    def test_ignores_unregistered_requests(self):
+        db.instance_get(self.context, self.instance_id)
+        self.assertEqual(query_stats.get_request(self.context.request_id),
+                         None)
+
+    def test_logs_slow_statements(self):
+        FLAGS.sql_slow_query_threshold = 0.25
+        logged = []
+        self.stubs.Set(query_stats.LOG, 'warn', logged.append)
+        db.instance_get(self.context, self.instance_id)
+        FLAGS.sql_slow_query_threshold = 0.5
+        db.instance_get(self.context, self.instance_id)
+        self.assertEqual(len(logged), 1)
+        self.assertTrue('instance_get' in logged[0])
@@ -0,0 +1,53 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack LLC.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests for the read-only row records of the SQLAlchemy backend."""
+
+from nova import test
+from nova import utils
+from nova.db.sqlalchemy import records
+
+
+class RecordTestCase(test.TestCase):
+    """Test dict style access to records."""
+
+    def setUp(self):
+        super(RecordTestCase, self).setUp()
+        self.record = records.make_records('TestRecord', ['id', 'name'],
+                                           [(1, 'one'), (2, None)])[0]
+
+    def test_access(self):
+        self.assertEqual(1, self.record['id'])
+        self.assertEqual('one', self.record.name)
+        self.assertEqual('one', self.record.get('name'))
+        self.assertEqual('x', self.record.get('missing', 'x'))
+        self.assertRaises(KeyError, lambda: self.record['missing'])
+        self.assertRaises(AttributeError, lambda: self.record.missing)
+
+    def test_contains_checks_keys(self):
+        self.assertTrue('name' in self.record)
+        self.assertFalse('one' in self.record)
+
+    def test_converts_to_dict(self):
+        self.assertEqual({'id': 1, 'name': 'one'}, dict(self.record))
+        self.assertEqual({'id': 1, 'name': 'one'},
+                         utils.loads(utils.dumps(self.record)))
+
+    def test_classes_are_shared(self):
+        other = records.record_class('TestRecord', ['id', 'name'])
+        self.assertTrue(isinstance(self.record, other))
+        self.assertFalse(hasattr(self.record, '__dict__'))
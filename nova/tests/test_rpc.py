@@ -49,6 +49,18 @@ class RpcTestCase(test.TestCase):
                                                  "args": {"value": value}})
         self.assertEqual(value, result)
 
+    def test_stats(self):
+        """Counts messages sent for a request"""
+        rpc.stats_begin(self.context)
+        rpc.call(self.context, 'test', {"method": "echo",
+                                        "args": {"value": 42}})
+        rpc.cast(self.context, 'test', {"method": "echo",
+                                        "args": {"value": 42}})
+        stats = rpc.stats_end(self.context)
+        self.assertEqual(stats['count'], 2)
+        self.assertEqual(stats['methods'], {'call': 1, 'cast': 1})
+        self.assertEqual(rpc.stats_end(self.context), None)
+
     def test_context_passed(self):
         """Makes sure a context is passed through rpc call"""
         value = 42
@@ -123,3 +123,57 @@ class ServiceTestCase(test.TestCase):
         app.start()
         app.stop()
         self.assert_(app)
+
+
+class ApiServiceTestCase(test.TestCase):
+    """Test cases for the nova-api service"""
+
+    def test_start_reaps_auth_tokens_until_stopped(self):
+        self.flags(auth_token_reap_interval=60)
+        serv = service.ApiService(None, [])
+        serv.start()
+        self.assertEqual(len(serv.timers), 1)
+        serv.stop()
+        self.assertEqual(serv.timers, [])
+
+    def test_wait_waits_for_the_reaper(self):
+        waited = []
+
+        class Waiter(object):
+            def __init__(self, name):
+                self.name = name
+
+            def wait(self):
+                waited.append(self.name)
+
+        serv = service.ApiService(None, [])
+        serv.wsgi_app = Waiter('wsgi')
+        serv.timers.append(Waiter('reaper'))
+        serv.wait()
+        self.assertEqual(waited, ['wsgi', 'reaper'])
+
+    def test_reaping_can_be_disabled(self):
+        self.flags(auth_token_reap_interval=0)
+        serv = service.ApiService(None, [])
+        serv.start()
+        self.assertEqual(serv.timers, [])
+
+    def test_destroy_expired_auth_tokens(self):
+        calls = []
+
+        def fake_destroy_expired(context):
+            calls.append(context)
+            return 2
+
+        self.stubs.Set(db, 'auth_token_destroy_expired',
+                       fake_destroy_expired)
+        service.ApiService(None, []).destroy_expired_auth_tokens()
+        self.assertEqual(len(calls), 1)
+
+    def test_destroy_expired_auth_tokens_survives_errors(self):
+        def fake_destroy_expired(context):
+            raise exception.DBError(Exception('db is gone'))
+
+        self.stubs.Set(db, 'auth_token_destroy_expired',
+                       fake_destroy_expired)
+        service.ApiService(None, []).destroy_expired_auth_tokens()
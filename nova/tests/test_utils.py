@@ -14,6 +14,7 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import datetime
 import os
 import tempfile
 
@@ -275,3 +276,91 @@ class GenericUtilsTestCase(test.TestCase):
         # error case
         result = utils.parse_server_string('www.exa:mple.com:8443')
         self.assertEqual(('', ''), result)
+
+
+class GenerationCacheTestCase(test.TestCase):
+    def setUp(self):
+        super(GenerationCacheTestCase, self).setUp()
+        self.cache = utils.GenerationCache()
+        self.calls = []
+        utils.set_time_override()
+
+    def tearDown(self):
+        utils.clear_time_override()
+        super(GenerationCacheTestCase, self).tearDown()
+
+    def _fetch(self, value):
+        self.calls.append(value)
+        return value
+
+    def test_hit_after_miss(self):
+        self.assertEqual(1, self.cache.get('a', 60, self._fetch, 1))
+        self.assertEqual(1, self.cache.get('a', 60, self._fetch, 2))
+        self.assertEqual([1], self.calls)
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+
+    def test_expires_after_ttl(self):
+        self.cache.get('a', 60, self._fetch, 1)
+        utils.advance_time_seconds(61)
+        self.assertEqual(2, self.cache.get('a', 60, self._fetch, 2))
+
+    def test_zero_ttl_disables(self):
+        self.cache.get('a', 0, self._fetch, 1)
+        self.cache.get('a', 0, self._fetch, 2)
+        self.assertEqual([1, 2], self.calls)
+        self.assertEqual(0, self.cache.stats()['size'])
+
+    def test_invalidate_drops_entries(self):
+        self.cache.get('a', 60, self._fetch, 1)
+        self.cache.invalidate()
+        self.assertEqual(2, self.cache.get('a', 60, self._fetch, 2))
+        self.assertEqual(1, self.cache.stats()['generation'])
+
+    def test_fetch_racing_invalidate_is_not_stored(self):
+        def _fetch_and_invalidate():
+            self.cache.invalidate()
+            return 1
+        self.cache.get('a', 60, _fetch_and_invalidate)
+        self.assertEqual(2, self.cache.get('a', 60, self._fetch, 2))
+
+
+class JSONTestCase(test.TestCase):
+    def test_dumps_datetimes_and_iterables(self):
+        value = {'at': [datetime.datetime(2011, 1, 1, 12, 30)],
+                 'ids': set([1]),
+                 'pair': (1, 2)}
+        self.assertEqual({'at': ['2011-01-01 12:30:00'],
+                          'ids': [1],
+                          'pair': [1, 2]},
+                         utils.loads(utils.dumps(value)))
+
+    def test_dumps_objects_with_iteritems(self):
+        class Model(object):
+            def iteritems(self):
+                return iter([('created_at', datetime.datetime(2011, 1, 1))])
+
+        self.assertEqual({'model': {'created_at': '2011-01-01 00:00:00'}},
+                         utils.loads(utils.dumps({'model': Model()})))
+
+    def test_dumps_falls_back_to_to_primitive(self):
+        class Flavor(object):
+            pass
+
+        def fake_to_primitive(value):
+            if isinstance(value, Flavor):
+                return 'm1.tiny'
+            return value
+
+        self.stubs.Set(utils, 'to_primitive', fake_to_primitive)
+        self.assertEqual('{"flavor": "m1.tiny"}',
+                         utils.dumps({'flavor': Flavor()}))
+
+    def test_dumps_unknown_type_fails(self):
+        self.assertRaises(TypeError, utils.dumps, object())
+
+    def test_dumps_sort_keys(self):
+        value = {'b': 1, 'a': {'d': 2, 'c': 3}}
+        self.assertEqual('{"a": {"c": 3, "d": 2}, "b": 1}',
+                         utils.dumps(value, sort_keys=True))
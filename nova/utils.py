@@ -23,7 +23,6 @@ import base64
 import datetime
 import functools
 import inspect
-import json
 import lockfile
 import netaddr
 import os
@@ -431,6 +430,54 @@ class LazyPluggable(object):
         return getattr(backend, key)
 
 
+class GenerationCache(object):
+    """A process local cache with a time to live and generation counter.
+
+    invalidate() bumps the generation, which drops every entry and keeps
+    values fetched before the bump from being stored after it.
+
+    """
+
+    def __init__(self):
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}
+
+    def get(self, key, ttl, fetch, *args):
+        """Return the value cached for key, calling fetch(*args) on a miss.
+
+        Entries older than ttl seconds are refetched, a ttl of 0 disables
+        caching.
+
+        """
+        entry = self._entries.get(key)
+        if entry and ttl > 0:
+            generation, stored_at, value = entry
+            if (generation == self.generation and
+                not is_older_than(stored_at, ttl)):
+                self.hits += 1
+                return value
+        self.misses += 1
+        generation = self.generation
+        value = fetch(*args)
+        if ttl > 0 and generation == self.generation:
+            self._entries[key] = (generation, utcnow(), value)
+        return value
+
+    def invalidate(self):
+        """Drop every entry and start a new generation."""
+        self.generation += 1
+        self._entries = {}
+
+    def stats(self):
+        """Return a dict of hit, miss and size counters."""
+        return {'generation': self.generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries)}
+
+
 class LoopingCallDone(Exception):
     """Exception to break out and stop a LoopingCall.
 
@@ -532,12 +579,56 @@ def to_primitive(value):
         return value
 
 
-def dumps(value):
-    try:
-        return json.dumps(value)
-    except TypeError:
-        pass
-    return json.dumps(to_primitive(value))
+def _json_default(value):
+    """Encode the values json can not, for dumps.
+
+    Called by the encoder only for values it does not know, so datetimes,
+    models and records nested anywhere in a document are converted in the
+    same single pass that encodes everything else. Anything else gets the
+    conversions of to_primitive before it is refused.
+
+    """
+    if isinstance(value, datetime.datetime):
+        return str(value)
+    elif hasattr(value, 'iteritems'):
+        return dict(value.iteritems())
+    elif hasattr(value, '__iter__'):
+        return list(value)
+    primitive = to_primitive(value)
+    if primitive is not value:
+        return primitive
+    raise TypeError(_('%r is not JSON serializable') % (value,))
+
+
+def set_json_backend(backend):
+    """Use the given json compatible module for dumps and loads."""
+    global json
+    global _json_encoders
+    json = backend
+    _json_encoders = {
+        False: backend.JSONEncoder(default=_json_default),
+        True: backend.JSONEncoder(default=_json_default, sort_keys=True)}
+
+
+def _import_json_backend(names):
+    """Return the first of the named json compatible modules installed."""
+    for name in names:
+        try:
+            __import__(name)
+            return sys.modules[name]
+        except ImportError:
+            pass
+    raise ImportError(_('No JSON library found, tried %s') % names)
+
+
+# simplejson is preferred when installed for its C accelerated encoder
+# and decoder; it has the same interface as the standard library json.
+set_json_backend(_import_json_backend(['simplejson', 'json']))
+
+
+def dumps(value, sort_keys=False):
+    """Encode value as JSON, with sorted keys when it has to be canonical."""
+    return _json_encoders[sort_keys].encode(value)
 
 
 def loads(s):
@@ -19,15 +19,22 @@
 
 """Utility methods for working with WSGI servers."""
 
+import functools
+import hashlib
+import itertools
 import os
+import re
 import sys
-from xml.dom import minidom
+import time
+import weakref
+from xml.parsers import expat
 
 import eventlet
 import eventlet.wsgi
 eventlet.patcher.monkey_patch(all=False, socket=True, time=True)
 import routes
 import routes.middleware
+import routes.util
 import webob
 import webob.dec
 import webob.exc
@@ -41,6 +48,92 @@ from nova import utils
 
 FLAGS = flags.FLAGS
 LOG = logging.getLogger('nova.wsgi')
+flags.DEFINE_boolean('xml_pretty_print', True,
+                     'Indent XML responses; compact XML is smaller and '
+                     'quicker to write')
+flags.DEFINE_integer('xml_max_size', 1024 * 1024,
+                     'Largest XML request body to parse, in bytes')
+flags.DEFINE_integer('xml_max_depth', 32,
+                     'Deepest element nesting allowed in an XML request')
+flags.DEFINE_integer('xml_max_elements', 10000,
+                     'Most elements allowed in an XML request')
+
+
+def add_timing(environ, phase, start):
+    """Add the time since start to a phase of the request's timings.
+
+    Timings are only kept for requests a TimingMiddleware is timing.
+
+    """
+    timings = environ.get('nova.timings')
+    if timings is not None:
+        timings[phase] = timings.get(phase, 0.0) + time.time() - start
+
+
+def timed(phase):
+    """Decorate a method taking a request to time it as phase."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, req, *args, **kwargs):
+            start = time.time()
+            try:
+                return func(self, req, *args, **kwargs)
+            finally:
+                add_timing(req.environ, phase, start)
+        return wrapper
+    return decorator
+
+
+# finish callbacks of the bodies not finished yet, by weakref to the body
+_UNFINISHED_BODIES = {}
+
+
+class FinishingBody(object):
+    """Response body calling finish once it has been sent.
+
+    finish is called once, when the server closes the body after sending
+    it, when the body is read to its end, or when it is dropped without
+    either, so it can end whatever was begun for the request.  It must
+    not hold on to the body or its response.  Subclasses wrap producing
+    each chunk in _next_chunk.
+
+    """
+
+    def __init__(self, app_iter, finish):
+        self.app_iter = app_iter
+        self._ref = weakref.ref(self, _finish_dropped_body)
+        _UNFINISHED_BODIES[self._ref] = finish
+
+    def __iter__(self):
+        chunks = iter(self.app_iter)
+        while True:
+            try:
+                chunk = self._next_chunk(chunks)
+            except StopIteration:
+                self.close()
+                return
+            yield chunk
+
+    def _next_chunk(self, chunks):
+        """Return the next chunk of the body."""
+        return chunks.next()
+
+    def close(self):
+        finish = _UNFINISHED_BODIES.pop(self._ref, None)
+        if finish is None:
+            return
+        try:
+            if hasattr(self.app_iter, 'close'):
+                self.app_iter.close()
+        finally:
+            finish()
+
+
+def _finish_dropped_body(ref):
+    """Call the finish of a body dropped before it was closed."""
+    finish = _UNFINISHED_BODIES.pop(ref, None)
+    if finish is not None:
+        finish()
 
 
 class WritableLogger(object):
@@ -113,6 +206,24 @@ class Request(webob.Request):
         LOG.debug(_("Wrong Content-Type: %s") % type)
         raise webob.exc.HTTPBadRequest("Invalid content type")
 
+    def is_not_modified(self, etag, last_modified=None):
+        """Whether the client already holds the representation described.
+
+        If-None-Match is checked against etag.  If-Modified-Since is only
+        checked when the request has no If-None-Match, as RFC 2616 asks, and
+        when last_modified is known.
+
+        """
+        if self.method not in ('GET', 'HEAD'):
+            return False
+        if 'If-None-Match' in self.headers:
+            return etag in self.if_none_match
+        if last_modified is None or self.if_modified_since is None:
+            return False
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=webob.UTC)
+        return last_modified.replace(microsecond=0) <= self.if_modified_since
+
 
 class Application(object):
     """Base WSGI application wrapper. Subclasses need to implement __call__."""
@@ -278,6 +389,200 @@ class Debug(Middleware):
         print
 
 
+# Marks a route variable when splitting a route path into segments
+_VARIABLE = '\0'
+
+# Requirements that never match across a '/', so they fit in a segment
+_SEGMENT_REQUIREMENTS = re.compile(r'^(\[\^\\?/[^\]]*\]|\\d|\\w|'
+                                   r'\[[\w-]*\])[+*]?\??$')
+
+
+class _RouteNode(object):
+    """A node of a RouteTable's prefix tree."""
+
+    __slots__ = ('static', 'variable', 'routes')
+
+    def __init__(self):
+        self.static = {}
+        self.variable = None
+        self.routes = {}
+
+
+class RouteTable(object):
+    """The routes of a routes.Mapper compiled into a prefix tree.
+
+    Routes are indexed by the '/' separated segments of their path, with
+    any segment holding a variable indexed as a wildcard, and then by the
+    request methods they accept.  Matching walks the tree to find the few
+    routes that could match and only runs the regular expressions of
+    those, in the mapper's order, so the first route routes would have
+    picked still wins.  Routes the tree can not describe, such as those
+    with wildcard or multi segment variables, are tried for every
+    request.
+
+    """
+
+    def __init__(self, mapper):
+        self.mapper = mapper
+        self.size = len(mapper.matchlist)
+        self._root = _RouteNode()
+        self._unindexed = []
+        for index, route in enumerate(mapper.matchlist):
+            if route.static:
+                continue
+            segments = self._segments(route)
+            if segments is None:
+                self._unindexed.append((index, route))
+                continue
+            node = self._root
+            for segment in segments:
+                if _VARIABLE in segment:
+                    if node.variable is None:
+                        node.variable = _RouteNode()
+                    node = node.variable
+                else:
+                    node = node.static.setdefault(segment, _RouteNode())
+            methods = (route.conditions or {}).get('method') or [None]
+            for method in methods:
+                node.routes.setdefault(method, []).append((index, route))
+
+    @staticmethod
+    def supports(mapper):
+        """Whether routes in mapper only depend on the path and method."""
+        return not (mapper.prefix or mapper.sub_domains or mapper.always_scan)
+
+    def _segments(self, route):
+        """Split the path of route into segments, None if it can not be."""
+        if route.minimization:
+            return None
+        path = []
+        for part in route.routelist:
+            if not isinstance(part, dict):
+                path.append(part)
+                continue
+            if part['type'] == '*' or part['name'] == 'controller':
+                return None
+            requirement = route.reqs.get(part['name'])
+            if (requirement is not None and
+                not _SEGMENT_REQUIREMENTS.match(requirement)):
+                return None
+            path.append(_VARIABLE)
+        return ''.join(path).split('/')
+
+    def match(self, url, environ):
+        """Return the match dict and route for url, or (None, None)."""
+        nodes = [self._root]
+        for segment in url.split('/'):
+            children = []
+            for node in nodes:
+                child = node.static.get(segment)
+                if child is not None:
+                    children.append(child)
+                if node.variable is not None:
+                    children.append(node.variable)
+            nodes = children
+            if not nodes:
+                break
+
+        method = environ.get('REQUEST_METHOD')
+        candidates = list(self._unindexed)
+        for node in nodes:
+            candidates.extend(node.routes.get(method, ()))
+            candidates.extend(node.routes.get(None, ()))
+        candidates.sort()
+
+        for index, route in candidates:
+            match = route.match(url, environ)
+            if isinstance(match, dict) or match:
+                return match, route
+        return None, None
+
+
+class RouteDispatcher(object):
+    """WSGI middleware that routes requests like RoutesMiddleware.
+
+    Requests are matched through a RouteTable compiled from the mapper,
+    and recompiled whenever routes are added to it.  Requests that use
+    routes' method override, mappers with a prefix or sub domains, and
+    redirect routes are handed to routes' own RoutesMiddleware.  Like it,
+    it fills in the routes request_config, so url_for works while the
+    request is handled.
+
+    """
+
+    def __init__(self, application, mapper):
+        self.application = application
+        self.mapper = mapper
+        self._fallback = routes.middleware.RoutesMiddleware(application,
+                                                            mapper)
+        self._table = None
+
+    def _get_table(self):
+        mapper = self.mapper
+        table = self._table
+        if (table is None or not mapper._created_regs or
+            table.size != len(mapper.matchlist)):
+            mapper.create_regs()
+            table = self._table = RouteTable(mapper)
+        return table
+
+    def _overrides_method(self, environ):
+        if ('_method' not in environ.get('QUERY_STRING', '') and
+            not (environ['REQUEST_METHOD'] == 'POST' and
+                 routes.middleware.is_form_post(environ))):
+            return False
+        req = webob.Request(environ)
+        req.errors = 'ignore'
+        return '_method' in req.params
+
+    def _set_request_config(self, environ, match, route):
+        """Fill in the routes request_config as RoutesMiddleware does."""
+        config = routes.request_config()
+        # without a mapper, loading the environ sets host and protocol
+        # but does not match the request again
+        config.mapper = None
+        config.environ = environ
+        config.mapper = self.mapper
+        config.mapper_dict = match
+        config.route = route
+        self.mapper.environ = environ
+
+    def __call__(self, environ, start_response):
+        if (not RouteTable.supports(self.mapper) or
+            self._overrides_method(environ)):
+            return self._fallback(environ, start_response)
+
+        start = time.time()
+
+        match, route = self._get_table().match(environ['PATH_INFO'], environ)
+        if route is not None and route.redirect:
+            return self._fallback(environ, start_response)
+
+        self._set_request_config(environ, match, route)
+        url = routes.util.URLGenerator(self.mapper, environ)
+        environ['wsgiorg.routing_args'] = ((url), match or {})
+        environ['routes.route'] = route
+        environ['routes.url'] = url
+
+        if match and 'path_info' in match:
+            oldpath = environ['PATH_INFO']
+            newpath = match.get('path_info') or ''
+            environ['PATH_INFO'] = newpath
+            if not environ['PATH_INFO'].startswith('/'):
+                environ['PATH_INFO'] = '/' + environ['PATH_INFO']
+            environ['SCRIPT_NAME'] += re.sub(r'^(.*?)/' + re.escape(newpath) +
+                                             '$', r'\1', oldpath)
+
+        add_timing(environ, 'routing', start)
+        try:
+            return self.application(environ, start_response)
+        finally:
+            try:
+                del self.mapper.environ
+            except AttributeError:
+                pass
+
+
 class Router(object):
     """WSGI middleware that maps incoming requests to WSGI apps."""
 
@@ -306,8 +611,7 @@ class Router(object):
 
         """
         self.map = mapper
-        self._router = routes.middleware.RoutesMiddleware(self._dispatch,
-                                                          self.map)
+        self._router = RouteDispatcher(self._dispatch, self.map)
 
     @webob.dec.wsgify(RequestClass=Request)
     def __call__(self, req):
@@ -335,20 +639,53 @@ class Router(object):
         return app
 
 
+def make_etag(*parts):
+    """Return a strong entity tag for the representation built from parts.
+
+    The parts are hashed through their JSON encoding with sorted keys, so
+    the tag changes whenever any value in them does, and is the same in
+    every process and with every json backend.
+
+    """
+    return hashlib.md5(utils.dumps(parts, sort_keys=True)).hexdigest()
+
+
+def conditional(func):
+    """Decorate a Controller action to answer conditional GET requests.
+
+    The response carries an ETag hashed from the dict the action returns,
+    and Last-Modified if the action stores a datetime in
+    req.environ['nova.last_modified'].  When If-None-Match or
+    If-Modified-Since show the client already has that representation, it
+    gets 304 Not Modified and the dict is never serialized.  Since the
+    whole dict is encoded first, such actions should return lists rather
+    than lazy iterators.  A JSON response is sent as that encoding, so it
+    is only encoded once.
+
+    """
+    func.conditional = True
+    return func
+
+
 class Controller(object):
     """WSGI app that dispatched to methods.
 
-    WSGI app that reads routing information supplied by RoutesMiddleware
+    WSGI app that reads routing information supplied by RouteDispatcher
     and calls the requested action method upon itself.  All action methods
     must, in addition to their normal parameters, accept a 'req' argument
     which is the incoming wsgi.Request.  They raise a webob.exc exception,
     or return a dict which will be serialized by requested content type.
+    Lists in the dict may be given as iterators, whose items are then only
+    read and serialized as the response is sent.  The status has been sent
+    by then and errors no longer become faults, so reading them should not
+    fail or call the db or other services.  Results without iterators are
+    sent whole, with a Content-Length.
 
     """
 
     @webob.dec.wsgify(RequestClass=Request)
     def __call__(self, req):
-        """Call the method specified in req.environ by RoutesMiddleware."""
+        """Call the method specified in req.environ by RouteDispatcher."""
         arg_dict = req.environ['wsgiorg.routing_args'][1]
         action = arg_dict['action']
         method = getattr(self, action)
@@ -358,16 +695,44 @@ class Controller(object):
         if 'format' in arg_dict:
             del arg_dict['format']
         arg_dict['req'] = req
+        start = time.time()
         result = method(**arg_dict)
+        add_timing(req.environ, 'controller', start)
 
         if type(result) is dict:
             content_type = req.best_match_content_type()
             default_xmlns = self.get_default_xmlns(req)
-            body = self._serialize(result, content_type, default_xmlns)
+            etag = None
+            body = None
+            lazy = _has_lazy(result)
+            start = time.time()
+            if getattr(method, 'conditional', False):
+                encoded = utils.dumps(result, sort_keys=True)
+                etag = make_etag(content_type, default_xmlns, encoded)
+                last_modified = req.environ.get('nova.last_modified')
+                if req.is_not_modified(etag, last_modified):
+                    response = webob.exc.HTTPNotModified()
+                    response.etag = etag
+                    return response
+                if content_type == 'application/json':
+                    body = [encoded]
+            if body is None:
+                body = self._serialize_iter(result, content_type,
+                                            default_xmlns)
+            if not lazy:
+                # sent whole, so the response gets its Content-Length
+                body = ''.join(body)
+            add_timing(req.environ, 'serialization', start)
 
             response = webob.Response()
             response.headers['Content-Type'] = content_type
-            response.body = body
+            if etag is not None:
+                response.etag = etag
+                response.last_modified = last_modified
+            if lazy:
+                response.app_iter = body
+            else:
+                response.body = body
             msg_dict = dict(url=req.url, status=response.status_int)
             msg = _("%(url)s returned with HTTP %(status)d") % msg_dict
             LOG.debug(msg)
@@ -375,6 +740,18 @@ class Controller(object):
         else:
             return result
 
+    def _get_serializer(self, default_xmlns=None):
+        """Return the Serializer for this controller class.
+
+        Uses self._serialization_metadata if it exists, which is a dict mapping
+        MIME types to information needed to serialize to that type.  The
+        serializer is built once per class and namespace and then reused.
+
+        """
+        _metadata = getattr(type(self), '_serialization_metadata', {})
+        return get_serializer((type(self), default_xmlns), _metadata,
+                              default_xmlns)
+
     def _serialize(self, data, content_type, default_xmlns):
         """Serialize the given dict to the provided content_type.
 
@@ -382,14 +759,25 @@ class Controller(object):
         MIME types to information needed to serialize to that type.
 
         """
-        _metadata = getattr(type(self), '_serialization_metadata', {})
-
-        serializer = Serializer(_metadata, default_xmlns)
+        serializer = self._get_serializer(default_xmlns)
         try:
             return serializer.serialize(data, content_type)
         except exception.InvalidContentType:
             raise webob.exc.HTTPNotAcceptable()
 
+    def _serialize_iter(self, data, content_type, default_xmlns):
+        """Serialize the given dict to an iterable of body chunks.
+
+        Like _serialize, but XML is written as the response is sent instead
+        of being built in memory first.
+
+        """
+        serializer = self._get_serializer(default_xmlns)
+        try:
+            return serializer.serialize_iter(data, content_type)
+        except exception.InvalidContentType:
+            raise webob.exc.HTTPNotAcceptable()
+
     def _deserialize(self, data, content_type):
         """Deserialize the request body to the specefied content type.
 
@@ -397,43 +785,138 @@ class Controller(object):
         MIME types to information needed to serialize to that type.
 
         """
-        _metadata = getattr(type(self), '_serialization_metadata', {})
-        serializer = Serializer(_metadata)
-        return serializer.deserialize(data, content_type)
+        serializer = self._get_serializer()
+        try:
+            return serializer.deserialize(data, content_type)
+        except exception.MalformedRequestBody as ex:
+            raise webob.exc.HTTPBadRequest(explanation=str(ex))
 
     def get_default_xmlns(self, req):
         """Provide the XML namespace to use if none is otherwise specified."""
         return None
 
 
+# Serializers shared between requests, see get_serializer
+_SERIALIZERS = {}
+
+
+def get_serializer(key, metadata=None, default_xmlns=None):
+    """Return the Serializer cached under key, creating it on first use.
+
+    key must change whenever metadata or default_xmlns do, since only the
+    first metadata seen for a key is used.
+
+    """
+    try:
+        return _SERIALIZERS[key]
+    except KeyError:
+        serializer = Serializer(metadata, default_xmlns)
+        _SERIALIZERS[key] = serializer
+        return serializer
+
+
+def _is_lazy(value):
+    """Whether value is an iterator whose items are made as it is read.
+
+    Actions may return such iterators in place of lists so their items
+    are built while the response is being sent.  Models are iterators over
+    their columns and are not counted.
+
+    """
+    return hasattr(value, 'next') and not hasattr(value, 'iteritems')
+
+
+def _has_lazy(data):
+    """Whether data, or a dict nested in it, holds a lazy iterator."""
+    if type(data) is not dict:
+        return _is_lazy(data)
+    for value in data.itervalues():
+        if _has_lazy(value):
+            return True
+    return False
+
+
+def _peek(iterator):
+    """Return an iterator over the same items, or [] if it has none."""
+    for first in iterator:
+        return itertools.chain([first], iterator)
+    return []
+
+
+def _compile_xml_metadata(metadata):
+    """Prepare XML serialization metadata for repeated lookups.
+
+    Returns a copy whose attribute names are sets instead of lists.  A
+    single name given as a string is taken as one name, not as letters.
+
+    """
+    compiled = dict(metadata)
+    attributes = {}
+    for nodename, names in metadata.get('attributes', {}).iteritems():
+        if isinstance(names, basestring):
+            names = [names]
+        attributes[nodename] = frozenset(names)
+    compiled['attributes'] = attributes
+    return compiled
+
+
 class Serializer(object):
     """Serializes and deserializes dictionaries to certain MIME types."""
 
-    def __init__(self, metadata=None, default_xmlns=None):
+    # Items of a lazy iterator encoded together into each chunk of JSON
+    json_items_per_chunk = 100
+
+    def __init__(self, metadata=None, default_xmlns=None, pretty=None):
         """Create a serializer based on the given WSGI environment.
 
         'metadata' is an optional dict mapping MIME types to information
-        needed to serialize a dictionary to that type.
+        needed to serialize a dictionary to that type.  'pretty' selects
+        indented or compact XML and defaults to FLAGS.xml_pretty_print.
 
         """
         self.metadata = metadata or {}
         self.default_xmlns = default_xmlns
-
-    def _get_serialize_handler(self, content_type):
-        handlers = {
+        self.pretty = pretty
+        xmldata = self.metadata.get('application/xml', {})
+        self._xml_metadata = _compile_xml_metadata(xmldata)
+        self._plurals = frozenset(xmldata.get('plurals', {}))
+        self._serialize_handlers = {
             'application/json': self._to_json,
             'application/xml': self._to_xml,
         }
+        self._serialize_iter_handlers = {
+            'application/json': self._to_json_iter,
+            'application/xml': self._to_xml_iter,
+        }
+        self._deserialize_handlers = {
+            'application/json': self._from_json,
+            'application/xml': self._from_xml,
+        }
 
+    def _get_serialize_handler(self, content_type):
         try:
-            return handlers[content_type]
-        except Exception:
+            return self._serialize_handlers[content_type]
+        except KeyError:
             raise exception.InvalidContentType(content_type=content_type)
 
     def serialize(self, data, content_type):
         """Serialize a dictionary into the specified content type."""
         return self._get_serialize_handler(content_type)(data)
 
+    def serialize_iter(self, data, content_type):
+        """Serialize a dictionary into an iterable of string chunks.
+
+        Suitable for a response's app_iter: XML, and JSON holding lazy
+        iterators, is generated a chunk at a time as the iterable is
+        consumed.  Iterators in data are only read then.
+
+        """
+        try:
+            handler = self._serialize_iter_handlers[content_type]
+        except KeyError:
+            raise exception.InvalidContentType(content_type=content_type)
+        return handler(data)
+
     def deserialize(self, datastring, content_type):
         """Deserialize a string to a dictionary.
 
@@ -443,113 +926,317 @@ class Serializer(object):
         return self.get_deserialize_handler(content_type)(datastring)
 
     def get_deserialize_handler(self, content_type):
-        handlers = {
-            'application/json': self._from_json,
-            'application/xml': self._from_xml,
-        }
-
         try:
-            return handlers[content_type]
-        except Exception:
+            return self._deserialize_handlers[content_type]
+        except KeyError:
             raise exception.InvalidContentType(content_type=content_type)
 
     def _from_json(self, datastring):
         return utils.loads(datastring)
 
     def _from_xml(self, datastring):
-        xmldata = self.metadata.get('application/xml', {})
-        plurals = set(xmldata.get('plurals', {}))
-        node = minidom.parseString(datastring).childNodes[0]
-        return {node.nodeName: self._from_xml_node(node, plurals)}
+        node = parse_xml(datastring)
+        return {node.name: self._from_xml_node(node, self._plurals)}
 
     def _from_xml_node(self, node, listnames):
-        """Convert a minidom node to a simple Python type.
+        """Convert a parsed XMLElement to a simple Python type.
 
         listnames is a collection of names of XML nodes whose subnodes should
         be considered list items.
 
         """
-        if len(node.childNodes) == 1 and node.childNodes[0].nodeType == 3:
-            return node.childNodes[0].nodeValue
-        elif node.nodeName in listnames:
-            return [self._from_xml_node(n, listnames) for n in node.childNodes]
+        children = node.children
+        if len(children) == 1 and isinstance(children[0], basestring):
+            return children[0]
+        elif node.name in listnames:
+            return [self._from_xml_node(n, listnames) for n in children
+                    if not isinstance(n, basestring)]
         else:
-            result = dict()
-            for attr in node.attributes.keys():
-                result[attr] = node.attributes[attr].nodeValue
-            for child in node.childNodes:
-                if child.nodeType != node.TEXT_NODE:
-                    result[child.nodeName] = self._from_xml_node(child,
-                                                                 listnames)
+            result = dict(node.attributes)
+            for child in children:
+                if not isinstance(child, basestring):
+                    result[child.name] = self._from_xml_node(child,
+                                                             listnames)
             return result
 
     def _to_json(self, data):
         return utils.dumps(data)
 
+    def _to_json_iter(self, data):
+        if not _has_lazy(data):
+            return [self._to_json(data)]
+        return self._json_chunks(data)
+
+    def _json_chunks(self, data):
+        """Yield the JSON for data, reading its lazy iterators as it goes.
+
+        The items of a lazy iterator are encoded a batch at a time, and the
+        text is the same utils.dumps gives once those iterators are lists.
+
+        """
+        parts = []
+        for chunk in self._json_value(parts, data):
+            yield chunk
+        if parts:
+            yield ''.join(parts)
+
+    def _json_value(self, parts, value):
+        """Write one value, yielding after each batch of a lazy iterator."""
+        if type(value) is dict and _has_lazy(value):
+            parts.append('{')
+            for i, (key, item) in enumerate(value.iteritems()):
+                if i:
+                    parts.append(', ')
+                if not isinstance(key, basestring):
+                    key = unicode(key)
+                parts.append('%s: ' % utils.dumps(key))
+                for chunk in self._json_value(parts, item):
+                    yield chunk
+            parts.append('}')
+        elif _is_lazy(value):
+            parts.append('[')
+            separator = ''
+            while True:
+                batch = list(itertools.islice(value,
+                                              self.json_items_per_chunk))
+                if not batch:
+                    break
+                # Encode the batch as a list and keep only its items
+                parts.append(separator + utils.dumps(batch)[1:-1])
+                separator = ', '
+                yield ''.join(parts)
+                del parts[:]
+            parts.append(']')
+        else:
+            parts.append(utils.dumps(value))
+
     def _to_xml(self, data):
-        metadata = self.metadata.get('application/xml', {})
+        return ''.join(self._to_xml_iter(data))
+
+    def _to_xml_iter(self, data):
+        metadata = self._xml_metadata
         # We expect data to contain a single key which is the XML root.
         root_key = data.keys()[0]
-        doc = minidom.Document()
-        node = self._to_xml_node(doc, metadata, root_key, data[root_key])
+        pretty = self.pretty
+        if pretty is None:
+            pretty = FLAGS.xml_pretty_print
+        if pretty:
+            writer = XMLWriter(addindent='    ', newl='\n')
+        else:
+            writer = XMLWriter()
+        return writer.write(metadata, root_key, data[root_key],
+                            self.default_xmlns)
+
+
+class XMLElement(object):
+    """An element of a parsed XML document.
+
+    children holds the child elements and the text between them, with
+    adjacent text joined into one string.
+
+    """
+
+    __slots__ = ('name', 'attributes', 'children')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.children = []
+
+
+def parse_xml(datastring, max_size=None, max_depth=None, max_elements=None):
+    """Parse an XML document into XMLElements and return the root element.
+
+    Elements are built directly from expat's callbacks, and the document
+    is rejected with MalformedRequestBody as soon as it is larger, deeper
+    or has more elements than allowed.  The limits default to
+    FLAGS.xml_max_size, FLAGS.xml_max_depth and FLAGS.xml_max_elements.
+    Documents with a DTD are refused so entities cannot expand the body
+    past those limits.
+
+    """
+    if max_size is None:
+        max_size = FLAGS.xml_max_size
+    if max_depth is None:
+        max_depth = FLAGS.xml_max_depth
+    if max_elements is None:
+        max_elements = FLAGS.xml_max_elements
+
+    if len(datastring) > max_size:
+        reason = _('body is larger than %d bytes') % max_size
+        raise exception.MalformedRequestBody(reason=reason)
+
+    stack = []
+    roots = []
+    counts = {'elements': 0}
+
+    def start_element(name, attributes):
+        counts['elements'] += 1
+        if counts['elements'] > max_elements:
+            reason = _('more than %d elements') % max_elements
+            raise exception.MalformedRequestBody(reason=reason)
+        if len(stack) >= max_depth:
+            reason = _('elements nested deeper than %d') % max_depth
+            raise exception.MalformedRequestBody(reason=reason)
+        element = XMLElement(name, attributes)
+        if stack:
+            stack[-1].children.append(element)
+        else:
+            roots.append(element)
+        stack.append(element)
+
+    def end_element(name):
+        stack.pop()
+
+    def character_data(data):
+        if not stack:
+            return
+        children = stack[-1].children
+        if children and isinstance(children[-1], basestring):
+            children[-1] += data
+        else:
+            children.append(data)
+
+    def doctype(*args):
+        reason = _('document type declarations are not allowed')
+        raise exception.MalformedRequestBody(reason=reason)
+
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    parser.StartElementHandler = start_element
+    parser.EndElementHandler = end_element
+    parser.CharacterDataHandler = character_data
+    parser.StartDoctypeDeclHandler = doctype
+    try:
+        parser.Parse(datastring, True)
+    except expat.ExpatError as ex:
+        raise exception.MalformedRequestBody(reason=str(ex))
+    return roots[0]
+
+
+def _xml_escape(data):
+    """Escape text or an attribute value the way minidom writes it."""
+    data = data.replace('&', '&amp;').replace('<', '&lt;')
+    return data.replace('"', '&quot;').replace('>', '&gt;')
 
-        xmlns = node.getAttribute('xmlns')
-        if not xmlns and self.default_xmlns:
-            node.setAttribute('xmlns', self.default_xmlns)
 
-        return node.toprettyxml(indent='    ')
+class XMLWriter(object):
+    """Writes serialized data as XML without building a DOM.
 
-    def _to_xml_node(self, doc, metadata, nodename, data):
-        """Recursive method to convert data members to XML nodes."""
-        result = doc.createElement(nodename)
+    Follows the same serialization metadata as building a minidom tree
+    did (attributes, plurals, list_collections, dict_collections and
+    xmlns) and writes the same document that tree's toprettyxml, or toxml
+    when no indent is given, would have.  The document is produced as
+    chunks of roughly `parts_per_chunk` tags and values.
 
+    """
+
+    def __init__(self, addindent='', newl='', parts_per_chunk=1024):
+        self.addindent = addindent
+        self.newl = newl
+        self.parts_per_chunk = parts_per_chunk
+
+    def write(self, metadata, nodename, data, default_xmlns=None):
+        """Yield the XML for data as a root node named nodename."""
+        parts = []
+        for chunk in self._node(parts, metadata, nodename, data, '',
+                                default_xmlns):
+            yield chunk
+        if parts:
+            yield ''.join(parts)
+
+    def _open(self, parts, nodename, attrs, indent):
+        parts.append('%s<%s' % (indent, nodename))
+        for name in sorted(attrs):
+            parts.append(' %s="%s"' % (name, _xml_escape(attrs[name])))
+
+    def _text(self, parts, nodename, attrs, text, indent):
+        self._open(parts, nodename, attrs, indent)
+        parts.append('>%s</%s>%s' % (_xml_escape(text), nodename, self.newl))
+
+    def _node(self, parts, metadata, nodename, data, indent,
+              default_xmlns=None):
+        """Write one node, yielding whenever enough parts are pending."""
+        attrs = {}
         # Set the xml namespace if one is specified
         # TODO(justinsb): We could also use prefixes on the keys
         xmlns = metadata.get('xmlns', None)
         if xmlns:
-            result.setAttribute('xmlns', xmlns)
+            attrs['xmlns'] = xmlns
 
-        if type(data) is list:
+        children = []
+        leaves = []
+        if _is_lazy(data):
+            data = _peek(data)
+        if type(data) is list or _is_lazy(data):
             collections = metadata.get('list_collections', {})
             if nodename in collections:
-                metadata = collections[nodename]
-                for item in data:
-                    node = doc.createElement(metadata['item_name'])
-                    node.setAttribute(metadata['item_key'], str(item))
-                    result.appendChild(node)
-                return result
-            singular = metadata.get('plurals', {}).get(nodename, None)
-            if singular is None:
-                if nodename.endswith('s'):
-                    singular = nodename[:-1]
-                else:
-                    singular = 'item'
-            for item in data:
-                node = self._to_xml_node(doc, metadata, singular, item)
-                result.appendChild(node)
+                collection = collections[nodename]
+                leaves = [(collection['item_name'],
+                           {collection['item_key']: str(item)}, None)
+                          for item in data]
+            else:
+                singular = metadata.get('plurals', {}).get(nodename, None)
+                if singular is None:
+                    if nodename.endswith('s'):
+                        singular = nodename[:-1]
+                    else:
+                        singular = 'item'
+                if data:
+                    children = ((singular, item) for item in data)
         elif type(data) is dict:
             collections = metadata.get('dict_collections', {})
             if nodename in collections:
-                metadata = collections[nodename]
+                collection = collections[nodename]
+                leaves = [(collection['item_name'],
+                           {collection['item_key']: str(k)}, str(v))
+                          for k, v in data.items()]
+            else:
+                attributes = metadata.get('attributes', {}).get(nodename, {})
                 for k, v in data.items():
-                    node = doc.createElement(metadata['item_name'])
-                    node.setAttribute(metadata['item_key'], str(k))
-                    text = doc.createTextNode(str(v))
-                    node.appendChild(text)
-                    result.appendChild(node)
-                return result
-            attrs = metadata.get('attributes', {}).get(nodename, {})
-            for k, v in data.items():
-                if k in attrs:
-                    result.setAttribute(k, str(v))
-                else:
-                    node = self._to_xml_node(doc, metadata, k, v)
-                    result.appendChild(node)
+                    if k in attributes:
+                        attrs[k] = str(v)
+                    else:
+                        children.append((k, v))
         else:
             # Type is atom
-            node = doc.createTextNode(str(data))
-            result.appendChild(node)
-        return result
+            if default_xmlns and not attrs.get('xmlns'):
+                attrs['xmlns'] = default_xmlns
+            self._text(parts, nodename, attrs, str(data), indent)
+            return
+
+        if default_xmlns and not attrs.get('xmlns'):
+            attrs['xmlns'] = default_xmlns
+        self._open(parts, nodename, attrs, indent)
+        if not children and not leaves:
+            parts.append('/>%s' % self.newl)
+            return
+        parts.append('>%s' % self.newl)
+
+        newl = self.newl
+        child_indent = indent + self.addindent
+        for name, leaf_attrs, text in leaves:
+            if text is None:
+                self._open(parts, name, leaf_attrs, child_indent)
+                parts.append('/>%s' % newl)
+            else:
+                self._text(parts, name, leaf_attrs, text, child_indent)
+        for name, value in children:
+            if type(value) is list or type(value) is dict or _is_lazy(value):
+                for chunk in self._node(parts, metadata, name, value,
+                                        child_indent):
+                    yield chunk
+            else:
+                child_attrs = {}
+                if xmlns:
+                    child_attrs['xmlns'] = xmlns
+                self._text(parts, name, child_attrs, str(value),
+                           child_indent)
+            if len(parts) >= self.parts_per_chunk:
+                yield ''.join(parts)
+                del parts[:]
+
+        parts.append('%s</%s>%s' % (indent, nodename, newl))
 
 
 def paste_config_file(basename):
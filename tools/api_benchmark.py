@@ -0,0 +1,391 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack, LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+  Micro-benchmarks for the wsgi layer of the API.
+
+  Runs in process without a server or database:
+
+    tools/api_benchmark.py xml_serialize 1000
+    tools/api_benchmark.py xml_deserialize 10000
+    tools/api_benchmark.py json_serialize 1000
+    tools/api_benchmark.py lazy_lists 10000
+    tools/api_benchmark.py routing 100
+"""
+
+import datetime
+import gettext
+import os
+import sys
+import time
+from xml.dom import minidom
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import flags
+from nova import utils
+from nova import wsgi
+from nova.db.sqlalchemy import records
+
+FLAGS = flags.FLAGS
+
+# The serialization metadata of the servers controller
+_SERVER_METADATA = {
+    'application/xml': {
+        'attributes': {
+            'server': ['id', 'imageId', 'name', 'flavorId', 'hostId',
+                       'status', 'progress', 'adminPass', 'flavorRef',
+                       'imageRef'],
+            'link': ['rel', 'type', 'href'],
+        },
+        'dict_collections': {
+            'metadata': {'item_name': 'meta', 'item_key': 'key'},
+        },
+        'list_collections': {
+            'public': {'item_name': 'ip', 'item_key': 'addr'},
+            'private': {'item_name': 'ip', 'item_key': 'addr'},
+        },
+    },
+}
+
+
+def _timed(label, count, f, *args, **kwargs):
+    """Run f and print its wall time and per item cost."""
+    start = time.time()
+    result = f(*args, **kwargs)
+    elapsed = time.time() - start
+    print "%-32s %8d %10.3fs %10.1fus/item" % (label, count, elapsed,
+                                              elapsed * 1e6 / max(count, 1))
+    return result
+
+
+def _server(i):
+    """Build the servers/detail view of server i."""
+    return {'id': i,
+            'name': 'server-%d' % i,
+            'imageId': 3,
+            'flavorId': 1,
+            'hostId': 'e4d909c290d0fb1ca068ffaddf22cbd0',
+            'status': 'ACTIVE',
+            'progress': 100,
+            'addresses': {'public': ['1.2.%d.%d' % (i / 250, i % 250)],
+                          'private': ['10.0.%d.%d' % (i / 250, i % 250)]},
+            'metadata': {'role': 'web', 'owner': 'ops'}}
+
+
+def _servers_detail(count):
+    """Build a servers/detail response body for count servers."""
+    return {'servers': [_server(i) for i in xrange(count)]}
+
+
+def _instance_list(count):
+    """Build an instance list as instance_get_all_records returns it."""
+    fields = ('id', 'created_at', 'updated_at', 'deleted_at', 'deleted',
+              'hostname', 'host', 'project_id', 'user_id', 'image_id',
+              'state', 'state_description', 'launched_at', 'vcpus',
+              'memory_mb', 'display_name', 'metadata')
+    instance = records.record_class('Instance', fields)
+    now = datetime.datetime(2011, 6, 1, 12, 0, 0)
+    return {'instances': [instance((i, now, now, None, False,
+                                    'server-%d' % i, 'compute1', 'proj',
+                                    'user', 'ami-00000003', 1, 'running',
+                                    now, 1, 512, 'Server %d' % i,
+                                    [{'key': 'role', 'value': 'web'}]))
+                          for i in xrange(count)]}
+
+
+def _double_dumps(value):
+    """Encode value the way utils.dumps used to, retrying on TypeError."""
+    try:
+        return utils.json.dumps(value)
+    except TypeError:
+        pass
+    return utils.json.dumps(utils.to_primitive(value))
+
+
+def _route_requests(mapper):
+    """Build a request path and method for every route of mapper."""
+    requests = []
+    for route in mapper.matchlist:
+        if route.static:
+            continue
+        path = []
+        for part in route.routelist:
+            if not isinstance(part, dict):
+                path.append(part)
+            elif part['name'] == 'format':
+                path.append('json')
+            else:
+                path.append('1')
+        methods = (route.conditions or {}).get('method') or ['GET']
+        requests.append((''.join(path), methods[0]))
+    return requests
+
+
+# A server create request with metadata and personality
+_SERVER_CREATE = """<?xml version="1.0" encoding="UTF-8"?>
+<server xmlns="http://docs.rackspacecloud.com/servers/api/v1.0"
+        name="new-server-test" imageId="1" flavorId="1">
+  <metadata>
+    <meta key="My Server Name">Apache1</meta>
+    <meta key="role">web</meta>
+    <meta key="owner">ops</meta>
+  </metadata>
+  <personality>
+    <file path="/etc/banner.txt">
+        ICAgICAgDQoiQSBjbG91ZCBkb2VzIG5vdCBrbm93IHdoeSBp
+        dCBtb3ZlcyBpbiBqdXN0IHN1Y2ggYSBkaXJlY3Rpb24gYW5k
+    </file>
+    <file path="/root/.ssh/authorized_keys">c3NoLXJzYSBBQUFB</file>
+  </personality>
+</server>"""
+
+
+def _minidom_from_xml(datastring, plurals):
+    """Deserialize by building a minidom tree, as wsgi used to."""
+
+    def _node(node):
+        if len(node.childNodes) == 1 and node.childNodes[0].nodeType == 3:
+            return node.childNodes[0].nodeValue
+        elif node.nodeName in plurals:
+            return [_node(n) for n in node.childNodes
+                    if n.nodeType != node.TEXT_NODE]
+        result = dict()
+        for attr in node.attributes.keys():
+            result[attr] = node.attributes[attr].nodeValue
+        for child in node.childNodes:
+            if child.nodeType != node.TEXT_NODE:
+                result[child.nodeName] = _node(child)
+        return result
+
+    node = minidom.parseString(datastring).childNodes[0]
+    return {node.nodeName: _node(node)}
+
+
+def _minidom_xml(metadata, data, pretty):
+    """Serialize data by building a minidom tree, as wsgi used to."""
+
+    def _node(doc, metadata, nodename, data):
+        result = doc.createElement(nodename)
+        if type(data) is list:
+            collections = metadata.get('list_collections', {})
+            if nodename in collections:
+                metadata = collections[nodename]
+                for item in data:
+                    node = doc.createElement(metadata['item_name'])
+                    node.setAttribute(metadata['item_key'], str(item))
+                    result.appendChild(node)
+                return result
+            singular = metadata.get('plurals', {}).get(nodename, None)
+            if singular is None:
+                singular = nodename.endswith('s') and nodename[:-1] or 'item'
+            for item in data:
+                result.appendChild(_node(doc, metadata, singular, item))
+        elif type(data) is dict:
+            collections = metadata.get('dict_collections', {})
+            if nodename in collections:
+                metadata = collections[nodename]
+                for k, v in data.items():
+                    node = doc.createElement(metadata['item_name'])
+                    node.setAttribute(metadata['item_key'], str(k))
+                    node.appendChild(doc.createTextNode(str(v)))
+                    result.appendChild(node)
+                return result
+            attrs = metadata.get('attributes', {}).get(nodename, {})
+            for k, v in data.items():
+                if k in attrs:
+                    result.setAttribute(k, str(v))
+                else:
+                    result.appendChild(_node(doc, metadata, k, v))
+        else:
+            result.appendChild(doc.createTextNode(str(data)))
+        return result
+
+    root_key = data.keys()[0]
+    node = _node(minidom.Document(), metadata.get('application/xml', {}),
+                 root_key, data[root_key])
+    if pretty:
+        return node.toprettyxml(indent='    ')
+    return node.toxml()
+
+
+class Benchmarks(object):
+    """Benchmarks runnable by name from the command line."""
+
+    def xml_serialize(self, servers='1000', repeat='5'):
+        """Serialize servers/detail as XML with minidom and streaming
+        arguments: [servers] [repeat]"""
+        data = _servers_detail(int(servers))
+        repeat = int(repeat)
+        count = int(servers) * repeat
+
+        for pretty in (True, False):
+            mode = pretty and 'pretty' or 'compact'
+            serializer = wsgi.Serializer(_SERVER_METADATA, pretty=pretty)
+
+            def _minidom():
+                for i in xrange(repeat):
+                    body = _minidom_xml(_SERVER_METADATA, data, pretty)
+                return body
+
+            def _streaming():
+                for i in xrange(repeat):
+                    chunks = list(serializer.serialize_iter(
+                            data, 'application/xml'))
+                return chunks
+
+            expected = _timed('minidom (%s)' % mode, count, _minidom)
+            chunks = _timed('streaming (%s)' % mode, count, _streaming)
+            assert ''.join(chunks) == expected
+            print "%-32s %8d chunks, largest %d bytes" % (
+                    '', len(chunks), max([len(chunk) for chunk in chunks]))
+
+    def xml_deserialize(self, requests='10000'):
+        """Deserialize XML server create requests with minidom and expat
+        arguments: [requests]"""
+        requests = int(requests)
+        plurals = set(['personality'])
+        serializer = wsgi.Serializer({'application/xml':
+                                      {'plurals': {'personality': 'file'}}})
+
+        def _minidom():
+            for i in xrange(requests):
+                body = _minidom_from_xml(_SERVER_CREATE, plurals)
+            return body
+
+        def _expat():
+            for i in xrange(requests):
+                body = serializer.deserialize(_SERVER_CREATE,
+                                              'application/xml')
+            return body
+
+        expected = _timed('minidom', requests, _minidom)
+        body = _timed('expat', requests, _expat)
+        assert body == expected
+
+        def _parse_only():
+            for i in xrange(requests):
+                wsgi.parse_xml(_SERVER_CREATE)
+
+        _timed('parse_xml', requests, _parse_only)
+
+
+    def json_serialize(self, instances='1000', repeat='5'):
+        """Encode and decode an instance list as JSON
+        arguments: [instances] [repeat]"""
+        data = _instance_list(int(instances))
+        repeat = int(repeat)
+        count = int(instances) * repeat
+        print 'backend: %s' % utils.json.__name__
+
+        def _run(dumps):
+            for i in xrange(repeat):
+                body = dumps(data)
+            return body
+
+        expected = _timed('to_primitive and retry', count, _run,
+                          _double_dumps)
+        body = _timed('dumps', count, _run, utils.dumps)
+        assert utils.loads(body) == utils.loads(expected)
+
+        def _loads():
+            for i in xrange(repeat):
+                utils.loads(body)
+
+        _timed('loads', count, _loads)
+
+
+    def lazy_lists(self, servers='10000'):
+        """Serialize servers/detail built as a list and as an iterator
+        arguments: [servers]"""
+        count = int(servers)
+        serializer = wsgi.Serializer(_SERVER_METADATA, pretty=False)
+
+        for content_type in ('application/json', 'application/xml'):
+            for name in ('list', 'iterator'):
+                start = time.time()
+                if name == 'list':
+                    data = _servers_detail(count)
+                else:
+                    data = {'servers': (_server(i) for i in xrange(count))}
+                chunks = iter(serializer.serialize_iter(data, content_type))
+                size = len(chunks.next())
+                first = time.time() - start
+                for chunk in chunks:
+                    size += len(chunk)
+                elapsed = time.time() - start
+                print "%-32s %8d %10.3fs first chunk %8.3fs, %d bytes" % (
+                        '%s %s' % (content_type, name), count, elapsed,
+                        first, size)
+
+    def routing(self, repeat='100'):
+        """Match a request for every OpenStack API route with routes and
+        with the compiled route table
+        arguments: [repeat]"""
+        from nova.api import openstack
+
+        repeat = int(repeat)
+        for router in (openstack.APIRouterV10(), openstack.APIRouterV11()):
+            mapper = router.map
+            mapper.create_regs()
+            table = wsgi.RouteTable(mapper)
+            requests = _route_requests(mapper)
+            environs = [{'REQUEST_METHOD': method, 'PATH_INFO': path}
+                        for path, method in requests]
+            count = len(requests) * repeat
+            name = router.__class__.__name__
+
+            def _routes():
+                for i in xrange(repeat):
+                    results = [mapper.routematch(environ['PATH_INFO'],
+                                                 environ)
+                               for environ in environs]
+                return results
+
+            def _table():
+                for i in xrange(repeat):
+                    results = [table.match(environ['PATH_INFO'], environ)
+                               for environ in environs]
+                return results
+
+            expected = _timed('%s routes' % name, count, _routes)
+            results = _timed('%s route table' % name, count, _table)
+            assert results == [tuple(result) for result in expected]
+
+
+
+def main():
+    argv = FLAGS(sys.argv)
+    benchmarks = Benchmarks()
+    if len(argv) < 2 or not hasattr(benchmarks, argv[1]):
+        print __doc__
+        for name in sorted(dir(benchmarks)):
+            if not name.startswith('_'):
+                doc = getattr(benchmarks, name).__doc__.splitlines()[0]
+                print '    %-16s %s' % (name, doc)
+        sys.exit(2)
+    getattr(benchmarks, argv[1])(*argv[2:])
+
+
+if __name__ == '__main__':
+    main()
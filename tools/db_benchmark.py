@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright 2011 OpenStack, LLC
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+  Micro-benchmarks for nova.db calls.
+
+  Runs against a scratch sqlite database unless --sql_connection is given:
+
+    tools/db_benchmark.py ip_range 10.0.0.0/16
+"""
+
+import gettext
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+
+import eventlet
+import IPy
+from eventlet import tpool
+
+POSSIBLE_TOPDIR = os.path.normpath(os.path.join(os.path.abspath(sys.argv[0]),
+                                   os.pardir,
+                                   os.pardir))
+if os.path.exists(os.path.join(POSSIBLE_TOPDIR, 'nova', '__init__.py')):
+    sys.path.insert(0, POSSIBLE_TOPDIR)
+
+gettext.install('nova', unicode=1)
+
+from nova import context
+from nova import db
+from nova import flags
+from nova.db import migration
+
+FLAGS = flags.FLAGS
+
+
+def _timed(label, count, f, *args, **kwargs):
+    """Run f and print its wall time and per item cost."""
+    start = time.time()
+    result = f(*args, **kwargs)
+    elapsed = time.time() - start
+    print "%-32s %8d %10.3fs %10.1fus/item" % (label, count, elapsed,
+                                              elapsed * 1e6 / max(count, 1))
+    return result
+
+
+class Benchmarks(object):
+    """Benchmarks runnable by name from the command line."""
+
+    def ip_range(self, cidr='10.0.0.0/16', sample='2048'):
+        """Create fixed and floating ips for a range, per row and in bulk
+        arguments: [cidr] [sample]"""
+        ctxt = context.get_admin_context()
+        addresses = [str(address) for address in IPy.IP(cidr)]
+        sample = min(int(sample), len(addresses))
+
+        def _per_row(create, prefix):
+            for address in addresses[:sample]:
+                create(ctxt, {'address': prefix + address})
+
+        _timed('fixed_ip_create (sample)', sample,
+               _per_row, db.fixed_ip_create, 'row-')
+        _timed('fixed_ip_bulk_create', len(addresses),
+               db.fixed_ip_bulk_create, ctxt,
+               [{'address': address} for address in addresses])
+        _timed('floating_ip_create (sample)', sample,
+               _per_row, db.floating_ip_create, 'row-')
+        _timed('floating_ip_bulk_create', len(addresses),
+               db.floating_ip_bulk_create, ctxt,
+               [{'address': address, 'host': 'bench'}
+                for address in addresses])
+        _timed('floating_ip_bulk_destroy', len(addresses),
+               db.floating_ip_bulk_destroy, ctxt, addresses)
+
+    def allocate(self, threads='50', addresses='1024'):
+        """Allocate fixed ips from many green threads at once
+        arguments: [threads] [addresses]"""
+        ctxt = context.get_admin_context()
+        addresses = int(addresses)
+        prefix = 32 - int(math.ceil(math.log(addresses, 2)))
+        network = IPy.IP('10.0.0.0/%d' % prefix)
+        network_ref = db.network_create_safe(ctxt, {'cidr': str(network)})
+        db.fixed_ip_bulk_create(ctxt, [{'address': str(address),
+                                        'network_id': network_ref['id']}
+                                       for address in network])
+        instance_ids = [db.instance_create(ctxt, {})['id']
+                        for i in xrange(addresses)]
+        allocated = []
+
+        def _allocate(instance_id):
+            # run the db call in a real thread so allocators race
+            allocated.append(tpool.execute(db.fixed_ip_associate_pool,
+                                           ctxt,
+                                           network_ref['id'],
+                                           instance_id))
+
+        def _allocate_all():
+            pool = eventlet.GreenPool(int(threads))
+            for instance_id in instance_ids:
+                pool.spawn_n(_allocate, instance_id)
+            pool.waitall()
+
+        _timed('fixed_ip_associate_pool x%s' % threads, len(instance_ids),
+               _allocate_all)
+        print "allocated %d, duplicates %d" % (len(allocated),
+                                               len(allocated) -
+                                               len(set(allocated)))
+
+    def security_group_rules(self, instances='1000', groups='50',
+                             groups_per_instance='3'):
+        """Fetch the rules of every instance on a host, per instance and
+        in one set based call
+        arguments: [instances] [groups] [groups_per_instance]"""
+        ctxt = context.get_admin_context()
+        group_ids = []
+        for i in xrange(int(groups)):
+            group_id = db.security_group_create(ctxt,
+                                                {'name': 'group-%d' % i,
+                                                 'project_id': 'bench'})['id']
+            for port in xrange(5):
+                db.security_group_rule_create(ctxt,
+                                              {'parent_group_id': group_id,
+                                               'protocol': 'tcp',
+                                               'from_port': port,
+                                               'to_port': port,
+                                               'cidr': '10.0.0.0/8'})
+            group_ids.append(group_id)
+        instance_ids = []
+        for i in xrange(int(instances)):
+            instance_id = db.instance_create(ctxt, {'host': 'bench'})['id']
+            for group_id in random.sample(group_ids,
+                                          int(groups_per_instance)):
+                db.instance_add_security_group(ctxt, instance_id, group_id)
+            instance_ids.append(instance_id)
+
+        def _per_instance():
+            rules = {}
+            for instance_id in instance_ids:
+                rules[instance_id] = [rule
+                        for group in db.security_group_get_by_instance(
+                                ctxt, instance_id)
+                        for rule in group['rules']]
+            return rules
+
+        per_instance = _timed('security_group_get_by_instance',
+                              len(instance_ids), _per_instance)
+        by_host = _timed('rule_get_by_instances (host)', len(instance_ids),
+                         db.security_group_rule_get_by_instances, ctxt,
+                         host='bench')
+        by_ids = _timed('rule_get_by_instances (ids)', len(instance_ids),
+                        db.security_group_rule_get_by_instances, ctxt,
+                        instance_ids)
+        for rules in (by_host, by_ids):
+            assert sorted(rules) == sorted(per_instance)
+            for instance_id, instance_rules in rules.iteritems():
+                assert (sorted([rule['id'] for rule in instance_rules]) ==
+                        sorted([rule['id']
+                                for rule in per_instance[instance_id]]))
+
+
+def main():
+    argv = sys.argv
+    if not [arg for arg in argv if arg.startswith('--sql_connection')]:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+        argv = argv + ['--sql_connection=sqlite:///%s' % path]
+    argv = FLAGS(argv)
+    benchmarks = Benchmarks()
+    if len(argv) < 2 or not hasattr(benchmarks, argv[1]):
+        print __doc__
+        for name in sorted(dir(benchmarks)):
+            if not name.startswith('_'):
+                doc = getattr(benchmarks, name).__doc__.splitlines()[0]
+                print '    %-16s %s' % (name, doc)
+        sys.exit(2)
+    migration.db_sync()
+    getattr(benchmarks, argv[1])(*argv[2:])
+
+
+if __name__ == '__main__':
+    main()